@@ -199,6 +199,12 @@ load-data)
     echo
 ;;
 
+provision-tags)
+    echo "==> Provisioning the TE community tags of peering-manager peers and locations in netbox"
+    docker exec salt-master provision_tags.py -c
+    echo "==> Done"
+;;
+
 vmx-license-install)
     for r in ${VMXS}
     do
@@ -228,6 +234,7 @@ router-check)
     echo "  vmx-license-install: install a vmx license to the vmx containers"
     echo "  router-check: check proper startup of Juniper routers in the topology"
     echo "  load-data: load data in sources of truth (netbox, peering-manager)"
+    echo "  provision-tags: create the missing TE community tags of peers and locations in netbox"
     echo "  start-routers: start the router containers (Juniper vMX)"
     echo "  start-salt: start salt containers (master and proxies)"
     echo "  start-sot: start the sources of truth (netbox, peering-manager)"
@@ -0,0 +1,1697 @@
+# -*- coding: utf-8 -*-
+
+"""
+Salt execution module for the bgp-te-tool states.
+
+It renders the JunOS configuration of the bgp-announcements and ebgp-peerings
+states as fragments: one per BGP group, per export policy, per community
+block and per announcement family / route type. The rendered text of every
+fragment is cached under a hash of its input data and of the sources of the
+state's config.j2 and lib.j2 templates (plus any custom policy template).
+Only the fragments whose hash is not in the cache are rendered, in a single
+template render, and the configuration is stitched together from the
+fragments.
+
+The cache is kept in memory (the proxy minions are long running processes)
+and on disk under the bgpte:cache_dir directory (default: <cachedir>/bgpte).
+The disk cache is pruned of the fragments not used for FRAGMENT_MAX_AGE.
+
+The configuration can be loaded as whole replace groups in text (output
+"replace") or XML (output "xml") format, or as the set / delete commands
+between the last committed and the rendered configuration (output "set").
+The XML and set outputs are produced by the junos_config utils module.
+
+After a successful commit, the hash of the rendered configuration of a state
+is recorded per minion, together with the latest entry of the device commit
+history. When a later render has the same hash and the device commit history
+has not moved, the configuration load and compare on the device is skipped.
+
+A configuration is rendered as a stream of chunks (bgpte.render_iter): the
+cached fragments, indented one at a time. With stream=True, apply writes
+the chunks to a spool file that is loaded on the device, instead of
+joining and indenting the whole configuration in memory. The fragments of
+a streamed render are not kept in the memory cache either, they are read
+back from the disk cache one at a time.
+
+Several states can be applied in a single transaction: their configurations
+are loaded in the same candidate and committed once, so a failure of either
+leaves the device untouched.
+
+Every committed apply is kept in a content addressed store (the
+config_store utils module): the configurations are split in fragments
+stored once across routers and applies, plus a manifest per minion and
+apply. bgpte.history lists the applies, bgpte.rollback loads a previous one.
+
+The templates are rendered with a jinja2 environment kept per state for the
+life of the proxy minion process, so lib.j2 and config.j2 are compiled once
+and not on every render. The environment is rebuilt when the hash of any
+template of the state changes on the master. The hashes are fetched once
+for the environment key and the fragment keys, and reused for
+TEMPLATE_HASH_TTL seconds, so a render within that time makes no request
+to the master's file server. The compiled templates are also
+kept in a jinja2 bytecode cache on disk, validated against the template
+source checksum, so a restarted proxy minion (or another proxy minion
+sharing the directory) does not compile them again.
+
+Blackholes (RTBH) and the communities of a single announcement take a
+fast path: bgpte.blackhole commits a discard static route tagged with the
+blackhole community (see the rtbh utils module), bgpte.set_communities
+the community list of an announcement route (see the announcement_te
+utils module), as a few set commands, with no render of the states and no
+configuration compare. The applied records follow that commit, so the
+next apply of the states does not see it as a drift, except the
+bgp-announcements record after bgpte.set_communities: the route it records
+is not the one on the device anymore, so it is dropped and the next apply
+loads and compares the state.
+
+Configuration options (minion / proxy config or pillar):
+
+  bgpte:cache_dir: base directory of the bgpte caches
+  bgpte:store_dir: directory of the applied configuration store
+                   (default: <cache_dir>/store). Share it between the proxy
+                   minions to deduplicate fragments across routers.
+  bgpte:jinja_cache_dir: directory of the jinja2 bytecode cache
+                         (default: <cache_dir>/jinja). Share it between the
+                         proxy minions of a host.
+
+CLI examples:
+
+  salt vmx1-lab bgpte.render ebgp-peerings
+  salt vmx1-lab bgpte.apply ebgp-peerings test=True
+  salt vmx1-lab bgpte.apply bgp-announcements,ebgp-peerings
+  salt vmx1-lab bgpte.blackhole 100.64.1.1/32
+  salt vmx1-lab bgpte.set_communities 100.65.0.0/16 '[65000:3:1999, 65000:62:65100]'
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections.abc import Mapping
+
+import jinja2
+import salt.utils.jinja
+import salt.utils.network  # registers the is_ipv4 / is_ipv6 jinja filters
+from salt.utils.decorators.jinja import JinjaFilter, JinjaGlobal, JinjaTest
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = "bgpte"
+
+#----------------- Global settings -------------------
+# State templates: the full template plus the library and settings templates
+# that fragments depend on
+GROUPS = {
+    "ebgp-peerings": {
+        "template": "ebgp-peerings/templates/peerings.j2",
+        "sources": ["ebgp-peerings/templates/config.j2",
+                    "ebgp-peerings/templates/lib.j2"],
+    },
+    "bgp-announcements": {
+        "template": "bgp-announcements/templates/announcements.j2",
+        "sources": ["bgp-announcements/templates/config.j2",
+                    "bgp-announcements/templates/lib.j2"],
+    },
+}
+CUSTOM_POLICY_DIR = "ebgp-peerings/templates/"
+# Out policy actions per peer ASN and per location (large community data1)
+PEER_ACTIONS = ["40", "41", "61", "62", "63"]
+LOCATION_ACTIONS = ["400", "601", "602", "603"]
+FRAGMENT_SEPARATOR = "#@bgpte-fragment@#"
+# Batch templates: each renders a list of fragments of a state, separated by
+# FRAGMENT_SEPARATOR lines
+BATCH_TEMPLATES = {
+    "ebgp-peerings": """
+{%- import "ebgp-peerings/templates/config.j2" as conf -%}
+{%- import "ebgp-peerings/templates/lib.j2" as lib -%}
+{%- for f in fragments %}
+{{ separator }}
+    {%- if f['kind'] == 'settings' %}
+{{ {'local_asn': conf.local_asn, 'geolocations': conf.geolocations, 'prune_unused_policy_actions': conf.prune_unused_policy_actions} | json }}
+    {%- elif f['kind'] == 'group' %}
+{{ lib.gen_junos_ebgp_groups([f['data']['group']], [], f['data']['location']) }}
+    {%- elif f['kind'] == 'policy' %}
+{{ lib.gen_junos_ebgp_out_policy(f['data']['policy'], f['data']['used_actions']) }}
+    {%- elif f['kind'] == 'common' %}
+{{ lib.gen_junos_common_ebgp_out_policy_options() }}
+    {%- elif f['kind'] == 'communities' %}
+{{ lib.gen_junos_ebgp_out_policy_communities(f['data']['policy'], f['data']['used_actions']) }}
+    {%- endif %}
+{%- endfor %}
+""",
+    "bgp-announcements": """
+{%- import "bgp-announcements/templates/config.j2" as conf -%}
+{%- import "bgp-announcements/templates/lib.j2" as lib -%}
+{%- for f in fragments %}
+{{ separator }}
+    {%- if f['kind'] == 'settings' %}
+{{ {'internet_vrf': conf.internet_vrf} | json }}
+    {%- elif f['kind'] == 'routes' %}
+{{ lib.gen_junos_announcement_routes(f['data']['announcements'], f['data']['route_type'], f['data']['family']) }}
+    {%- endif %}
+{%- endfor %}
+""",
+}
+# Formats the configuration can be loaded in
+OUTPUTS = ["replace", "set", "xml"]
+# Device command that returns the commit history (latest commit first)
+COMMIT_HISTORY_CMD = "show system commit"
+# Settings templates of the fast path changes (blackholes, route communities)
+FAST_PATH_SETTINGS = {
+    "ebgp-peerings": ["local_asn", "v4_allocations", "v6_allocations"],
+    "bgp-announcements": ["internet_vrf"],
+}
+# jinja_env options (minion / proxy config) passed to the jinja2 environment
+JINJA_ENV_OPTIONS = ["block_start_string", "block_end_string", "variable_start_string",
+                     "variable_end_string", "comment_start_string", "comment_end_string",
+                     "line_statement_prefix", "line_comment_prefix", "trim_blocks",
+                     "lstrip_blocks", "newline_sequence", "keep_trailing_newline"]
+# Fragments of the disk cache not used for FRAGMENT_MAX_AGE seconds are
+# removed, at most once every FRAGMENT_PRUNE_INTERVAL seconds
+FRAGMENT_MAX_AGE = 7 * 24 * 3600
+FRAGMENT_PRUNE_INTERVAL = 3600
+# Fragments rendered per template render when they are not kept in memory
+# (streamed render), so a cold cache does not hold them all at once
+STREAM_BATCH_SIZE = 1000
+# Seconds the hashes of the templates of a state on the master are reused
+# for, before they are fetched again
+TEMPLATE_HASH_TTL = 5
+#----------------- Global settings -------------------
+
+# In memory fragment cache (key -> text) and the keys used by the last
+# render of every group
+_FRAGMENTS = {}
+_GROUP_KEYS = {}
+# Time of the last prune of the disk cache
+_PRUNED = {"time": 0}
+# Template environment of every group: the hash of the templates it was
+# built for, the jinja2 environment and the compiled batch template
+_JINJA = {}
+# Hashes of the templates of every state on the master: the time they were
+# fetched and path -> hash
+_TEMPLATE_HASHES = {}
+
+
+class _DunderView(Mapping):
+    """
+    Read only view of a Salt loader dunder (__salt__, __pillar__, ...),
+    looked up on every access. The loader replaces the dunders (eg on a
+    pillar refresh) while the template environments live on.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def _data(self):
+        return globals()[self._name]
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def _cache_dir(name):
+    """
+    Get (and create) a bgpte cache directory
+
+    Args:
+      name (string): the cache name (eg fragments)
+
+    Returns:
+      string (the directory path)
+    """
+
+    base = __salt__["config.get"]("bgpte:cache_dir", os.path.join(__opts__["cachedir"], "bgpte"))
+    path = os.path.join(base, name)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _store_dir():
+    """
+    Get the directory of the applied configuration store
+    """
+
+    return __salt__["config.get"]("bgpte:store_dir",
+                                  os.path.join(__salt__["config.get"]("bgpte:cache_dir",
+                                               os.path.join(__opts__["cachedir"], "bgpte")), "store"))
+
+
+def _hash(data):
+    """
+    Get the sha256 hex digest of json serializable data, independent of
+    dictionary ordering
+    """
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _tmp_suffix():
+    """
+    Get a suffix unique to the process and thread (proxy minions run their
+    jobs in threads, multiprocessing is off)
+    """
+
+    return "{}.{}".format(os.getpid(), threading.get_ident())
+
+
+def _write_atomic(path, text):
+    """
+    Write a file atomically (write to a temporary file and rename)
+    """
+
+    tmp = "{}.{}.tmp".format(path, _tmp_suffix())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _template_hashes(group):
+    """
+    Get the hashes of all the templates of a state on the master (the full
+    template, config.j2, lib.j2 and the custom policy templates), fetched
+    with one file list and a hash per template at most once every
+    TEMPLATE_HASH_TTL seconds. The environment key, the fragment sources
+    and the custom policy templates of a render all come from them.
+
+    Returns:
+      dictionary of path (relative to the file roots) -> hash
+    """
+
+    cached = _TEMPLATE_HASHES.get(group)
+    if cached and time.time() - cached["time"] < TEMPLATE_HASH_TTL:
+        return cached["hashes"]
+    prefix = os.path.dirname(GROUPS[group]["template"]) + "/"
+    hashes = {}
+    for path in sorted(__salt__["cp.list_master"](prefix=prefix)):
+        if path.endswith(".j2"):
+            h = __salt__["cp.hash_file"]("salt://{}".format(path))
+            hashes[path] = h.get("hsum") if h else None
+    _TEMPLATE_HASHES[group] = {"time": time.time(), "hashes": hashes}
+    return hashes
+
+
+def _sources_hash(group):
+    """
+    Get the combined hash of the template sources a state's fragments depend on
+
+    Args:
+      group (string): the state (ebgp-peerings or bgp-announcements)
+
+    Returns:
+      string (sha256 hex digest)
+    """
+
+    hashes = _template_hashes(group)
+    return _hash([[src, hashes.get(src)] for src in GROUPS[group]["sources"]])
+
+
+def _custom_policy_templates():
+    """
+    Get the custom policy templates of the ebgp-peerings state
+
+    Returns:
+      dictionary of policy name -> hash of its custom template
+    """
+
+    templates = {}
+    for path, h in _template_hashes("ebgp-peerings").items():
+        if not path.startswith(CUSTOM_POLICY_DIR):
+            continue
+        name = os.path.basename(path)[:-3]
+        if name not in ["config", "lib", "peerings"]:
+            templates[name] = h
+    return templates
+
+
+def _templates_hash(group):
+    """
+    Get the combined hash of all the templates of a state
+    """
+
+    return _hash(sorted([[path, h] for path, h in _template_hashes(group).items()]))
+
+
+def _jinja_cache_dir():
+    """
+    Get (and create) the directory of the jinja2 bytecode cache
+    """
+
+    path = __salt__["config.get"]("bgpte:jinja_cache_dir", None)
+    if not path:
+        return _cache_dir("jinja")
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _jinja_env(group):
+    """
+    Get the template environment of a state, built again if a template of
+    the state changed on the master
+
+    The environment renders like file.apply_template_on_contents: the
+    templates are fetched with the Salt cache loader and have the Salt
+    filters, tests, globals and the salt, pillar, grains and opts variables.
+
+    Args:
+      group (string): the state
+
+    Returns:
+      dictionary with the environment ('env') and the compiled batch
+      template of the state ('batch')
+    """
+
+    key = _templates_hash(group)
+    cached = _JINJA.get(group)
+    if cached and cached["key"] == key:
+        return cached
+    env_args = {"loader": salt.utils.jinja.SaltCacheLoader(__opts__, "base"),
+                "extensions": ["jinja2.ext.do", salt.utils.jinja.SerializerExtension],
+                "bytecode_cache": jinja2.FileSystemBytecodeCache(_jinja_cache_dir()),
+                "undefined": jinja2.Undefined,
+                # templates are invalidated by _templates_hash, not by mtime
+                "auto_reload": False}
+    env_args.update({k: v for k, v in (__opts__.get("jinja_env") or {}).items() if k in JINJA_ENV_OPTIONS})
+    env = jinja2.Environment(**env_args)
+    env.filters.update(JinjaFilter.salt_jinja_filters)
+    env.tests.update(JinjaTest.salt_jinja_tests)
+    env.globals.update(JinjaGlobal.salt_jinja_globals)
+    env.globals.update({name: _DunderView("__{}__".format(name)) for name in ["salt", "pillar", "grains", "opts"]})
+    _JINJA[group] = {"key": key, "env": env, "batch": env.from_string(BATCH_TEMPLATES[group])}
+    log.debug("bgpte: new template environment for %s", group)
+    return _JINJA[group]
+
+
+class _DiskFragment(object):
+    """
+    A fragment of the disk cache, read when its chunk is produced (see
+    render_iter with keep False). It is false if the fragment is empty.
+    """
+
+    def __init__(self, path, empty):
+        self.path = path
+        self.empty = empty
+
+    def __bool__(self):
+        return not self.empty
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+
+def _cache_get(key, use_disk=True, keep=True):
+    """
+    Get a fragment from the memory or the disk cache
+
+    Args:
+      key (string): the fragment key
+      use_disk (boolean): look in the disk cache too
+      keep (boolean): keep a fragment of the disk cache in memory. If False
+                      a _DiskFragment is returned instead of its text
+
+    Returns:
+      string (or _DiskFragment) or None if the fragment is not cached
+    """
+
+    if key in _FRAGMENTS:
+        return _FRAGMENTS[key]
+    if not use_disk:
+        return None
+    path = os.path.join(_cache_dir("fragments"), key[:2], key)
+    if not keep:
+        try:
+            return _DiskFragment(path, os.path.getsize(path) == 0)
+        except OSError:
+            return None
+    try:
+        with open(path) as f:
+            text = f.read()
+    except (IOError, OSError):
+        return None
+    _FRAGMENTS[key] = text
+    return text
+
+
+def _cache_put(key, text, keep=True):
+    """
+    Store a fragment in the disk cache and, with keep, in the memory cache
+
+    Returns:
+      string (the path of the fragment in the disk cache)
+    """
+
+    if keep:
+        _FRAGMENTS[key] = text
+    d = os.path.join(_cache_dir("fragments"), key[:2])
+    if not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    path = os.path.join(d, key)
+    _write_atomic(path, text)
+    return path
+
+
+def _render_batch(group, fragments):
+    """
+    Render a list of fragments of a state in a single template render
+
+    Args:
+      group (string): the state
+      fragments (list of dictionaries): records with the fragment 'kind' and
+                                        its input 'data'
+
+    Returns:
+      list of strings (the rendered fragments, in order)
+    """
+
+    rendered = _JINJA[group]["batch"].render(fragments=fragments, separator=FRAGMENT_SEPARATOR)
+    chunks = rendered.split(FRAGMENT_SEPARATOR)[1:]
+    if len(chunks) != len(fragments):
+        raise Exception("bgpte: rendered {} fragments of {}, expected {}".format(len(chunks), group, len(fragments)))
+    return [c.strip("\n").rstrip() for c in chunks]
+
+
+def _render_fragments(group, fragments, sources, cache=True, keep=True):
+    """
+    Get the rendered text of fragments, from the cache when possible
+
+    Args:
+      group (string): the state
+      fragments (list of dictionaries): records with the fragment 'kind' and
+                                        its input 'data'
+      sources (string): the hash of the state's template sources
+      cache (boolean): use the cache (if False everything is rendered)
+      keep (boolean): keep the fragments in the memory cache. If False the
+                      fragments not in memory are returned as _DiskFragment
+
+    Returns:
+      list of strings (the rendered fragments, in order)
+    """
+
+    keys = [_hash([f["kind"], f["data"], sources]) for f in fragments]
+    texts = [_cache_get(k, keep=keep) if cache else None for k in keys]
+    missing = [i for i, t in enumerate(texts) if t is None]
+    # fragments with the same key are rendered once
+    unique = {}
+    for i in missing:
+        unique.setdefault(keys[i], i)
+    if unique:
+        order = list(unique.values())
+        size = len(order) if keep else STREAM_BATCH_SIZE
+        done = {}
+        for n in range(0, len(order), size):
+            batch = order[n:n + size]
+            for i, text in zip(batch, _render_batch(group, [fragments[i] for i in batch])):
+                path = _cache_put(keys[i], text, keep)
+                done[keys[i]] = text if keep else _DiskFragment(path, not text)
+        for i in missing:
+            texts[i] = done[keys[i]]
+    log.debug("bgpte: %s fragments %d, rendered %d", group, len(fragments), len(unique))
+    _GROUP_KEYS.setdefault(group, set()).update(keys)
+    return texts
+
+
+def _forget_unused(group, keys, keep=True):
+    """
+    Drop from the memory cache the fragments of a group not used by its last
+    render (and not used by any other group). Without keep, the fragments of
+    the last render are dropped too.
+    """
+
+    old = _GROUP_KEYS.get(group, set())
+    _GROUP_KEYS[group] = set(keys)
+    used = set()
+    for g, k in _GROUP_KEYS.items():
+        if keep or g != group:
+            used |= k
+    for k in (old | _GROUP_KEYS[group]) - used:
+        _FRAGMENTS.pop(k, None)
+    if not keep:
+        used |= _GROUP_KEYS[group]
+    _prune_disk(used)
+
+
+def _prune_disk(used):
+    """
+    Remove from the disk cache the fragments not used for FRAGMENT_MAX_AGE
+    seconds. The fragments in use by this process are touched first: the
+    cache directory can be shared by proxy minions, whose fragments are
+    kept as long as any of them uses them.
+    """
+
+    now = time.time()
+    if now - _PRUNED["time"] < FRAGMENT_PRUNE_INTERVAL:
+        return
+    _PRUNED["time"] = now
+    base = _cache_dir("fragments")
+    for k in used:
+        try:
+            os.utime(os.path.join(base, k[:2], k), (now, now))
+        except OSError:
+            pass
+    removed = 0
+    for d in os.listdir(base):
+        path = os.path.join(base, d)
+        if not os.path.isdir(path):
+            continue
+        for k in os.listdir(path):
+            f = os.path.join(path, k)
+            try:
+                if k not in used and now - os.path.getmtime(f) > FRAGMENT_MAX_AGE:
+                    os.remove(f)
+                    removed += 1
+            except OSError:
+                pass
+    log.debug("bgpte: %d fragments removed from the disk cache", removed)
+
+
+def _indent(text, width):
+    """
+    Indent every non empty line of a text
+    """
+
+    pad = " " * width
+    return "\n".join([pad + l if l.strip() else "" for l in text.splitlines()])
+
+
+def _get_location():
+    """
+    Get the location of the router from the pillar, as peerings.j2 does
+    """
+
+    location = __salt__["pillar.get"]("location")
+    if isinstance(location, str):
+        location = location.upper()
+    return location
+
+
+def get_policies(bgp_peerings, location):
+    """
+    Get the out policy records of BGP groups, as gen_junos_ebgp_groups builds them
+
+    Identical records (a policy shared by several sessions) are returned once.
+
+    Args:
+      bgp_peerings (list of dictionaries): the bgp | direct-peerings and / or
+                                           bgp | internet-exchange-peerings pillar
+      location (string): the location of the router
+
+    Returns:
+      list of policy records (name, family, peer_asn, relationship, location)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.get_policies "$(salt-call pillar.get bgp:direct-peerings --out json)" FR
+    """
+
+    policies = []
+    seen = set()
+    for pg in bgp_peerings:
+        for p in pg["peerings"]:
+            if p["export_policy"]:
+                rec = {"name": p["export_policy"], "family": p["family"], "peer_asn": p["peer_asn"],
+                       "relationship": p["relationship"], "location": location}
+                rec_key = (rec["name"], rec["family"], rec["peer_asn"], rec["relationship"])
+                if rec_key not in seen:
+                    seen.add(rec_key)
+                    policies.append(rec)
+    return policies
+
+
+def get_used_actions(announcements, local_asn):
+    """
+    Get the out policy actions referenced by BGP announcements, as peerings.j2
+    computes them when prune_unused_policy_actions is enabled
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      local_asn (int): our AS number
+
+    Returns:
+      dictionary with "<action>:<asn or location code>" keys
+    """
+
+    used = {}
+    for a in announcements:
+        for c in a["communities"]:
+            parts = c.split(":")
+            if len(parts) == 3 and parts[0] == str(local_asn) and parts[1] in PEER_ACTIONS + LOCATION_ACTIONS:
+                used["{}:{}".format(parts[1], parts[2])] = True
+    return used
+
+
+def _policy_actions(p, used_actions, settings):
+    """
+    Restrict the used actions to the ones an out policy looks at, so that a
+    policy fragment only changes when its own actions change
+    """
+
+    if used_actions is None:
+        return None
+    loc = settings["geolocations"].get(p["location"])
+    keys = ["40:0", "400:0"] + ["{}:{}".format(a, p["peer_asn"]) for a in PEER_ACTIONS] + \
+           ["{}:{}".format(a, loc) for a in LOCATION_ACTIONS]
+    return {k: True for k in keys if k in used_actions}
+
+
+def _settings(group, sources, cache):
+    """
+    Get the settings of a state's config.j2 (cached like a fragment)
+    """
+
+    return json.loads(_render_fragments(group, [{"kind": "settings", "data": {}}], sources, cache)[0])
+
+
+def _render_ebgp_peerings(cache, keep=True):
+    """
+    Render the ebgp-peerings configuration from fragments
+
+    Returns:
+      (parts, keys) tuple: the parts of the configuration (see _chunks) and
+      the fragment keys used
+    """
+
+    direct_peerings = __salt__["pillar.get"]("bgp:direct-peerings", [])
+    ix_peerings = __salt__["pillar.get"]("bgp:internet-exchange-peerings", [])
+    if not (direct_peerings or ix_peerings):
+        return ([], [])
+    location = _get_location()
+    sources = _sources_hash("ebgp-peerings")
+    settings = _settings("ebgp-peerings", sources, cache)
+    used_actions = None
+    if settings["prune_unused_policy_actions"]:
+        used_actions = get_used_actions(__salt__["pillar.get"]("bgp:announcements", []), settings["local_asn"])
+    custom_hashes = _custom_policy_templates()
+
+    groups = list(direct_peerings or []) + list(ix_peerings or [])
+    fragments = []
+    for pg in groups:
+        # the custom policy templates change the export statement of a session
+        pg_custom = {p["export_policy"]: custom_hashes[p["export_policy"]]
+                     for p in pg["peerings"] if p["export_policy"] in custom_hashes}
+        fragments.append({"kind": "group", "data": {"group": pg, "location": location, "custom": pg_custom}})
+    n_groups = len(fragments)
+    policies = get_policies(groups, location)
+    for p in policies:
+        fragments.append({"kind": "policy", "data": {"policy": p,
+                                                     "used_actions": _policy_actions(p, used_actions, settings),
+                                                     "custom": custom_hashes.get(p["name"])}})
+    n_policies = len(fragments)
+    fragments.append({"kind": "common", "data": {}})
+    processed_asns = set()
+    for p in policies:
+        if p["peer_asn"] not in processed_asns:
+            processed_asns.add(p["peer_asn"])
+            fragments.append({"kind": "communities", "data": {"policy": p,
+                                                              "used_actions": _policy_actions(p, used_actions, settings)}})
+    texts = _render_fragments("ebgp-peerings", fragments, sources, cache, keep)
+
+    lines = ["groups {",
+             "    replace: eBGP-PEERINGS {",
+             "        routing-instances {",
+             "            NET {",
+             "                protocols {",
+             "                    bgp {"]
+    lines += [(t, 24) for t in texts[:n_groups] if t]
+    lines += ["                    }",
+              "                }",
+              "            }",
+              "        }",
+              "    }",
+              "    replace: eBGP-PEERINGS-POLICIES {",
+              "        policy-options {"]
+    lines += [(t, 12) for t in texts[n_groups:] if t]
+    lines += ["        }",
+              "    }",
+              "}"]
+    keys = [_hash([f["kind"], f["data"], sources]) for f in fragments] + \
+           [_hash(["settings", {}, sources])]
+    return (lines, keys)
+
+
+def _render_bgp_announcements(cache, keep=True):
+    """
+    Render the bgp-announcements configuration from fragments
+
+    Returns:
+      (parts, keys) tuple: the parts of the configuration (see _chunks) and
+      the fragment keys used
+    """
+
+    announcements = __salt__["pillar.get"]("bgp:announcements", [])
+    direct_peerings = __salt__["pillar.get"]("bgp:direct-peerings", [])
+    ix_peerings = __salt__["pillar.get"]("bgp:internet-exchange-peerings", [])
+    if not (announcements and (direct_peerings or ix_peerings)):
+        return ([], [])
+    sources = _sources_hash("bgp-announcements")
+    settings = _settings("bgp-announcements", sources, cache)
+    vrf = settings["internet_vrf"]
+    fragments = []
+    for family in ["IPv4", "IPv6"]:
+        for route_type in ["static", "aggregate"]:
+            routes = [a for a in announcements
+                      if a["address-family"] == family and a["route-type"] == route_type]
+            if routes:
+                fragments.append({"kind": "routes", "data": {"announcements": routes, "route_type": route_type,
+                                                             "family": family}})
+    texts = _render_fragments("bgp-announcements", fragments, sources, cache, keep)
+
+    # indentation of the routing-options hierarchy without / with the vrf
+    base = 16
+    lines = ["groups {",
+             "    replace: BGP-ANNOUNCEMENTS {"]
+    if vrf:
+        lines += ["        routing-instances {",
+                  "            {} {{".format(vrf)]
+    lines += [" " * base + "routing-options {"]
+    for family, rib in [("IPv4", "inet.0"), ("IPv6", "inet6.0")]:
+        family_texts = [t for f, t in zip(fragments, texts) if f["data"]["family"] == family]
+        if family_texts:
+            lines += [" " * (base + 4) + "rib {}{} {{".format("{}.".format(vrf) if vrf else "", rib)]
+            lines += [(t, base + 8) for t in family_texts]
+            lines += [" " * (base + 4) + "}"]
+    lines += [" " * base + "}"]
+    if vrf:
+        lines += ["            }",
+                  "        }"]
+    lines += ["    }",
+              "}"]
+    keys = [_hash([f["kind"], f["data"], sources]) for f in fragments] + \
+           [_hash(["settings", {}, sources])]
+    return (lines, keys)
+
+
+def _render_template(group):
+    """
+    Render the full template of a state (no fragments, no cache), as a
+    stream of chunks
+    """
+
+    for chunk in _JINJA[group]["env"].get_template(GROUPS[group]["template"]).generate():
+        yield chunk
+    # like Salt, keep the trailing newline of the template that jinja2 strips
+    yield "\n"
+
+
+def _chunks(parts):
+    """
+    Get the chunks of a configuration from its parts: configuration lines
+    and (fragment text, indentation) tuples. A fragment is indented when its
+    chunk is produced, so the configuration is never built as a whole.
+    """
+
+    for part in parts:
+        if isinstance(part, tuple):
+            text, width = part
+            if isinstance(text, _DiskFragment):
+                text = text.read()
+            yield _indent(text, width) + "\n"
+        else:
+            yield part + "\n"
+
+
+def render_iter(group, cache=True, fragments=True, keep=True):
+    """
+    Render the JunOS configuration of a state as a stream of chunks
+
+    The fragments are rendered (or fetched from the cache) up front, their
+    indentation is applied chunk by chunk. With fragments False, the chunks
+    are generated by the full template. Without keep, the fragments are not
+    kept in the memory cache: they are read from the disk cache one by one,
+    when their chunk is produced.
+
+    Args:
+      group (string): the state (ebgp-peerings or bgp-announcements)
+      cache (boolean): use the fragment cache
+      fragments (boolean): render from fragments
+      keep (boolean): keep the fragments in the memory cache
+
+    Returns:
+      generator of strings, whose concatenation is the configuration
+    """
+
+    _groups([group])
+    _jinja_env(group)
+    if not fragments:
+        return _render_template(group)
+    if group == "ebgp-peerings":
+        parts, keys = _render_ebgp_peerings(cache, keep)
+    else:
+        parts, keys = _render_bgp_announcements(cache, keep)
+    _forget_unused(group, keys, keep)
+    return _chunks(parts)
+
+
+def render(group, cache=True, fragments=True):
+    """
+    Render the JunOS configuration of a state
+
+    Args:
+      group (string): the state (ebgp-peerings or bgp-announcements)
+      cache (boolean): use the fragment cache
+      fragments (boolean): render from fragments. If False the full template
+                           of the state is rendered, as netconfig.managed does
+
+    Returns:
+      string (the JunOS configuration)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.render ebgp-peerings
+        salt vmx1-lab bgpte.render bgp-announcements cache=False
+    """
+
+    t0 = time.time()
+    text = "".join(render_iter(group, cache=cache, fragments=fragments))
+    log.debug("bgpte: rendered %s in %.3f sec", group, time.time() - t0)
+    return text
+
+
+def _applied_path(group, ext="json"):
+    """
+    Get the path of the last applied record (json) or configuration (conf)
+    of a state for this minion
+    """
+
+    return os.path.join(_cache_dir("applied"), "{}.{}.{}".format(__opts__["id"], group, ext))
+
+
+def get_applied(group):
+    """
+    Get the record of the last configuration of a state committed on the device
+
+    Args:
+      group (string): the state (ebgp-peerings or bgp-announcements)
+
+    Returns:
+      dictionary or None if there is no record
+
+    Return example:
+      {'hash': '9f2c...', 'commit': '0   2021-03-01 10:12:44 UTC by salt via netconf',
+       'time': 1614593564.3}
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.get_applied ebgp-peerings
+    """
+
+    try:
+        with open(_applied_path(group)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_applied_config(group):
+    """
+    Get the last configuration of a state committed on the device
+
+    Args:
+      group (string): the state (ebgp-peerings or bgp-announcements)
+
+    Returns:
+      string or None if it is not known
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.get_applied_config ebgp-peerings
+    """
+
+    try:
+        with open(_applied_path(group, "conf")) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def forget_applied(group=None):
+    """
+    Remove the last applied record of a state (or all states), so that the
+    next apply loads the configuration on the device
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.forget_applied
+    """
+
+    for g in [group] if group else list(GROUPS):
+        for ext in ["json", "conf"]:
+            try:
+                os.remove(_applied_path(g, ext))
+            except OSError:
+                pass
+    return True
+
+
+def last_commit():
+    """
+    Get the latest entry of the device commit history
+
+    Returns:
+      string or None if the commit history could not be fetched
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.last_commit
+    """
+
+    history = _commit_history()
+    return history[0] if history else None
+
+
+def _commit_history(count=1):
+    """
+    Get the latest entries of the device commit history, latest first
+
+    Returns:
+      list of strings (empty if the commit history could not be fetched)
+    """
+
+    res = __salt__["net.cli"](COMMIT_HISTORY_CMD)
+    if not res.get("result"):
+        log.warning("bgpte: could not get the commit history: %s", res.get("comment"))
+        return []
+    entries = {}
+    for line in res["out"].get(COMMIT_HISTORY_CMD, "").splitlines():
+        words = line.split()
+        if words and words[0].isdigit() and int(words[0]) < count:
+            entries[int(words[0])] = " ".join(words)
+    return [entries[i] for i in sorted(entries)]
+
+
+def _follow_commit():
+    """
+    Move the applied records of the states to the latest device commit,
+    after a commit of ours that did not touch the states' groups (eg a
+    blackhole route), so that the next apply does not see it as a drift.
+    A record is moved only if its commit is the one before the latest.
+    """
+
+    history = _commit_history(2)
+    if len(history) < 2:
+        return
+    previous = history[1].split(None, 1)[1]
+    for g in GROUPS:
+        applied = get_applied(g)
+        if applied and applied["commit"].split(None, 1)[1:] == [previous]:
+            applied["commit"] = history[0]
+            _write_atomic(_applied_path(g), json.dumps(applied))
+
+
+def _record_applied(group, config, config_hash, commit, path=None):
+    """
+    Record the configuration of a state committed on the device and its hash,
+    with the device's latest commit. A spooled configuration is copied from
+    its file (path).
+    """
+
+    if commit is None:
+        forget_applied(group)
+        return
+    if path:
+        tmp = "{}.{}.tmp".format(_applied_path(group, "conf"), _tmp_suffix())
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, _applied_path(group, "conf"))
+    else:
+        _write_atomic(_applied_path(group, "conf"), config)
+    _write_atomic(_applied_path(group), json.dumps({"hash": config_hash, "commit": commit, "time": time.time()}))
+
+
+def _groups(group):
+    """
+    Get the list of states from a state name, a comma separated string of
+    state names or a list
+    """
+
+    if isinstance(group, str):
+        group = [g.strip() for g in group.split(",") if g.strip()]
+    for g in group:
+        if g not in GROUPS:
+            raise Exception("bgpte: unknown group {}".format(g))
+    return list(group)
+
+
+def _spool(groups, cache=True, fragments=True):
+    """
+    Stream the rendered configuration of states to files, one per state and
+    one with all of them (the file loaded on the device), hashing it chunk
+    by chunk
+
+    Returns:
+      (path, spooled) tuple: the path of the file with all the states and a
+      list of (state, path, sha256) tuples of the states with configuration
+    """
+
+    base = os.path.join(_cache_dir("spool"), "{}.{}".format(__opts__["id"], _tmp_suffix()))
+    spooled = []
+    with open(base + ".conf", "w") as out:
+        for g in groups:
+            path = "{}.{}.conf".format(base, g)
+            h = hashlib.sha256()
+            # chunks held back until the state has some configuration
+            pending = []
+            with open(path, "w") as f:
+                for chunk in render_iter(g, cache=cache, fragments=fragments, keep=False):
+                    h.update(chunk.encode("utf-8"))
+                    f.write(chunk)
+                    if pending is None:
+                        out.write(chunk)
+                        continue
+                    pending.append(chunk)
+                    if chunk.strip():
+                        if spooled:
+                            out.write("\n")
+                        out.write("".join(pending))
+                        pending = None
+            if pending is not None:
+                os.remove(path)
+            else:
+                spooled.append((g, path, h.hexdigest()))
+    return (base + ".conf", spooled)
+
+
+def _xml_config(text):
+    """
+    Get the XML of a configuration, None if it can not be converted
+    """
+
+    try:
+        return __utils__["junos_config.text_to_xml"](text)
+    except Exception as e:
+        log.warning("bgpte: xml output failed, loading the text configuration: %s", e)
+        return None
+
+
+def apply(group, test=False, debug=False, cache=True, fragments=True, skip_unchanged=True, output="replace",
+          stream=False):
+    """
+    Render the configuration of one or more states and load it on the device
+
+    The configuration is loaded via net.load_config and committed, unless
+    test is True in which case the candidate is discarded after the diff.
+    The configurations of several states are loaded in one candidate and
+    committed once: if the load or the commit fails, none of them is applied.
+    With skip_unchanged, the load is skipped when the rendered configuration
+    of every state is the one last committed and the device commit history
+    shows no commit since then.
+
+    With output "set", the set / delete commands between the last committed
+    and the rendered configuration are loaded instead of the whole groups.
+    The full configuration (replace groups) is loaded when the last committed
+    configuration is not known or the device has a newer commit. With output
+    "xml", the replace groups are loaded as JunOS XML, so the device does not
+    parse configuration text. When the set commands fail to load or commit,
+    the full configuration is loaded instead.
+
+    With stream, the replace output is rendered chunk by chunk into a spool
+    file that is loaded on the device, so the proxy minion does not build
+    the configuration in memory. The set and xml outputs need the whole
+    configuration and are not streamed.
+
+    Args:
+      group (string or list): the state (ebgp-peerings or bgp-announcements),
+                              a comma separated string or a list of states
+      test (boolean): only compute the diff
+      debug (boolean): return the loaded configuration as well
+      cache (boolean): use the fragment cache
+      fragments (boolean): render from fragments
+      skip_unchanged (boolean): skip the load of an unchanged configuration
+      output (string): "replace" (full groups), "set" (differences) or "xml"
+                       (full groups in XML)
+      stream (boolean): stream the replace output through a spool file
+
+    Returns:
+      dictionary: the result of net.load_config, plus the render time
+                  ('render_time' in seconds), 'skipped' (True if the load
+                  was skipped) and 'output' (the output actually loaded)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.apply ebgp-peerings test=True
+        salt vmx1-lab bgpte.apply bgp-announcements,ebgp-peerings output=set
+        salt vmx1-lab bgpte.apply ebgp-peerings stream=True
+    """
+
+    if output not in OUTPUTS:
+        raise Exception("bgpte: unknown output {}".format(output))
+    groups = _groups(group)
+    if stream and output == "replace":
+        return _apply_stream(groups, test, debug, cache, fragments, skip_unchanged)
+    t0 = time.time()
+    configs = [(g, render(g, cache=cache, fragments=fragments)) for g in groups]
+    configs = [(g, c) for g, c in configs if c.strip()]
+    render_time = time.time() - t0
+    if not configs:
+        return _nothing_to_configure(groups, render_time, output)
+    hashes = {g: hashlib.sha256(c.encode("utf-8")).hexdigest() for g, c in configs}
+    undrifted, commit = _undrifted([g for g, c in configs], skip_unchanged or output == "set")
+    if skip_unchanged and undrifted and _unchanged(hashes):
+        return _unchanged_since(commit, render_time, output)
+    config = None
+    if output == "set" and undrifted:
+        previous = [get_applied_config(g) for g, c in configs]
+        if all(p is not None for p in previous):
+            try:
+                config = "".join([__utils__["junos_config.diff_text"](p, c) for p, (g, c) in zip(previous, configs)])
+            except Exception as e:
+                log.warning("bgpte: set output failed, loading the full configuration: %s", e)
+                config = None
+    elif output == "xml":
+        config = _xml_config("\n".join([c for g, c in configs]))
+    if config is None:
+        output = "replace"
+        config = "\n".join([c for g, c in configs])
+    elif not config:
+        # no difference with the configuration committed by us
+        ret = {"result": True, "comment": "Already configured.", "already_configured": True, "diff": "",
+               "render_time": render_time, "skipped": True, "output": output}
+        if not test:
+            for g, c in configs:
+                _record_applied(g, c, hashes[g], commit)
+        return ret
+    ret = __salt__["net.load_config"](text=config, test=test, debug=debug, commit=True)
+    if output == "set" and not ret.get("result"):
+        # the candidate is discarded on failures, the groups replace what the
+        # set commands could not change
+        log.warning("bgpte: set output failed, loading the full configuration: %s", ret.get("comment"))
+        output = "replace"
+        ret = __salt__["net.load_config"](text="\n".join([c for g, c in configs]), test=test, debug=debug,
+                                          commit=True)
+    ret["render_time"] = render_time
+    ret["skipped"] = False
+    ret["output"] = output
+    if ret.get("result") and not test:
+        commit = last_commit()
+        for g, c in configs:
+            _record_applied(g, c, hashes[g], commit)
+        if not ret.get("already_configured"):
+            ret["apply_id"] = _store_apply(dict(configs), commit)
+    return ret
+
+
+def _undrifted(groups, check=True):
+    """
+    Check that the device is as we left it: every state has an applied
+    record with the device's latest commit
+
+    Returns:
+      (undrifted, commit) tuple: a boolean and the latest device commit
+      (None if not checked)
+    """
+
+    applied = [get_applied(g) for g in groups]
+    if not (check and all(applied)):
+        return (False, None)
+    commit = last_commit()
+    return (commit is not None and all(a["commit"] == commit for a in applied), commit)
+
+
+def _unchanged(hashes):
+    """
+    Check that the rendered configurations (state -> sha256) are the ones
+    last applied
+    """
+
+    return all((get_applied(g) or {}).get("hash") == h for g, h in hashes.items())
+
+
+def _nothing_to_configure(groups, render_time, output):
+    """
+    Get the apply result when no state has configuration
+    """
+
+    return {"result": True, "comment": "Nothing to configure for {}".format(", ".join(groups)),
+            "already_configured": True, "diff": "", "render_time": render_time, "skipped": True,
+            "output": output}
+
+
+def _unchanged_since(commit, render_time, output):
+    """
+    Get the apply result when the load is skipped (unchanged configuration)
+    """
+
+    return {"result": True, "comment": "Unchanged since the last commit ({})".format(commit),
+            "already_configured": True, "diff": "", "render_time": render_time, "skipped": True,
+            "output": output}
+
+
+def _apply_stream(groups, test, debug, cache, fragments, skip_unchanged):
+    """
+    Apply the replace output of states through a spool file (see apply)
+    """
+
+    t0 = time.time()
+    path, spooled = _spool(groups, cache, fragments)
+    render_time = time.time() - t0
+    try:
+        if not spooled:
+            return _nothing_to_configure(groups, render_time, "replace")
+        hashes = {g: h for g, p, h in spooled}
+        undrifted, commit = _undrifted(list(hashes), skip_unchanged)
+        if skip_unchanged and undrifted and _unchanged(hashes):
+            return _unchanged_since(commit, render_time, "replace")
+        ret = __salt__["net.load_config"](filename=path, test=test, debug=debug, commit=True)
+        ret["render_time"] = render_time
+        ret["skipped"] = False
+        ret["output"] = "replace"
+        if ret.get("result") and not test:
+            commit = last_commit()
+            for g, p, h in spooled:
+                _record_applied(g, None, h, commit, path=p)
+            if not ret.get("already_configured"):
+                files = {g: open(p) for g, p, h in spooled}
+                try:
+                    ret["apply_id"] = _store_apply(files, commit)
+                finally:
+                    for f in files.values():
+                        f.close()
+        return ret
+    finally:
+        for p in [path] + [p for g, p, h in spooled]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def _store_apply(configs, commit, meta=None):
+    """
+    Keep the configurations of a committed apply in the store. Store errors
+    are logged, they do not fail the apply.
+
+    Returns:
+      string (the apply id) or None
+    """
+
+    data = {"commit": commit}
+    data.update(meta or {})
+    try:
+        return __utils__["config_store.save"](_store_dir(), __opts__["id"], configs, data)
+    except Exception as e:
+        log.error("bgpte: could not store the applied configuration: %s", e)
+        return None
+
+
+def history(limit=20):
+    """
+    Get the applies of this minion kept in the store, latest first
+
+    Args:
+      limit (int): maximum number of applies
+
+    Returns:
+      list of dictionaries (apply id, time, device commit and states)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.history limit=5
+    """
+
+    store = _store_dir()
+    ret = []
+    for apply_id in __utils__["config_store.history"](store, __opts__["id"])[:limit]:
+        m = __utils__["config_store.manifest"](store, __opts__["id"], apply_id)
+        ret.append({"id": apply_id, "time": m["time"], "commit": m.get("commit"),
+                    "states": sorted(m["states"]), "rollback_of": m.get("rollback_of")})
+    return ret
+
+
+def get_stored(apply_id, group=None):
+    """
+    Get the configuration of an apply from the store
+
+    Args:
+      apply_id (string): the apply id (see bgpte.history)
+      group (string or list): the state(s) (default: all the states of the apply)
+
+    Returns:
+      dictionary: state -> configuration
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.get_stored 20210301T101244.123456Z ebgp-peerings
+    """
+
+    store = _store_dir()
+    m = __utils__["config_store.manifest"](store, __opts__["id"], apply_id)
+    groups = _groups(group) if group else sorted(m["states"])
+    return {g: __utils__["config_store.assemble"](store, m, g) for g in groups}
+
+
+def rollback(apply_id, group=None, test=False, debug=False):
+    """
+    Load the configuration of a previous apply from the store and commit it
+
+    The configurations are reassembled from the store (no render, no source
+    of truth query) and loaded as replace groups in a single transaction.
+    The next apply loads the rendered configuration again.
+
+    Args:
+      apply_id (string): the apply id (see bgpte.history)
+      group (string or list): the state(s) to roll back (default: all the
+                              states of the apply)
+      test (boolean): only compute the diff
+      debug (boolean): return the loaded configuration as well
+
+    Returns:
+      dictionary: the result of net.load_config, plus the 'apply_id' of the
+                  rollback
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.rollback 20210301T101244.123456Z test=True
+    """
+
+    configs = get_stored(apply_id, group)
+    ret = __salt__["net.load_config"](text="\n".join(configs.values()), test=test, debug=debug, commit=True)
+    if ret.get("result") and not test:
+        commit = last_commit()
+        for g, c in configs.items():
+            _record_applied(g, c, hashlib.sha256(c.encode("utf-8")).hexdigest(), commit)
+        if not ret.get("already_configured"):
+            ret["apply_id"] = _store_apply(configs, commit, {"rollback_of": apply_id})
+    return ret
+
+
+def store_stats():
+    """
+    Get the size of the applied configuration store
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.store_stats
+    """
+
+    return __utils__["config_store.stats"](_store_dir())
+
+
+def compare(group, cache=True):
+    """
+    Compare the rendered configuration of states with the configuration last
+    committed by bgpte.apply, without contacting the device
+
+    Args:
+      group (string or list): the state(s) to compare
+      cache (boolean): use the fragment cache for the render
+
+    Returns:
+      dictionary: per state the differences in 'show | compare' format (a
+                  string, empty if there are none) or None if the last
+                  committed configuration is not known
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.compare bgp-announcements,ebgp-peerings
+    """
+
+    ret = {}
+    for g in _groups(group):
+        previous = get_applied_config(g)
+        if previous is None:
+            ret[g] = None
+            continue
+        lines = __utils__["junos_config.compare"](__utils__["junos_config.parse"](previous),
+                                                  __utils__["junos_config.parse"](render(g, cache=cache)))
+        ret[g] = "\n".join(lines)
+    return ret
+
+
+def bench_load(group, repeat=3, commit=False, cache=True):
+    """
+    Benchmark the load of the configuration of states in text and XML format
+
+    The same rendered configuration is loaded repeat times in each format.
+    Without commit the candidate is compared and discarded (test mode), with
+    commit it is committed (the configuration is unchanged after the first
+    commit, so only the load and commit processing is measured).
+
+    Args:
+      group (string or list): the state(s) to benchmark
+      repeat (int): loads per format
+      commit (boolean): commit every load
+      cache (boolean): use the fragment cache for the render
+
+    Returns:
+      dictionary: per format the conversion time and the min / avg load time
+                  in seconds, plus the configuration sizes in bytes
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.bench_load bgp-announcements,ebgp-peerings repeat=5 commit=True
+    """
+
+    groups = _groups(group)
+    text = "\n".join([c for c in [render(g, cache=cache) for g in groups] if c.strip()])
+    t0 = time.time()
+    xml = __utils__["junos_config.text_to_xml"](text)
+    xml_time = time.time() - t0
+    ret = {}
+    for fmt, config, convert_time in [("text", text, 0.0), ("xml", xml, xml_time)]:
+        times = []
+        for i in range(repeat):
+            t0 = time.time()
+            res = __salt__["net.load_config"](text=config, test=not commit, commit=commit)
+            times.append(time.time() - t0)
+            if not res.get("result"):
+                return {"result": False, "format": fmt, "comment": res.get("comment")}
+        ret[fmt] = {"bytes": len(config.encode("utf-8")), "convert": convert_time,
+                    "min": min(times), "avg": sum(times) / len(times)}
+    # the configuration loaded is unchanged, the applied records stay valid
+    # only if the device commit history did not move
+    if commit:
+        forget_applied()
+    ret["result"] = True
+    return ret
+
+
+def _fast_commit(config, message, test=False):
+    """
+    Load set commands and commit them right away, without the candidate
+    compare of net.load_config. In test mode they are loaded with
+    net.load_config and the candidate is discarded after the diff.
+
+    Returns:
+      dictionary: result and comment (plus the diff in test mode)
+    """
+
+    if test:
+        return __salt__["net.load_config"](text=config, test=True, commit=False)
+    ret = __proxy__["napalm.call"]("load_merge_candidate", config=config)
+    if ret.get("result"):
+        ret = __proxy__["napalm.call"]("commit_config", message=message)
+    if not ret.get("result"):
+        __proxy__["napalm.call"]("discard_config")
+    return ret
+
+
+def _fast_path_settings():
+    """
+    Get the settings of the fast path changes from the config.j2 templates
+    of the states
+    """
+
+    settings = {}
+    for group, names in FAST_PATH_SETTINGS.items():
+        conf = _jinja_env(group)["env"].get_template(GROUPS[group]["sources"][0]).module
+        settings.update({n: getattr(conf, n) for n in names})
+    return settings
+
+
+def blackhole(prefix, withdraw=False, test=False, settings=None):
+    """
+    Blackhole a prefix (RTBH) or withdraw its blackhole, on the fast path
+
+    The discard static route of the prefix, tagged with the blackhole
+    community, is set (or deleted) with a few set commands and committed
+    right away, without rendering the states or comparing the candidate.
+
+    Args:
+      prefix (string): the prefix, in our allocations
+      withdraw (boolean): remove the blackhole route
+      test (boolean): only compute the diff
+      settings (dictionary): local_asn, v4_allocations, v6_allocations and
+                             internet_vrf (default: from the config.j2
+                             templates; the bgpte.blackhole runner passes
+                             them)
+
+    Returns:
+      dictionary: result, comment, the prefix, the commands loaded and the
+      seconds spent to prepare and to load / commit them
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.blackhole 100.64.1.1/32
+        salt vmx1-lab bgpte.blackhole 100.64.1.1/32 withdraw=True
+    """
+
+    t0 = time.time()
+    settings = settings or _fast_path_settings()
+    try:
+        prefix = __utils__["rtbh.validate"](prefix, settings["v4_allocations"], settings["v6_allocations"])
+    except ValueError as e:
+        return {"result": False, "comment": str(e), "prefix": prefix}
+    config = __utils__["rtbh.config"](prefix, settings["local_asn"], settings.get("internet_vrf"), withdraw)
+    t1 = time.time()
+    ret = _fast_commit(config, "bgpte: {} blackhole {}".format("withdraw" if withdraw else "set", prefix), test)
+    t2 = time.time()
+    if not ret.get("result") and withdraw and "statement not found" in str(ret.get("comment")):
+        ret = {"result": True, "comment": "{} is not blackholed".format(prefix), "already_configured": True}
+    elif ret.get("result") and not test:
+        ret["comment"] = "{} {}".format("Withdrew the blackhole of" if withdraw else "Blackholed", prefix)
+        _follow_commit()
+    ret.pop("out", None)
+    ret.update({"prefix": prefix, "withdraw": withdraw, "loaded_config": config,
+                "seconds": {"prepare": round(t1 - t0, 3), "commit": round(t2 - t1, 3)}})
+    return ret
+
+
+def blackholes(settings=None):
+    """
+    Get the blackholed prefixes configured on the device
+
+    Args:
+      settings (dictionary): see blackhole
+
+    Returns:
+      list of strings
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' bgpte.blackholes
+    """
+
+    settings = settings or _fast_path_settings()
+    cmds = []
+    for prefix in ["0.0.0.0/0", "::/0"]:
+        path = __utils__["rtbh.rib"](prefix, settings.get("internet_vrf"))
+        cmds.append("show configuration {} static | display set".format(path))
+    res = __salt__["net.cli"](*cmds)
+    if not res.get("result"):
+        raise Exception("bgpte: could not get the configuration: {}".format(res.get("comment")))
+    return __utils__["rtbh.parse"]("\n".join(res["out"].values()), settings["local_asn"])
+
+
+def set_communities(prefix, communities, route_type="aggregate", test=False, settings=None):
+    """
+    Replace the community list of an announcement route, on the fast path
+
+    The set / delete commands of the community list of the route in the
+    BGP-ANNOUNCEMENTS group are committed right away, without rendering the
+    bgp-announcements state. Nothing is loaded if the route is not in the
+    configuration last applied by the state (the router does not announce
+    it), or if that configuration is not known. The communities must be the
+    ones of the announcement in netbox, so the next apply of the state
+    renders the same route (the bgpte.te runner updates netbox first).
+    After the commit the applied record of bgp-announcements is dropped, its
+    route does not match the device anymore.
+
+    Args:
+      prefix (string): the announcement prefix
+      communities (list of strings): the communities of the announcement
+                                     (netbox tag names)
+      route_type (string): static or aggregate
+      test (boolean): only compute the diff
+      settings (dictionary): see blackhole
+
+    Returns:
+      dictionary: result, comment, the prefix, the commands loaded and the
+      seconds spent to prepare and to load / commit them
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.set_communities 100.65.0.0/16 '[65000:3:1999, 65000:62:65100]'
+    """
+
+    t0 = time.time()
+    settings = settings or _fast_path_settings()
+    if isinstance(communities, str):
+        communities = [c.strip() for c in communities.split(",") if c.strip()]
+    applied = get_applied_config("bgp-announcements")
+    if applied is None or "route {} {{".format(prefix) not in applied:
+        if applied is None:
+            comment = "the bgp-announcements configuration of this router is not known, apply the state first"
+        else:
+            comment = "{} is not announced by this router".format(prefix)
+        return {"result": True, "comment": comment, "skipped": True,
+                "prefix": prefix, "seconds": {"prepare": round(time.time() - t0, 3), "commit": 0.0}}
+    rib = __utils__["rtbh.rib"](prefix, settings.get("internet_vrf"))
+    config = __utils__["announcement_te.route_config"](prefix, route_type, communities, rib)
+    t1 = time.time()
+    ret = _fast_commit(config, "bgpte: communities of {}".format(prefix), test)
+    t2 = time.time()
+    if ret.get("result") and not test:
+        ret["comment"] = "Communities of {} set".format(prefix)
+        forget_applied("bgp-announcements")
+        _follow_commit()
+    ret.pop("out", None)
+    ret.update({"prefix": prefix, "loaded_config": config,
+                "seconds": {"prepare": round(t1 - t0, 3), "commit": round(t2 - t1, 3)}})
+    return ret
+
+
+def clear_cache():
+    """
+    Clear the fragment cache (memory and disk) and the template environments
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt vmx1-lab bgpte.clear_cache
+    """
+
+    _FRAGMENTS.clear()
+    _GROUP_KEYS.clear()
+    shutil.rmtree(_cache_dir("fragments"), ignore_errors=True)
+    _JINJA.clear()
+    _TEMPLATE_HASHES.clear()
+    jinja2.FileSystemBytecodeCache(_jinja_cache_dir()).clear()
+    return True
@@ -0,0 +1,813 @@
+# -*- coding: utf-8 -*-
+
+"""
+Salt runner module for the bgp-te-tool states.
+
+Fleet reconciliation: the bgp-announcements and ebgp-peerings states (or
+the bgp-te state, both in a single transaction, with single_transaction in
+the master config) are applied to a minion
+only when their inputs changed since the last successful run. The inputs of
+a state are the bgp and location pillar data of the minion and the files of
+the state (templates, custom policy templates, init.sls) plus the bgpte
+execution and state modules. Their fingerprint is stored on the master,
+under <cachedir>/bgpte/fingerprints.
+
+The change impact index (the impact_index utils module), recorded by the
+external pillars under <cachedir>/bgpte/impact, maps a netbox or
+peering-manager changelog entry to the minions and fragments it affects.
+
+Webhooks: netbox and peering-manager post their object changes to the
+salt-api /hook/bgpte/<source> endpoint, the reactor (salt://reactor/
+bgpte_webhook.sls) runs bgpte.webhook for every event, which only queues
+the change under <cachedir>/bgpte/queue. The master schedule runs
+bgpte.flush due=True every few seconds (see salt/master): once no other
+change arrived for webhook_debounce seconds (or the oldest queued change
+waited webhook_max_delay seconds) the queue is flushed: the affected
+minions are looked up in the impact index and only the affected states are
+applied to them, apply_concurrency minions at a time. No reactor thread
+waits for a debounce or an apply. The webhooks are signed with
+webhook_secret (X-Hook-Signature): salt-api takes them with no token
+(webhook_disable_auth, which applies to every /hook endpoint), so unsigned
+webhooks, or any webhook when webhook_secret is not set (or is a
+placeholder such as CHANGE-ME), are refused. The changes of the minions
+whose state failed are queued again, retried webhook_retry_delay seconds
+later. The settings are read from the bgpte key of the master config:
+
+  bgpte:
+    webhook_secret: <the secret of the netbox / peering-manager webhooks>
+    netbox_sslverify: true
+    webhook_debounce: 2
+    webhook_max_delay: 10
+    webhook_retry_delay: 60
+    apply_concurrency: 10
+    single_transaction: false   (apply bgp-te instead of the two states,
+                                 as top.sls does when it is opted in)
+
+Blackholes (RTBH): bgpte.blackhole validates the prefix against our
+allocations, then has the targeted minions commit its tagged discard route
+on the fast path of the bgpte execution module, all of them at once. It is
+also available through salt-api:
+
+  curl -sSk https://salt-master:8080/run -H 'Accept: application/json' \
+       -d client=runner -d fun=bgpte.blackhole -d prefix=100.64.1.1/32 \
+       -d username=... -d password=... -d eauth=file
+
+Day to day traffic engineering of a prefix: bgpte.te replaces the
+communities of an announcement in netbox (NETBOX_API_BASE_URL,
+NETBOX_API_TOKEN and BGP_ANNOUNCEMENT_COMMUNITY in the environment, as for
+the netbox external pillar), then has the targeted minions replace the
+community list of the route on the same fast path.
+
+Sync the runner and utils modules on the master with:
+
+  salt-run saltutil.sync_runners
+  salt-run saltutil.sync_utils
+
+CLI examples:
+
+  salt-run bgpte.fingerprint vmx1-lab
+  salt-run bgpte.reconcile '*'
+  salt-run bgpte.reconcile vmx1-lab groups='[ebgp-peerings]' force=True
+  salt-run bgpte.impact '{"changed_object_type": "peering.autonomoussystem", ...}'
+  salt-run bgpte.flush test=True
+  salt-run bgpte.flush due=True
+  salt-run bgpte.blackhole 100.64.1.1/32
+  salt-run bgpte.blackhole 100.64.1.1/32 withdraw=True
+  salt-run bgpte.te 100.65.0.0/16 65000:400:250,65000:62:65100
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+import fcntl
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+import jinja2
+import salt.cache
+import salt.client
+import salt.pillar
+import salt.utils.minions
+
+log = logging.getLogger(__name__)
+
+__virtualname__ = "bgpte"
+
+#----------------- Global settings -------------------
+GROUPS = ["bgp-announcements", "ebgp-peerings", "bgp-te"]
+# States applied by default (as in top.sls), bgp-te with single_transaction
+DEFAULT_GROUPS = ["bgp-announcements", "ebgp-peerings"]
+# State directories a state depends on (bgp-te applies both groups)
+STATE_DIRS = {
+    "bgp-announcements": ["bgp-announcements"],
+    "ebgp-peerings": ["ebgp-peerings"],
+    "bgp-te": ["bgp-te", "bgp-announcements", "ebgp-peerings"],
+}
+# Pillar keys the states depend on
+PILLAR_KEYS = ["bgp", "location"]
+# Files (relative to file_roots) every state depends on
+COMMON_SOURCES = ["_modules/bgpte.py", "_states/bgpte.py"]
+# Webhook defaults (overridden by the bgpte key of the master config):
+# seconds without a new change before the queue is flushed, maximum seconds
+# a change is queued, seconds before the changes of failed minions are
+# retried, minions applied at the same time
+WEBHOOK_DEBOUNCE = 2.0
+WEBHOOK_MAX_DELAY = 10.0
+WEBHOOK_RETRY_DELAY = 60.0
+APPLY_CONCURRENCY = 10
+# Example / placeholder values of webhook_secret, refused as if it was not set
+PLACEHOLDER_SECRETS = ["change-me", "changeme", "secret", "<secret>", "xxx"]
+# Settings templates (relative to file_roots) of the fast path changes
+FAST_PATH_SETTINGS = {
+    "ebgp-peerings/templates/config.j2": ["local_asn", "v4_allocations", "v6_allocations"],
+    "bgp-announcements/templates/config.j2": ["internet_vrf"],
+}
+#----------------- Global settings -------------------
+
+# The change impact index, kept for the life of the runner process
+_INDEX = {}
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def _cache_dir(name):
+    """
+    Get (and create) a bgpte cache directory on the master
+    """
+
+    path = os.path.join(__opts__["cachedir"], "bgpte", name)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _hash(data):
+    """
+    Get the sha256 hex digest of json serializable data, independent of
+    dictionary ordering
+    """
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _minions(tgt, tgt_type="glob"):
+    """
+    Get the list of minions matching a target
+    """
+
+    ckminions = salt.utils.minions.CkMinions(__opts__)
+    return sorted(ckminions.check_minions(tgt, tgt_type)["minions"])
+
+
+def _compile_pillar(minion):
+    """
+    Compile the pillar of a minion on the master (as pillar.show_pillar does)
+    """
+
+    data = salt.cache.factory(__opts__).fetch("minions/{}".format(minion), "data") or {}
+    pillar = salt.pillar.get_pillar(__opts__, data.get("grains", {}), minion, saltenv="base")
+    return pillar.compile_pillar()
+
+
+def _source_files(group):
+    """
+    Get the files of a state and the common sources, as relative path ->
+    absolute path (the first file_roots directory containing it wins)
+    """
+
+    files = {}
+    for root in __opts__["file_roots"]["base"]:
+        for rel in COMMON_SOURCES:
+            if rel not in files and os.path.isfile(os.path.join(root, rel)):
+                files[rel] = os.path.join(root, rel)
+        for state_dir in STATE_DIRS[group]:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(root, state_dir)):
+                for f in filenames:
+                    rel = os.path.relpath(os.path.join(dirpath, f), root)
+                    if rel not in files:
+                        files[rel] = os.path.join(dirpath, f)
+    return files
+
+
+def _sources_hash(group):
+    """
+    Get the hash of the files of a state
+    """
+
+    hashes = []
+    for rel, path in sorted(_source_files(group).items()):
+        with open(path, "rb") as f:
+            hashes.append([rel, hashlib.sha256(f.read()).hexdigest()])
+    return _hash(hashes)
+
+
+def _fingerprint(pillar, sources):
+    """
+    Get the fingerprint of a state from the minion's pillar and the hash of
+    the state's sources
+    """
+
+    return _hash([{k: pillar.get(k) for k in PILLAR_KEYS}, sources])
+
+
+def _load_fingerprints(minion):
+    try:
+        with open(os.path.join(_cache_dir("fingerprints"), "{}.json".format(minion))) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_fingerprints(minion, fingerprints):
+    path = os.path.join(_cache_dir("fingerprints"), "{}.json".format(minion))
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(fingerprints, f)
+    os.replace(tmp, path)
+
+
+def _state_succeeded(ret):
+    """
+    Check the return of a state.apply (dictionary of state results)
+    """
+
+    return isinstance(ret, dict) and bool(ret) and \
+           all(isinstance(r, dict) and r.get("result") is not False for r in ret.values())
+
+
+def fingerprint(tgt, tgt_type="glob", groups=None):
+    """
+    Get the current and the last applied fingerprints of the states of minions
+
+    Args:
+      tgt (string): the minion target
+      tgt_type (string): the target type
+      groups (list of strings): the states (default: bgp-announcements and
+                                ebgp-peerings, bgp-te with single_transaction)
+
+    Returns:
+      dictionary: minion -> state -> {'current': ..., 'applied': ...}
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.fingerprint vmx1-lab
+    """
+
+    groups = groups or _default_groups()
+    sources = {g: _sources_hash(g) for g in groups}
+    ret = {}
+    for minion in _minions(tgt, tgt_type):
+        pillar = _compile_pillar(minion)
+        applied = _load_fingerprints(minion)
+        ret[minion] = {g: {"current": _fingerprint(pillar, sources[g]), "applied": applied.get(g)}
+                       for g in groups}
+    return ret
+
+
+def reconcile(tgt, tgt_type="glob", groups=None, test=False, force=False, concurrency=None):
+    """
+    Apply the states whose inputs changed since their last successful run
+
+    For every minion and state, the fingerprint of the bgp / location pillar
+    and of the state's files is compared with the one stored after the last
+    successful run. States with an unchanged fingerprint are not applied
+    (nothing is rendered or loaded on the device), unless force is True.
+    The fingerprints of all the minions are computed first, then the
+    changed states are applied (all of a minion in one state.apply),
+    apply_concurrency minions at a time.
+
+    Args:
+      tgt (string): the minion target
+      tgt_type (string): the target type
+      groups (list of strings): the states (default: bgp-announcements and
+                                ebgp-peerings, bgp-te with single_transaction)
+      test (boolean): apply the states in test mode (fingerprints are not stored)
+      force (boolean): apply the states even if their fingerprint is unchanged
+      concurrency (int): minions applied at the same time (default:
+                         apply_concurrency)
+
+    Returns:
+      dictionary: minion -> state -> 'unchanged' / 'applied' / 'failed' (or
+                  the state.apply return in test mode)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.reconcile '*'
+    """
+
+    groups = groups or _default_groups()
+    sources = {g: _sources_hash(g) for g in groups}
+    ret = {}
+    # minion -> (stored fingerprints, changed state -> fingerprint)
+    changed = {}
+    for minion in _minions(tgt, tgt_type):
+        pillar = _compile_pillar(minion)
+        applied = _load_fingerprints(minion)
+        ret[minion] = {}
+        for g in groups:
+            fp = _fingerprint(pillar, sources[g])
+            if not force and applied.get(g) == fp:
+                ret[minion][g] = "unchanged"
+                continue
+            changed.setdefault(minion, (applied, {}))[1][g] = fp
+    targets = {m: ",".join(fps) for m, (applied, fps) in changed.items()}
+    results = _apply(targets, test, concurrency) if targets else {}
+    for minion, (applied, fps) in changed.items():
+        for g, fp in fps.items():
+            ret[minion][g] = results.get(minion)
+            if test:
+                continue
+            if results.get(minion) == "applied":
+                applied[g] = fp
+            else:
+                applied.pop(g, None)
+        if not test:
+            _save_fingerprints(minion, applied)
+    return ret
+
+
+def forget(tgt, tgt_type="glob"):
+    """
+    Remove the stored fingerprints of minions, so that the next reconcile
+    applies all states
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.forget vmx1-lab
+    """
+
+    for minion in _minions(tgt, tgt_type):
+        try:
+            os.remove(os.path.join(_cache_dir("fingerprints"), "{}.json".format(minion)))
+        except OSError:
+            pass
+    return True
+
+
+def _impact_index():
+    """
+    Get the change impact index, up to date with the external pillar records
+    """
+
+    index = _INDEX.get("index")
+    if index is None:
+        index = _INDEX["index"] = __utils__["impact_index.load"](_cache_dir("impact"))
+    elif index.refresh():
+        index.save()
+    return index
+
+
+def impact(change):
+    """
+    Get the minions and fragments a netbox or peering-manager change affects
+
+    Args:
+      change (dictionary or json string): the changelog entry (ObjectChange)
+
+    Returns:
+      dictionary: 'minions' maps every affected minion to its fragments,
+      'exact' is False for object types the index does not know (every
+      minion is affected)
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.impact '{"changed_object_type": "peering.autonomoussystem", "changed_object_id": 3, "action": "update", "prechange_data": {"asn": 65100}, "postchange_data": {"asn": 65100}}'
+    """
+
+    if isinstance(change, str):
+        change = json.loads(change)
+    return _impact_index().impact(change)
+
+
+def _setting(name, default=None):
+    """
+    Get a setting from the bgpte key of the master config
+    """
+
+    return (__opts__.get("bgpte") or {}).get(name, default)
+
+
+def _default_groups():
+    """
+    Get the states applied by default, as in top.sls
+    """
+
+    return ["bgp-te"] if _setting("single_transaction", False) else list(DEFAULT_GROUPS)
+
+
+def _webhook_secret():
+    """
+    Get the webhook secret, None if it is not set or a placeholder
+    """
+
+    secret = str(_setting("webhook_secret") or "").strip()
+    if not secret or secret.lower() in PLACEHOLDER_SECRETS:
+        return None
+    return secret
+
+
+def _verify_signature(body, headers):
+    """
+    Check the X-Hook-Signature header of a webhook (hex HMAC-SHA512 of the
+    body with the webhook secret). No webhook is valid without a secret.
+    """
+
+    secret = _webhook_secret()
+    if not secret:
+        return False
+    signature = {k.lower(): v for k, v in (headers or {}).items()}.get("x-hook-signature", "")
+    if not isinstance(body, (str, bytes)):
+        return False
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def _queued():
+    """
+    Get the names of the queued changes, oldest first
+    """
+
+    return sorted([n for n in os.listdir(_cache_dir("queue")) if n.endswith(".json")])
+
+
+def _queued_at(name):
+    """
+    Get the time (seconds since the epoch) a change was queued
+    """
+
+    return int(name.split(".")[0]) / 1e9
+
+
+def _enqueue(change, source, minions=None, delay=0):
+    """
+    Queue a change, named after the time it arrived (plus delay seconds, it
+    is not due before). A change that failed to apply is queued again with
+    the fragments of the minions it affects (minions), instead of the
+    change.
+
+    Returns:
+      string (the name of the queued change)
+    """
+
+    name = "{:020d}.{}.json".format(time.time_ns() + int(delay * 1e9), os.getpid())
+    path = os.path.join(_cache_dir("queue"), name)
+    tmp = "{}.tmp".format(path)
+    queued = {"source": source, "change": change}
+    if minions is not None:
+        queued["minions"] = {m: sorted(f) for m, f in minions.items()}
+    with open(tmp, "w") as f:
+        json.dump(queued, f)
+    os.replace(tmp, path)
+    return name
+
+
+def _apply_state(fragments):
+    """
+    Get the state to apply for the fragments of a minion: both states if
+    both are affected (bgp-te with single_transaction)
+    """
+
+    groups = set()
+    for f in fragments:
+        group = f.split(":")[0]
+        groups.update(["bgp-announcements", "ebgp-peerings"] if group == "*" else [group])
+    if len(groups) > 1:
+        return "bgp-te" if _setting("single_transaction", False) else ",".join(sorted(groups))
+    return groups.pop()
+
+
+def _apply(targets, test=False, concurrency=None):
+    """
+    Apply the states of minions, a batch of concurrency minions at a time
+
+    Args:
+      targets (dictionary): minion -> state
+      test (boolean): apply the states in test mode
+
+    Returns:
+      dictionary: minion -> 'applied' / 'failed' (or the state.apply return
+                  in test mode)
+    """
+
+    concurrency = concurrency or _setting("apply_concurrency", APPLY_CONCURRENCY)
+    client = salt.client.get_local_client(__opts__["conf_file"])
+    by_state = {}
+    for minion, state in targets.items():
+        by_state.setdefault(state, []).append(minion)
+    ret = {}
+    for state, minions in sorted(by_state.items()):
+        for batch_ret in client.cmd_batch(minions, "state.apply", [state], tgt_type="list",
+                                          kwarg={"test": test}, batch=str(concurrency)):
+            for minion, res in batch_ret.items():
+                if isinstance(res, dict) and "ret" in res:
+                    res = res["ret"]
+                if test:
+                    ret[minion] = res
+                elif _state_succeeded(res):
+                    ret[minion] = "applied"
+                else:
+                    log.error("bgpte: state %s failed on %s: %s", state, minion, res)
+                    ret[minion] = "failed"
+        for minion in minions:
+            ret.setdefault(minion, None if test else "failed")
+    return ret
+
+
+def _due(names):
+    """
+    Check if the queued changes are due: no change arrived for
+    webhook_debounce seconds, or the oldest one waited webhook_max_delay
+    seconds. Changes queued again after a failure count once their retry
+    time has come.
+    """
+
+    now = time.time()
+    queued = [_queued_at(n) for n in names if _queued_at(n) <= now]
+    if not queued:
+        return False
+    debounce = float(_setting("webhook_debounce", WEBHOOK_DEBOUNCE))
+    max_delay = float(_setting("webhook_max_delay", WEBHOOK_MAX_DELAY))
+    return now - max(queued) >= debounce or now - min(queued) >= max_delay
+
+
+def flush(test=False, concurrency=None, due=False):
+    """
+    Apply the queued webhook changes: the states of the minions they
+    affect, looked up in the change impact index
+
+    Only one flush runs at a time; changes queued while a flush applies
+    states are applied by the next one. The changes of the minions whose
+    state failed are queued again, due webhook_retry_delay seconds later.
+
+    Args:
+      test (boolean): apply the states in test mode (the queue is kept)
+      concurrency (int): minions applied at the same time (default:
+                         apply_concurrency)
+      due (boolean): only flush if the changes are due (see webhook), and
+                     return right away if a flush is running. The master
+                     schedule runs it so.
+
+    Returns:
+      dictionary: the number of changes, whether the impact is exact, the
+      state applied per minion, the results and the seconds from the oldest
+      change to the end of the apply
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.flush
+    """
+
+    with open(os.path.join(_cache_dir("queue"), ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (fcntl.LOCK_NB if due else 0))
+        except (IOError, OSError):
+            return {"changes": 0, "running": True}
+        names = _queued()
+        if not names or (due and not _due(names)):
+            return {"changes": 0}
+        index = _impact_index()
+        exact = True
+        fragments = {}
+        for name in names:
+            path = os.path.join(_cache_dir("queue"), name)
+            try:
+                with open(path) as f:
+                    queued = json.load(f)
+            except (IOError, OSError, ValueError) as e:
+                log.error("bgpte: queued change %s: %s", name, e)
+                continue
+            if "minions" in queued:
+                found = {"minions": queued["minions"], "exact": True}
+            else:
+                found = index.impact(queued["change"])
+            exact = exact and found["exact"]
+            for minion, frags in found["minions"].items():
+                fragments.setdefault(minion, set()).update(frags)
+        targets = {m: _apply_state(f) for m, f in sorted(fragments.items())}
+        log.info("bgpte: %d queued changes affect %d minions", len(names), len(targets))
+        ret = {"changes": len(names), "exact": exact, "states": targets,
+               "results": _apply(targets, test, concurrency) if targets else {}}
+        if not test:
+            failed = {m: fragments[m] for m, r in ret["results"].items() if r != "applied"}
+            if failed:
+                ret["requeued"] = _enqueue(None, "flush", failed,
+                                           float(_setting("webhook_retry_delay", WEBHOOK_RETRY_DELAY)))
+                log.error("bgpte: queued the changes of %d failed minions again", len(failed))
+            for name in names:
+                try:
+                    os.remove(os.path.join(_cache_dir("queue"), name))
+                except OSError:
+                    pass
+        ret["seconds"] = round(max(time.time() - _queued_at(names[0]), 0), 3)
+        log.info("bgpte: applied %d changes in %.1f sec", len(names), ret["seconds"])
+        return ret
+
+
+def webhook(source, body, headers=None):
+    """
+    Queue the change of a netbox or peering-manager webhook
+
+    Run by the reactor for the salt/netapi/hook/bgpte/<source> events, so
+    it only checks the signature and queues the change. Edits come in
+    bursts (eg tagging a few prefixes): the scheduled bgpte.flush due=True
+    applies the affected states webhook_debounce seconds after the last
+    change; a change never waits more than webhook_max_delay seconds.
+
+    Args:
+      source (string): netbox or peering-manager
+      body (string): the webhook body (json)
+      headers (dictionary): the webhook headers (X-Hook-Signature is
+                            checked against webhook_secret; webhooks are
+                            refused if it is not set)
+
+    Returns:
+      dictionary: the queued change
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.webhook netbox '{"event": "updated", "model": "prefix", "data": {"id": 34, ...}, ...}'
+    """
+
+    if not _webhook_secret():
+        log.error("bgpte: %s webhook refused, webhook_secret is not set (or a placeholder)", source)
+        return {"error": "webhook_secret is not set"}
+    if not _verify_signature(body, headers):
+        log.error("bgpte: %s webhook with a bad signature", source)
+        return {"error": "bad signature"}
+    try:
+        payload = json.loads(body) if isinstance(body, (str, bytes)) else body
+    except ValueError as e:
+        log.error("bgpte: %s webhook: %s", source, e)
+        return {"error": "bad body: {}".format(e)}
+    change = __utils__["impact_index.webhook_change"](payload)
+    return {"queued": _enqueue(change, source)}
+
+
+def _fast_path_settings():
+    """
+    Get the settings of the fast path changes from the config.j2 templates
+    of the states (they only set variables, so plain jinja2 renders them)
+    """
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(__opts__["file_roots"]["base"]))
+    settings = {}
+    for path, names in FAST_PATH_SETTINGS.items():
+        conf = env.get_template(path).module
+        settings.update({n: getattr(conf, n) for n in names})
+    return settings
+
+
+def _fan_out(fun, prefix, tgt, tgt_type, kwarg, test):
+    """
+    Call a fast path function of the bgpte execution module on minions, all
+    of them at once
+
+    Returns:
+      dictionary: minion -> result, comment and seconds (plus the diff in
+      test mode)
+    """
+
+    client = salt.client.get_local_client(__opts__["conf_file"])
+    returns = client.cmd(tgt, fun, [prefix], tgt_type=tgt_type, kwarg=kwarg)
+    minions = {}
+    for minion, res in sorted(returns.items()):
+        if not isinstance(res, dict):
+            res = {"result": False, "comment": str(res)}
+        minions[minion] = {k: res.get(k) for k in ["result", "comment", "seconds"]}
+        if test:
+            minions[minion]["diff"] = res.get("diff")
+        if not res.get("result"):
+            log.error("bgpte: %s %s failed on %s: %s", fun, prefix, minion, res.get("comment"))
+    return minions
+
+
+def blackhole(prefix, tgt="*", tgt_type="glob", withdraw=False, test=False):
+    """
+    Blackhole a prefix (RTBH) on routers, or withdraw its blackhole
+
+    The prefix is checked against our allocations on the master, then every
+    targeted minion commits (or deletes) the blackhole route of the prefix
+    with bgpte.blackhole: a few set commands, no render of the states. The
+    minions are called in parallel.
+
+    Args:
+      prefix (string): the prefix, in our allocations
+      tgt (string): the minion target (default: all)
+      tgt_type (string): the target type
+      withdraw (boolean): remove the blackhole route
+      test (boolean): only compute the diff
+
+    Returns:
+      dictionary: result, the prefix, per minion the result, comment and
+      load / commit seconds, and the seconds from the request to the last
+      commit
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.blackhole 100.64.1.1/32
+        salt-run bgpte.blackhole 2001:db8:100::1/128 tgt='vmx*'
+        salt-run bgpte.blackhole 100.64.1.1/32 withdraw=True
+    """
+
+    t0 = time.time()
+    settings = _fast_path_settings()
+    try:
+        prefix = __utils__["rtbh.validate"](prefix, settings["v4_allocations"], settings["v6_allocations"])
+    except ValueError as e:
+        return {"result": False, "comment": str(e)}
+    minions = _fan_out("bgpte.blackhole", prefix, tgt, tgt_type,
+                       {"withdraw": withdraw, "test": test, "settings": settings}, test)
+    seconds = round(time.time() - t0, 3)
+    log.info("bgpte: %s blackhole %s on %d minions in %.2f sec", "withdraw" if withdraw else "set",
+             prefix, len(minions), seconds)
+    return {"result": bool(minions) and all(m["result"] for m in minions.values()),
+            "prefix": prefix, "withdraw": withdraw, "minions": minions, "seconds": seconds}
+
+
+def te(prefix, communities, tgt="*", tgt_type="glob", test=False):
+    """
+    Replace the communities of an announcement: in netbox, then on routers
+
+    The community tags of the netbox aggregate or prefix are replaced (the
+    other tags and the announcement community are kept, missing community
+    tags are created). Then every targeted minion replaces the community
+    list of the route with bgpte.set_communities, a few set commands with
+    no render of the states. The minions are called in parallel. This is
+    the path for day to day TE changes; the next apply of the states
+    renders the same route from the updated pillar. A netbox prefix merged
+    with its siblings by the aggregation of the netbox external pillar
+    (--aggregate) is not a route of the routers: the minions skip it (not
+    announced), only the next apply of bgp-announcements renders the
+    change.
+
+    Args:
+      prefix (string): the announcement prefix
+      communities (list or comma separated string): the new communities
+      tgt (string): the minion target (default: all)
+      tgt_type (string): the target type
+      test (boolean): netbox is not changed, the minions compute the diff
+
+    Returns:
+      dictionary: result, the prefix, the netbox object with its previous
+      and new communities, per minion the result, comment and load /
+      commit seconds, and the seconds from the request to the last commit
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt-run bgpte.te 100.65.0.0/16 65000:400:250,65000:62:65100
+        salt-run bgpte.te 2001:db8:2000::/36 '[65000:400:840, 65000:40:65101]' test=True
+    """
+
+    t0 = time.time()
+    if isinstance(communities, str):
+        communities = [c.strip() for c in communities.split(",") if c.strip()]
+    announcement_community = os.environ.get("BGP_ANNOUNCEMENT_COMMUNITY")
+    try:
+        api = __utils__["announcement_te.connect"](os.environ.get("NETBOX_API_BASE_URL", ""),
+                                                    os.environ.get("NETBOX_API_TOKEN", ""),
+                                                    _setting("netbox_sslverify", True))
+        if not (api.api_base_url.startswith("http") and announcement_community):
+            raise ValueError("missing NETBOX_API_BASE_URL, NETBOX_API_TOKEN or BGP_ANNOUNCEMENT_COMMUNITY")
+        kind, obj = api.find_announcement(prefix, announcement_community)
+        tags = __utils__["announcement_te.with_communities"](obj["tags"], communities, announcement_community)
+        new = [t for t in tags if __utils__["announcement_te.is_community"](t)]
+        old = sorted([t for t in __utils__["announcement_te.tag_names"](obj["tags"])
+                      if __utils__["announcement_te.is_community"](t)])
+        if not test:
+            api.ensure_tags(new)
+            api.set_tags(kind, obj["id"], tags)
+    except Exception as e:
+        log.error("bgpte: te %s: %s", prefix, e)
+        return {"result": False, "comment": str(e)}
+    netbox = {"object": "{}:{}".format(kind, obj["id"]), "old": old, "new": new,
+              "seconds": round(time.time() - t0, 3)}
+    minions = _fan_out("bgpte.set_communities", obj["prefix"], tgt, tgt_type,
+                       {"communities": new, "route_type": __utils__["announcement_te.route_type"](obj["tags"]),
+                        "test": test, "settings": _fast_path_settings()}, test)
+    seconds = round(time.time() - t0, 3)
+    log.info("bgpte: communities of %s set on %d minions in %.2f sec", obj["prefix"], len(minions), seconds)
+    return {"result": bool(minions) and all(m["result"] for m in minions.values()),
+            "prefix": obj["prefix"], "netbox": netbox, "minions": minions, "seconds": seconds}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+Salt state module for the bgp-te-tool states.
+
+Renders the configuration of a state via the bgpte execution module (from
+cached fragments) and loads it on the device, like netconfig.managed does
+for a full template.
+
+Example:
+
+  Configure eBGP peerings:
+    bgpte.managed:
+      - group: ebgp-peerings
+      - render_cache: true
+
+  Configure BGP announcements and eBGP peerings:
+    bgpte.managed:
+      - group:
+        - bgp-announcements
+        - ebgp-peerings
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+__virtualname__ = "bgpte"
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def managed(name, group, render_cache=True, fragments=True, skip_unchanged=True, output="replace",
+            stream=False, debug=False):
+    """
+    Manage the configuration of a bgp-te-tool state on the device
+
+    Args:
+      name (string): the state id
+      group (string or list): the state whose configuration is managed
+                              (ebgp-peerings or bgp-announcements) or a list
+                              of states, loaded and committed in a single
+                              transaction
+      render_cache (boolean): use the fragment render cache
+      fragments (boolean): render from fragments. If False the full template
+                           of the state is rendered
+      skip_unchanged (boolean): do not load the configuration on the device when
+                                it is the one last committed and the device
+                                has no newer commit
+      output (string): "replace" loads the full groups, "set" loads the set /
+                       delete commands from the last committed configuration
+                       (the full groups when it is not known), "xml" loads
+                       the full groups as JunOS XML
+      stream (boolean): stream the "replace" output to the device through a
+                        spool file, without building it in memory
+      debug (boolean): include the loaded configuration in the result
+
+    Returns:
+      state return dictionary
+    """
+
+    ret = {"name": name, "result": False, "changes": {}, "comment": ""}
+    test = __opts__.get("test", False)
+    res = __salt__["bgpte.apply"](group, test=test, debug=debug, cache=render_cache, fragments=fragments,
+                                   skip_unchanged=skip_unchanged, output=output, stream=stream)
+    ret["comment"] = res.get("comment", "")
+    if not res.get("result"):
+        return ret
+    if res.get("already_configured"):
+        ret["result"] = True
+        if not ret["comment"]:
+            ret["comment"] = "Already configured."
+        return ret
+    ret["changes"]["diff"] = res.get("diff")
+    if debug:
+        ret["changes"]["loaded_config"] = res.get("loaded_config")
+    ret["result"] = None if test else True
+    if not ret["comment"]:
+        ret["comment"] = "Configuration changed!" if not test else "Configuration discarded."
+    return ret
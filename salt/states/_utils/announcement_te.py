@@ -0,0 +1,595 @@
+# -*- coding: utf-8 -*-
+
+"""
+Traffic engineering (TE) of the BGP announcements of the bgp-te-tool.
+
+The communities of an announcement are the community tags of its netbox
+prefix or aggregate (see netbox_extpillar.py). This module changes them in
+netbox and builds the set / delete commands that change the community
+list of the route on a router, in the BGP-ANNOUNCEMENTS group, without a
+render of the bgp-announcements state.
+
+Bulk TE actions (eg prepend x2 at location FR for all prefixes tagged FR,
+stop announcing to AS65202) are planned locally against a snapshot of the
+announcements (snapshot, select, plan_action) and written with the bulk
+update endpoints of netbox (Netbox.bulk_update). An action sets the out
+policy behaviour towards a peer ASN or a location: the communities of the
+other actions towards the same target are removed, since the out policy
+applies only the first matching one.
+
+The community tags of all the actions towards the peer ASNs and locations
+are provisioned in bulk (action_tags, Netbox.tags, Netbox.create_tags), so
+that the TE of a new peer or location only needs tagging the
+announcements.
+
+check_actions finds the contradictory and shadowed TE actions of the
+announcements (eg no-announce and prepend towards the same peer), which
+the out policy resolves silently by term order, and the actions towards
+peer ASNs or locations that do not exist. The peer ASNs are the ones of
+peering-manager (peer_asns), optionally cached in a file for the pillar
+runs of all the minions.
+
+The netbox client needs the requests package (the salt-master and the
+scripts have it).
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+import ipaddress
+import json
+import os
+import re
+import time
+
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+#----------------- Global settings -------------------
+# Configuration group of the bgp-announcements state
+ANNOUNCEMENTS_GROUP = "BGP-ANNOUNCEMENTS"
+# netbox endpoints of the announcement objects, by kind
+NETBOX_ENDPOINTS = {"aggregate": "ipam/aggregates/", "prefix": "ipam/prefixes/"}
+NETBOX_TAGS = "extras/tags/"
+# peering-manager endpoint of the autonomous systems
+PEERING_MANAGER_ASNS = "peering/autonomous-systems/"
+# Seconds the peer ASNs of a cache file are used for
+PEER_ASNS_MAX_AGE = 3600
+# Objects per page of the netbox list requests
+PAGE_SIZE = 1000
+# Tag names per filtered tag request
+TAG_FILTER_SIZE = 50
+# Objects per bulk update request
+BULK_BATCH = 100
+# TE actions: the large community data1 of every action, per target kind
+# (peer ASN or location code), in the term order of the out policy. Target 0
+# (any peer / location) has only no-announce.
+TE_ACTIONS = {
+    "peer": {"no-announce": 40, "announce": 41, "prepend1": 61, "prepend2": 62, "prepend3": 63},
+    "location": {"no-announce": 400, "prepend1": 601, "prepend2": 602, "prepend3": 603},
+}
+#----------------- Global settings -------------------
+
+
+class NetboxError(Exception):
+    pass
+
+
+def is_community(s):
+    """
+    Check if a tag is a BGP community (as netbox_extpillar.py does)
+    """
+
+    # large communities
+    if re.match(r'\d+:\d+:\d+$', s):
+        return True
+    # regular communities
+    elif re.match(r'\d{1,5}:\d{1,5}$', s) or \
+         re.match(r'(no-advertise)|(no-export)|(no-export-subconfed)$', s, re.I):
+        return True
+    # extended communities
+    elif re.match(r'(origin)|(target):\d+:\d+$', s) or \
+         re.match(r'(origin)|(target):\d+\.\d+\.\d+\.\d+:\d+$', s):
+        return True
+    return False
+
+
+def slugify(s, num_chars=50):
+    """
+    Get the netbox slug of a string (eg of a tag name)
+    """
+
+    st = re.sub(r'[^\-\.\w\s]', '', s)
+    st = re.sub(r'^[\s\.]+|[\s\.]+$', r'', st)
+    st = re.sub(r'[\-\.\s]+', r'-', st)
+    return (st.lower()[:num_chars])
+
+
+def tag_names(tags):
+    """
+    Get the names of netbox tags (dictionaries or names)
+    """
+
+    return [t["name"] if isinstance(t, dict) else t for t in tags]
+
+
+def route_type(tags):
+    """
+    Get the route type of an announcement from its tags (default: aggregate)
+    """
+
+    for tag in tag_names(tags):
+        if tag.lower().startswith("route-type:"):
+            return tag.lower().split(":")[1]
+    return "aggregate"
+
+
+def with_communities(tags, communities, announcement_community):
+    """
+    Get the tags of an announcement with its communities replaced
+
+    The tags that are not communities are kept. The announcement community
+    is always kept, otherwise the prefix is no longer an announcement.
+
+    Args:
+      tags (list): the current tags (dictionaries or names)
+      communities (list of strings): the new communities
+      announcement_community (string): eg 65000:3:1999
+
+    Returns:
+      list of strings (tag names)
+
+    Raises:
+      ValueError if a community is not valid
+    """
+
+    for c in communities:
+        if not is_community(c):
+            raise ValueError("{} is not a BGP community".format(c))
+    kept = [t for t in tag_names(tags) if not is_community(t)]
+    return kept + sorted(set(communities) | set([announcement_community]))
+
+
+def route_members(communities):
+    """
+    Get the community list of a route as rendered by lib.j2 (unique, sorted,
+    large communities with the large: prefix)
+    """
+
+    return [re.sub(r'(\d+:\d+:\d+$)', r'large:\1', c) for c in sorted(set(communities))]
+
+
+def route_config(prefix, route_type, communities, rib, group=ANNOUNCEMENTS_GROUP):
+    """
+    Get the set / delete commands that replace the community list of an
+    announcement route
+
+    Args:
+      prefix (string): the route prefix
+      route_type (string): static or aggregate
+      communities (list of strings): the communities of the route
+      rib (string): the configuration path of the rib of the prefix (see
+                    rtbh.rib)
+      group (string): the configuration group of the routes
+
+    Returns:
+      string (the JunOS set commands)
+    """
+
+    route = "groups {} {} {} route {} community".format(group, rib, route_type, ipaddress.ip_network(prefix))
+    return "delete {0}\nset {0} [ {1} ]\n".format(route, " ".join(route_members(communities)))
+
+
+def action_community(local_asn, action, kind, target):
+    """
+    Get the community of a TE action (eg 65000:62:65100)
+
+    Args:
+      local_asn (int): our AS number
+      action (string): a TE_ACTIONS action (no-announce, announce, prepend1-3)
+      kind (string): peer or location
+      target (int): the peer ASN or location code (0: any)
+
+    Raises:
+      ValueError for unknown actions or targets
+    """
+
+    if action not in TE_ACTIONS.get(kind, {}):
+        raise ValueError("unknown {} action {}".format(kind, action))
+    if int(target) == 0 and action != "no-announce":
+        raise ValueError("only no-announce applies to any {}".format(kind))
+    return "{}:{}:{}".format(local_asn, TE_ACTIONS[kind][action], int(target))
+
+
+def action_tags(local_asn, asns, location_codes):
+    """
+    Get the community tags of all the TE actions towards peer ASNs and
+    locations, including no-announce to any peer / location
+
+    Args:
+      local_asn (int): our AS number
+      asns (iterable of ints): the peer ASNs
+      location_codes (iterable of ints): the location codes (eg the values of
+                                         the ebgp-peerings geolocations)
+
+    Returns:
+      sorted list of strings
+    """
+
+    names = set([action_community(local_asn, "no-announce", kind, 0) for kind in TE_ACTIONS])
+    for kind, targets in [("peer", asns), ("location", location_codes)]:
+        for target in set([int(t) for t in targets]) - set([0]):
+            names.update([action_community(local_asn, action, kind, target) for action in TE_ACTIONS[kind]])
+    return sorted(names)
+
+
+def check_actions(announcements, local_asn, peer_asns=None, location_codes=None):
+    """
+    Find the TE actions of announcements that the out policy does not apply
+    as written, in one pass over the communities:
+
+      contradictory: several actions towards the same peer ASN / location
+                     (the first in term order wins), or announce / prepend
+                     actions under no-announce to any peer / location
+      shadowed: no-announce towards a peer ASN / location under no-announce
+                to any peer / location (redundant)
+      invalid: announce / prepend actions towards any peer / location (target
+               0), no term matches them
+      unknown-asn, unknown-location: actions towards a peer ASN / location
+                                     code that is not in peer_asns /
+                                     location_codes (not checked if None)
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      local_asn (int): our AS number
+      peer_asns (set of ints): the known peer ASNs
+      location_codes (set of ints): the known location codes
+
+    Returns:
+      list of dictionaries: prefix, kind, the communities involved and a
+      description
+    """
+
+    prefix = "{}:".format(local_asn)
+    kinds = {}
+    for kind, actions in TE_ACTIONS.items():
+        for order, data1 in enumerate(actions.values()):
+            kinds[str(data1)] = (kind, order)
+    findings = []
+    for a in announcements:
+        targets = {}
+        for c in a["communities"]:
+            if not c.startswith(prefix):
+                continue
+            parts = c.split(":")
+            if len(parts) == 3 and parts[1] in kinds:
+                kind, order = kinds[parts[1]]
+                targets.setdefault((kind, int(parts[2])), []).append((order, c))
+        if not targets:
+            continue
+        # the no-announce to any peer / location
+        any_peer = ([c for order, c in targets.get(("peer", 0), []) if order == 0] or [None])[0]
+        any_location = ([c for order, c in targets.get(("location", 0), []) if order == 0] or [None])[0]
+        if any_peer and any_location:
+            findings.append({"prefix": a["prefix"], "kind": "shadowed", "communities": [any_peer, any_location],
+                             "description": "{} is redundant with {}".format(any_location, any_peer)})
+        for (kind, target), actions in sorted(targets.items()):
+            if target == 0:
+                for order, c in actions:
+                    if order != 0:
+                        findings.append({"prefix": a["prefix"], "kind": "invalid", "communities": [c],
+                                         "description": "{} has no effect: only no-announce applies to any {}".format(c, kind)})
+                continue
+            actions.sort()
+            communities = [c for order, c in actions]
+            # no-announce to any peer comes before all the other actions,
+            # no-announce to any location before the location actions
+            cover = any_peer or (any_location if kind == "location" else None)
+            if cover:
+                for order, c in actions:
+                    findings.append({"prefix": a["prefix"], "kind": "shadowed" if order == 0 else "contradictory",
+                                     "communities": [cover, c],
+                                     "description": "{} is not applied under {}".format(c, cover)})
+            elif len(actions) > 1:
+                findings.append({"prefix": a["prefix"], "kind": "contradictory", "communities": communities,
+                                 "description": "{} wins over {} by term order".format(communities[0],
+                                                                                       ", ".join(communities[1:]))})
+            known = peer_asns if kind == "peer" else location_codes
+            if known is not None and target not in known:
+                findings.append({"prefix": a["prefix"], "kind": "unknown-{}".format("asn" if kind == "peer" else kind),
+                                 "communities": communities,
+                                 "description": "{} {} is unknown".format("peer ASN" if kind == "peer" else "location code",
+                                                                          target)})
+    return findings
+
+
+def apply_action(communities, local_asn, action, kind, target):
+    """
+    Get the communities of an announcement after a TE action
+
+    The communities of the other actions towards the target are removed.
+    Action clear removes them all.
+
+    Returns:
+      sorted list of strings
+    """
+
+    target = int(target)
+    actions = TE_ACTIONS[kind].items() if target else [("no-announce", TE_ACTIONS[kind]["no-announce"])]
+    remove = set(["{}:{}:{}".format(local_asn, data1, target) for name, data1 in actions])
+    new = set(communities) - remove
+    if action != "clear":
+        new.add(action_community(local_asn, action, kind, target))
+    return sorted(new)
+
+
+def snapshot(api, announcement_community):
+    """
+    Get the announcements of netbox: the aggregates and prefixes tagged with
+    the announcement community
+
+    Returns:
+      list of dictionaries: kind (aggregate or prefix), id, prefix, family
+      (IPv4 or IPv6) and tags (names)
+    """
+
+    objects = []
+    for kind, path in sorted(NETBOX_ENDPOINTS.items()):
+        for o in api.get_all(path, {"tag": slugify(announcement_community)}):
+            objects.append({"kind": kind, "id": o["id"], "prefix": o["prefix"],
+                            "family": "IPv{}".format(ipaddress.ip_network(o["prefix"]).version),
+                            "tags": tag_names(o["tags"])})
+    return objects
+
+
+def select(objects, tags=None, prefixes=None, within=None, family=None):
+    """
+    Select announcements of a snapshot
+
+    Args:
+      objects (list): from snapshot
+      tags (list of strings): the announcements must have all these tags
+      prefixes (list of strings): one of these prefixes
+      within (list of strings): inside one of these prefixes
+      family (string): IPv4 or IPv6
+
+    Returns:
+      list (the selected objects)
+    """
+
+    exact = set([str(ipaddress.ip_network(p)) for p in prefixes or []])
+    ranges = [ipaddress.ip_network(p) for p in within or []]
+    selected = []
+    for o in objects:
+        if family and o["family"] != family:
+            continue
+        if tags and not set(tags) <= set(o["tags"]):
+            continue
+        network = ipaddress.ip_network(o["prefix"])
+        if exact and str(network) not in exact:
+            continue
+        if ranges and not any(network.version == r.version and network.subnet_of(r) for r in ranges):
+            continue
+        selected.append(o)
+    return selected
+
+
+def plan_action(objects, local_asn, action, kind, target):
+    """
+    Get the tag changes of a TE action on announcements
+
+    Returns:
+      list of dictionaries: the object (kind, id, prefix), its new tags and
+      the communities added and removed, for the objects that change
+    """
+
+    changes = []
+    for o in objects:
+        old = [t for t in o["tags"] if is_community(t)]
+        new = apply_action(old, local_asn, action, kind, target)
+        if set(new) == set(old):
+            continue
+        changes.append({"kind": o["kind"], "id": o["id"], "prefix": o["prefix"],
+                        "tags": [t for t in o["tags"] if not is_community(t)] + new,
+                        "added": sorted(set(new) - set(old)), "removed": sorted(set(old) - set(new))})
+    return changes
+
+
+class Netbox(object):
+    """
+    Minimal netbox REST API client
+
+    Args:
+      api_base_url (string): eg https://netbox.infra.msv/api/
+      api_token (string): the API token
+      sslverify (boolean): whether to check the server cert
+    """
+
+    def __init__(self, api_base_url, api_token, sslverify=True):
+        if not HAS_REQUESTS:
+            raise NetboxError("the requests package is not installed")
+        self.api_base_url = api_base_url if api_base_url.endswith("/") else api_base_url + "/"
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": "Token {}".format(api_token),
+                                     "Accept": "application/json"})
+        self.session.verify = sslverify
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request, path relative to the API base url (or a full url)
+
+        Returns:
+          the decoded json body (None if there is none)
+
+        Raises:
+          NetboxError on failures
+        """
+
+        url = path if path.startswith("http") else self.api_base_url + path
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise NetboxError("{} {}: {}".format(method, url, e))
+        if r.status_code >= 400:
+            raise NetboxError("{} {}: {} {}".format(method, url, r.status_code, r.text[:500]))
+        return r.json() if r.content else None
+
+    def get_all(self, path, params=None):
+        """
+        Get all the objects of a list endpoint, following the pages
+
+        Returns:
+          list of dictionaries
+        """
+
+        params = dict(params or {})
+        params.setdefault("limit", PAGE_SIZE)
+        data = self.request("GET", path, params=params)
+        objects = data["results"]
+        while data.get("next"):
+            data = self.request("GET", data["next"])
+            objects.extend(data["results"])
+        return objects
+
+    def find_announcement(self, prefix, announcement_community):
+        """
+        Get the netbox aggregate or prefix of an announcement
+
+        Returns:
+          (kind, object) tuple: kind is aggregate or prefix
+
+        Raises:
+          NetboxError if there is no such announcement
+        """
+
+        params = {"prefix": str(ipaddress.ip_network(prefix)), "tag": slugify(announcement_community)}
+        for kind, path in sorted(NETBOX_ENDPOINTS.items()):
+            found = self.get_all(path, params)
+            if found:
+                return (kind, found[0])
+        raise NetboxError("{} is not a BGP announcement in netbox".format(prefix))
+
+    def ensure_tags(self, names):
+        """
+        Create the tags that do not exist
+
+        Returns:
+          list of strings (the names of the tags created)
+        """
+
+        names = sorted(set(names))
+        existing = set()
+        for i in range(0, len(names), TAG_FILTER_SIZE):
+            existing.update([t["name"] for t in self.get_all(NETBOX_TAGS, {"name": names[i:i + TAG_FILTER_SIZE]})])
+        missing = [n for n in names if n not in existing]
+        self.create_tags(missing)
+        return missing
+
+    def tags(self):
+        """
+        Get all the tags (brief representation, one paginated fetch)
+
+        Returns:
+          dictionary: name -> slug
+        """
+
+        return {t["name"]: t["slug"] for t in self.get_all(NETBOX_TAGS, {"brief": 1})}
+
+    def create_tags(self, names, batch=BULK_BATCH):
+        """
+        Create tags with bulk POST requests, batch tags per request
+
+        Returns:
+          int (the number of requests)
+        """
+
+        names = list(names)
+        for i in range(0, len(names), batch):
+            self.request("POST", NETBOX_TAGS, json=[{"name": n, "slug": slugify(n)} for n in names[i:i + batch]])
+        return (len(names) + batch - 1) // batch
+
+    def bulk_update(self, kind, updates, batch=BULK_BATCH):
+        """
+        Update aggregates or prefixes with the bulk update endpoint, batch
+        objects per request
+
+        Args:
+          kind (string): aggregate or prefix
+          updates (list of dictionaries): the id and the changed fields of
+                                          every object (tags as names)
+
+        Returns:
+          int (the number of requests)
+        """
+
+        requests_sent = 0
+        for i in range(0, len(updates), batch):
+            data = []
+            for u in updates[i:i + batch]:
+                u = dict(u)
+                if "tags" in u:
+                    u["tags"] = [{"name": n} for n in u["tags"]]
+                data.append(u)
+            self.request("PATCH", NETBOX_ENDPOINTS[kind], json=data)
+            requests_sent += 1
+        return requests_sent
+
+    def set_tags(self, kind, obj_id, names):
+        """
+        Replace the tags of an aggregate or prefix
+        """
+
+        return self.request("PATCH", "{}{}/".format(NETBOX_ENDPOINTS[kind], obj_id),
+                            json={"tags": [{"name": n} for n in names]})
+
+
+def connect(api_base_url, api_token, sslverify=True):
+    """
+    Get a netbox client (see Netbox)
+    """
+
+    return Netbox(api_base_url, api_token, sslverify)
+
+
+def peer_asns(api_base_url, api_token, sslverify=True, cache=None, max_age=PEER_ASNS_MAX_AGE):
+    """
+    Get the peer ASNs of peering-manager: the autonomous systems that are
+    not affiliated (ie not ours). peering-manager has the REST API of
+    netbox, it is read with the Netbox client.
+
+    Args:
+      api_base_url (string): eg https://peering-manager.infra.msv/api/
+      api_token (string): the API token
+      sslverify (boolean): whether to check the server cert
+      cache (string): a json cache file, None for no cache. Its ASNs are
+                      used for max_age seconds
+      max_age (int): see cache
+
+    Returns:
+      asns (sorted list of ints)
+
+    Raises:
+      NetboxError on failures
+    """
+
+    if cache:
+        try:
+            with open(cache) as f:
+                data = json.load(f)
+            if data.get("url") == api_base_url and time.time() - data.get("time", 0) < max_age:
+                return data["asns"]
+        except (IOError, OSError, ValueError):
+            pass
+    api = Netbox(api_base_url, api_token, sslverify)
+    asns = sorted(set([int(a["asn"]) for a in api.get_all(PEERING_MANAGER_ASNS)
+                       if str(a.get("affiliated")).lower() != "true"]))
+    if cache:
+        if os.path.dirname(cache):
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+        tmp = "{}.{}.tmp".format(cache, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"url": api_base_url, "time": time.time(), "asns": asns}, f)
+        os.replace(tmp, cache)
+    return asns
@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Community bitmap index of the BGP announcements of the bgp-te-tool.
+
+Every announcement (a netbox aggregate or prefix tagged with the
+announcement community) gets a small integer id and every community
+(large, regular or extended) maps to the bitmap of the ids of the
+announcements that carry it. Questions such as "which prefixes carry
+no-announce for AS65202" or "which prefixes prepend at location 250" are
+bitmap operations instead of scans of the community lists:
+
+  65000:40:65202
+  65000:60?:250
+  65000:3:1999 & 65000:61:65100 - 65000:400:250
+  ( 65000:62:* | 65000:602:* ) & all
+
+The bitmaps are compressed the way roaring bitmaps are: the ids are split
+in chunks of 65536 and a chunk is a sorted array of 16 bit values when it
+has at most ARRAY_MAX ids, a bitset (a python int) otherwise. AND, OR and
+ANDNOT work chunk by chunk, so they take microseconds on dense bitmaps of
+1M announcements and sparse bitmaps stay small.
+
+The index is built from a netbox snapshot of the announcements (see
+announcement_te.snapshot) or from the announcement pillar and updated
+incrementally: update() compares the communities of every announcement
+with the indexed ones and only touches the bitmaps of the differences. It
+is saved in a pickle file.
+
+The module is also a command line program:
+
+  community_index.py -i /var/cache/salt/master/bgpte/communities.pickle refresh
+  community_index.py -i /var/cache/salt/master/bgpte/communities.pickle query '65000:40:65202'
+  community_index.py -i /var/cache/salt/master/bgpte/communities.pickle refresh -p pillar.json
+  community_index.py -i /var/cache/salt/master/bgpte/communities.pickle stats
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename, dirname
+from logging.handlers import SysLogHandler
+from array import array
+import logging
+import argparse
+import datetime
+import fnmatch
+import sys
+import json
+import os
+import pickle
+
+#----------------- Global settings -------------------
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_BYTES = CHUNK_SIZE // 8
+# Largest array chunk, a bitset chunk takes CHUNK_BYTES. Lower than the 4096
+# of roaring bitmaps: the bitset operations run in C, the array ones in python
+ARRAY_MAX = 1024
+PICKLE_VERSION = 1
+# Query operators, in decreasing precedence (as the python set operators)
+QUERY_OPERATORS = [["-", "andnot"], ["&", "and"], ["|", "or"]]
+#----------------- Global settings -------------------
+
+
+def _write_atomic(path, data):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _popcount(v):
+    return v.bit_count() if hasattr(v, "bit_count") else bin(v).count("1")
+
+
+def _bitset(values):
+    b = bytearray(CHUNK_BYTES)
+    for x in values:
+        b[x >> 3] |= 1 << (x & 7)
+    return int.from_bytes(b, "little")
+
+
+def _bitset_values(v):
+    b = v.to_bytes(CHUNK_BYTES, "little")
+    values = []
+    for i, byte in enumerate(b):
+        if byte:
+            for j in range(8):
+                if byte >> j & 1:
+                    values.append(i << 3 | j)
+    return values
+
+
+def _chunk(values):
+    """
+    Get the chunk of sorted unique 16 bit values (None if empty)
+    """
+
+    if not values:
+        return None
+    if len(values) > ARRAY_MAX:
+        return _bitset(values)
+    return array("H", values)
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return a & b or None
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        bb = b.to_bytes(CHUNK_BYTES, "little")
+        return _chunk([x for x in a if bb[x >> 3] >> (x & 7) & 1])
+    return _chunk(sorted(set(a).intersection(b)))
+
+
+def _or(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return a | b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return b | _bitset(a)
+    return _chunk(sorted(set(a).union(b)))
+
+
+def _andnot(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return a & ~b or None
+    if isinstance(a, int):
+        return a & ~_bitset(b) or None
+    if isinstance(b, int):
+        bb = b.to_bytes(CHUNK_BYTES, "little")
+        return _chunk([x for x in a if not bb[x >> 3] >> (x & 7) & 1])
+    return _chunk(sorted(set(a).difference(b)))
+
+
+class Bitmap(object):
+    """
+    Compressed bitmap of integer ids
+
+    chunks maps the high bits of the ids to the chunk of their low
+    CHUNK_BITS bits: an array('H') (sorted) or an int (bitset).
+    """
+
+    __slots__ = ["chunks"]
+
+    def __init__(self, chunks=None):
+        self.chunks = chunks or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        Get the bitmap of sorted unique ids
+        """
+
+        chunks = {}
+        current = None
+        values = []
+        for i in ids:
+            key = i >> CHUNK_BITS
+            if key != current:
+                if values:
+                    chunks[current] = _chunk(values)
+                current = key
+                values = []
+            values.append(i & (CHUNK_SIZE - 1))
+        if values:
+            chunks[current] = _chunk(values)
+        return cls(chunks)
+
+    def add(self, i):
+        key, x = i >> CHUNK_BITS, i & (CHUNK_SIZE - 1)
+        c = self.chunks.get(key)
+        if c is None:
+            self.chunks[key] = array("H", [x])
+        elif isinstance(c, int):
+            self.chunks[key] = c | 1 << x
+        else:
+            values = set(c)
+            values.add(x)
+            self.chunks[key] = _chunk(sorted(values))
+
+    def discard(self, i):
+        key, x = i >> CHUNK_BITS, i & (CHUNK_SIZE - 1)
+        c = self.chunks.get(key)
+        if c is None:
+            return
+        if isinstance(c, int):
+            c = c & ~(1 << x)
+        else:
+            c = _chunk([v for v in c if v != x])
+        if c:
+            self.chunks[key] = c
+        else:
+            del self.chunks[key]
+
+    def __contains__(self, i):
+        c = self.chunks.get(i >> CHUNK_BITS)
+        x = i & (CHUNK_SIZE - 1)
+        if c is None:
+            return False
+        if isinstance(c, int):
+            return bool(c >> x & 1)
+        return x in c
+
+    def __len__(self):
+        return sum([_popcount(c) if isinstance(c, int) else len(c) for c in self.chunks.values()])
+
+    def __iter__(self):
+        for key in sorted(self.chunks):
+            c = self.chunks[key]
+            high = key << CHUNK_BITS
+            for x in (_bitset_values(c) if isinstance(c, int) else c):
+                yield high | x
+
+    def __and__(self, other):
+        chunks = {}
+        for key in set(self.chunks).intersection(other.chunks):
+            c = _and(self.chunks[key], other.chunks[key])
+            if c:
+                chunks[key] = c
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for key, c in other.chunks.items():
+            chunks[key] = _or(chunks[key], c) if key in chunks else c
+        return Bitmap(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for key, c in self.chunks.items():
+            if key in other.chunks:
+                c = _andnot(c, other.chunks[key])
+            if c:
+                chunks[key] = c
+        return Bitmap(chunks)
+
+    @classmethod
+    def union(cls, bitmaps):
+        """
+        Get the OR of many bitmaps, in one pass over their chunks
+        """
+
+        bitsets = {}
+        arrays = {}
+        for b in bitmaps:
+            for key, c in b.chunks.items():
+                if isinstance(c, int):
+                    bitsets[key] = bitsets.get(key, 0) | c
+                else:
+                    arrays.setdefault(key, []).append(c)
+        chunks = {}
+        for key in set(bitsets).union(arrays):
+            if len(arrays.get(key, [])) == 1 and key not in bitsets:
+                chunks[key] = arrays[key][0]
+                continue
+            acc = bytearray(CHUNK_BYTES)
+            for a in arrays.get(key, []):
+                for x in a:
+                    acc[x >> 3] |= 1 << (x & 7)
+            v = int.from_bytes(acc, "little") | bitsets.get(key, 0)
+            chunks[key] = v if _popcount(v) > ARRAY_MAX else array("H", _bitset_values(v))
+        return cls(chunks)
+
+    def size(self):
+        """
+        Get the bytes of the chunks (arrays and bitsets)
+        """
+
+        return sum([CHUNK_BYTES if isinstance(c, int) else 2 * len(c) for c in self.chunks.values()])
+
+
+def announcements(records):
+    """
+    Get the (prefix, communities) of announcement records: netbox snapshot
+    objects (prefix, tags) or announcement pillar entries (prefix,
+    communities)
+
+    Returns:
+      dictionary: prefix -> frozenset of communities
+    """
+
+    # next to this file in the Salt states, the same check as the pillar
+    import announcement_te
+
+    result = {}
+    # the same tags are on many announcements
+    checked = {}
+    for r in records:
+        if "communities" in r:
+            communities = r["communities"]
+        else:
+            communities = [t["name"] if isinstance(t, dict) else t for t in r["tags"]]
+        for c in communities:
+            if c not in checked:
+                checked[c] = announcement_te.is_community(c)
+        result[r["prefix"]] = frozenset([c for c in communities if checked[c]])
+    return result
+
+
+class CommunityIndex(object):
+    """
+    Community -> bitmap of announcement ids
+
+    prefixes holds the prefix of every id (None for free ids) and
+    communities the indexed communities of every id.
+    """
+
+    def __init__(self):
+        self.prefixes = []
+        self.communities = []
+        self.ids = {}
+        self.free = []
+        self.bitmaps = {}
+        self.live = Bitmap()
+
+    def build(self, entries):
+        """
+        Index announcements from scratch
+
+        Args:
+          entries (dictionary): prefix -> communities (see announcements)
+        """
+
+        self.__init__()
+        members = {}
+        for prefix in sorted(entries):
+            i = len(self.prefixes)
+            self.ids[prefix] = i
+            self.prefixes.append(prefix)
+            self.communities.append(entries[prefix])
+            for c in entries[prefix]:
+                members.setdefault(c, []).append(i)
+        self.bitmaps = {c: Bitmap.from_ids(ids) for c, ids in members.items()}
+        self.live = Bitmap.from_ids(range(len(self.prefixes)))
+
+    def set(self, prefix, communities):
+        """
+        Index the communities of an announcement (new or changed)
+
+        Returns:
+          boolean (True if the index changed)
+        """
+
+        communities = frozenset(communities)
+        i = self.ids.get(prefix)
+        if i is not None and self.communities[i] == communities:
+            return False
+        if i is None:
+            i = self.free.pop() if self.free else len(self.prefixes)
+            if i == len(self.prefixes):
+                self.prefixes.append(prefix)
+                self.communities.append(frozenset())
+            self.prefixes[i] = prefix
+            self.ids[prefix] = i
+            self.live.add(i)
+        old = self.communities[i]
+        for c in old - communities:
+            self.bitmaps[c].discard(i)
+            if not self.bitmaps[c].chunks:
+                del self.bitmaps[c]
+        for c in communities - old:
+            self.bitmaps.setdefault(c, Bitmap()).add(i)
+        self.communities[i] = communities
+        return True
+
+    def remove(self, prefix):
+        """
+        Remove an announcement
+
+        Returns:
+          boolean (True if it was indexed)
+        """
+
+        i = self.ids.pop(prefix, None)
+        if i is None:
+            return False
+        for c in self.communities[i]:
+            self.bitmaps[c].discard(i)
+            if not self.bitmaps[c].chunks:
+                del self.bitmaps[c]
+        self.communities[i] = frozenset()
+        self.prefixes[i] = None
+        self.live.discard(i)
+        self.free.append(i)
+        return True
+
+    def update(self, entries):
+        """
+        Bring the index to a new set of announcements, touching only the
+        announcements that changed
+
+        Args:
+          entries (dictionary): prefix -> communities (all the announcements)
+
+        Returns:
+          dictionary: the number of added, changed and removed announcements
+        """
+
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        for prefix in [p for p in self.ids if p not in entries]:
+            self.remove(prefix)
+            counts["removed"] += 1
+        for prefix, communities in entries.items():
+            i = self.ids.get(prefix)
+            if i is None:
+                self.set(prefix, communities)
+                counts["added"] += 1
+            elif self.communities[i] != communities:
+                self.set(prefix, communities)
+                counts["changed"] += 1
+        return counts
+
+    def bitmap(self, term):
+        """
+        Get the bitmap of a community, of a glob pattern of communities
+        (eg 65000:60?:250) or of all the announcements (all)
+        """
+
+        if term == "all":
+            return self.live
+        if any([ch in term for ch in "*?["]):
+            return Bitmap.union([self.bitmaps[c] for c in fnmatch.filter(self.bitmaps, term)])
+        return self.bitmaps.get(term, Bitmap())
+
+    def query(self, expression):
+        """
+        Evaluate a query: communities, glob patterns or all combined with
+        - (andnot), & (and) and | (or), in this precedence, and parentheses.
+        Operators and parentheses are separated by spaces.
+
+        Returns:
+          Bitmap
+
+        Raises:
+          ValueError on syntax errors
+        """
+
+        tokens = expression.replace("(", " ( ").replace(")", " ) ").split()
+        pos = [0]
+
+        def peek():
+            return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+        def operand():
+            t = peek()
+            if t is None or t == ")" or any([t.lower() in ops for ops in QUERY_OPERATORS]):
+                raise ValueError("operand expected at '{}'".format(t or "end of query"))
+            pos[0] += 1
+            if t == "(":
+                result = level(len(QUERY_OPERATORS) - 1)
+                if peek() != ")":
+                    raise ValueError("')' expected at '{}'".format(peek() or "end of query"))
+                pos[0] += 1
+                return result
+            return self.bitmap(t)
+
+        def level(n):
+            result = operand() if n < 0 else level(n - 1)
+            if n < 0:
+                return result
+            while peek() is not None and peek().lower() in QUERY_OPERATORS[n]:
+                pos[0] += 1
+                right = level(n - 1)
+                if n == 0:
+                    result = result - right
+                elif n == 1:
+                    result = result & right
+                else:
+                    result = result | right
+            return result
+
+        result = level(len(QUERY_OPERATORS) - 1)
+        if peek() is not None:
+            raise ValueError("unexpected '{}'".format(peek()))
+        return result
+
+    def prefixes_of(self, bitmap):
+        """
+        Get the prefixes of a bitmap, in id order
+        """
+
+        return [self.prefixes[i] for i in bitmap]
+
+    def save(self, path):
+        """
+        Save the index in a pickle file
+        """
+
+        data = {"version": PICKLE_VERSION, "prefixes": self.prefixes, "communities": self.communities,
+                "free": self.free, "bitmaps": {c: b.chunks for c, b in self.bitmaps.items()},
+                "live": self.live.chunks}
+        if dirname(path):
+            os.makedirs(dirname(path), exist_ok=True)
+        _write_atomic(path, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    def stats(self):
+        """
+        Get the size of the index
+        """
+
+        return {"announcements": len(self.ids), "communities": len(self.bitmaps),
+                "bitmap_bytes": sum([b.size() for b in self.bitmaps.values()])}
+
+
+def load(path):
+    """
+    Get the index saved in a pickle file (an empty index if there is none)
+
+    Returns:
+      CommunityIndex
+    """
+
+    index = CommunityIndex()
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+    except (IOError, OSError):
+        return index
+    if data.get("version") == PICKLE_VERSION:
+        index.prefixes = data["prefixes"]
+        index.communities = data["communities"]
+        index.free = data["free"]
+        index.ids = {p: i for i, p in enumerate(index.prefixes) if p is not None}
+        index.bitmaps = {c: Bitmap(chunks) for c, chunks in data["bitmaps"].items()}
+        index.live = Bitmap(data["live"])
+    return index
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Query the community bitmap index of the BGP announcements")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-i", "--index", required=True, help="The index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p_refresh = subparsers.add_parser("refresh", help="Update the index from netbox (NETBOX_API_BASE_URL, \
+                                      NETBOX_API_TOKEN and BGP_ANNOUNCEMENT_COMMUNITY in the environment)")
+    p_refresh.add_argument("-p", "--pillar", type=argparse.FileType('r'),
+                           help="Update from the announcement pillar json instead ('-' for stdin)")
+    p_refresh.add_argument("-r", "--rebuild", action="store_true", help="Build the index from scratch")
+    p_refresh.add_argument("-s", "--sslnoverify", help="Skip verification of netbox server \
+                           certificates (eg use of self signed certs)", action="store_true")
+    p_query = subparsers.add_parser("query", help="Print the prefixes of a query")
+    p_query.add_argument("expression", help="eg '65000:3:1999 & 65000:61:65100 - 65000:400:250'")
+    p_query.add_argument("-n", "--count", action="store_true", help="Print the number of prefixes only")
+    subparsers.add_parser("stats", help="Print the size of the index")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        index = load(args.index)
+        if args.command == "refresh":
+            if args.pillar:
+                records = json.load(args.pillar).get("bgp", {}).get("announcements", [])
+            else:
+                # next to this file in the Salt states
+                import announcement_te
+                api_base_url = os.environ.get("NETBOX_API_BASE_URL", None)
+                api_token = os.environ.get("NETBOX_API_TOKEN", None)
+                bgp_announcement_community = os.environ.get("BGP_ANNOUNCEMENT_COMMUNITY", None)
+                if ((api_base_url is None) or (api_token is None) or (bgp_announcement_community is None)):
+                    logger.error("Missing NETBOX_API_BASE_URL or NETBOX_API_TOKEN or BGP_ANNOUNCEMENT_COMMUNITY variables in environment")
+                    exit(1)
+                api = announcement_te.connect(api_base_url, api_token, not args.sslnoverify)
+                records = announcement_te.snapshot(api, bgp_announcement_community)
+            entries = announcements(records)
+            if args.rebuild or not index.ids:
+                index.build(entries)
+                result = {"added": len(entries), "changed": 0, "removed": 0}
+            else:
+                result = index.update(entries)
+            if args.rebuild or any(result.values()):
+                index.save(args.index)
+            result.update(index.stats())
+            print(json.dumps(result, indent=2))
+        elif args.command == "query":
+            t1 = datetime.datetime.now()
+            result = index.query(args.expression)
+            logger.debug("Query evaluated in {}".format(datetime.datetime.now() - t1))
+            if args.count:
+                print(len(result))
+            else:
+                for prefix in index.prefixes_of(result):
+                    print(prefix)
+        else:
+            print(json.dumps(index.stats(), indent=2))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    except:
+        logger.exception("main()")
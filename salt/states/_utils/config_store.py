@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content addressed store of the configurations applied by the bgp-te-tool
+states.
+
+A rendered configuration is split in fragments: the blocks of the
+statements in FRAGMENT_STATEMENTS (BGP groups, policy statements,
+as-path groups, prefix lists, static / aggregate routes), runs of community
+definitions (FRAGMENT_RUN_LINES lines on average) and the text between
+them. Every fragment is stored once, zlib compressed, under the sha256 of
+its text:
+
+  <store>/objects/<h[:2]>/<h>
+
+so fragments shared by routers (most policy text) or unchanged between
+applies take no extra space. Every apply of a minion writes a manifest,
+with the ordered list of fragment hashes of each state:
+
+  <store>/manifests/<minion_id>/<apply_id>.json
+
+A configuration is reassembled by concatenating its fragments, so getting
+the configuration of any previous apply is a manifest lookup.
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+import datetime
+import hashlib
+import json
+import os
+import zlib
+
+#----------------- Global settings -------------------
+# Statements whose blocks are stored as separate fragments
+FRAGMENT_STATEMENTS = ["group", "policy-statement", "as-path-group", "prefix-list", "static", "aggregate"]
+# Consecutive one line statements stored as one fragment
+FRAGMENT_RUNS = ["community"]
+# Average number of lines of a run fragment: a run ends after a line whose
+# crc32 is a multiple of it, so the boundaries depend only on the content
+FRAGMENT_RUN_LINES = 64
+COMPRESS_LEVEL = 6
+#----------------- Global settings -------------------
+
+
+class StoreError(Exception):
+    pass
+
+
+def _write_atomic(path, data):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _first_word(line):
+    words = line.split(None, 2)
+    if words and words[0] in ["inactive:", "replace:"] and len(words) > 1:
+        return words[1]
+    return words[0] if words else ""
+
+
+def split(text):
+    """
+    Split a configuration in curly bracket format in fragments
+
+    The concatenation of the fragments is the configuration. The fragments
+    are generated one at a time, so a configuration read from a file is
+    never held in memory as a whole.
+
+    Args:
+      text (string or iterable of lines): the configuration, or its lines
+                                          (eg an open file)
+
+    Returns:
+      generator of strings
+    """
+
+    current = []
+    depth = 0
+    block_depth = None
+    run = None
+    for line in text.splitlines(True) if isinstance(text, str) else text:
+        stripped = line.strip()
+        if block_depth is None:
+            word = _first_word(stripped)
+            if run is not None and not (word == run and stripped.endswith(";")):
+                yield "".join(current)
+                current = []
+                run = None
+            if stripped.endswith("{") and word in FRAGMENT_STATEMENTS:
+                if current:
+                    yield "".join(current)
+                current = []
+                block_depth = depth
+            elif run is None and stripped.endswith(";") and word in FRAGMENT_RUNS:
+                if current:
+                    yield "".join(current)
+                current = []
+                run = word
+        current.append(line)
+        depth += stripped.count("{") - stripped.count("}")
+        if run is not None and zlib.crc32(stripped.encode("utf-8")) % FRAGMENT_RUN_LINES == 0:
+            yield "".join(current)
+            current = []
+            run = None
+        if block_depth is not None and depth == block_depth:
+            yield "".join(current)
+            current = []
+            block_depth = None
+    if current:
+        yield "".join(current)
+
+
+def put(store, data):
+    """
+    Store a fragment
+
+    Args:
+      store (string): the store directory
+      data (string): the fragment
+
+    Returns:
+      string (the sha256 of the fragment)
+    """
+
+    raw = data.encode("utf-8")
+    h = hashlib.sha256(raw).hexdigest()
+    d = os.path.join(store, "objects", h[:2])
+    path = os.path.join(d, h)
+    if not os.path.exists(path):
+        os.makedirs(d, exist_ok=True)
+        _write_atomic(path, zlib.compress(raw, COMPRESS_LEVEL))
+    return h
+
+
+def get(store, h):
+    """
+    Get a fragment
+
+    Args:
+      store (string): the store directory
+      h (string): the sha256 of the fragment
+
+    Returns:
+      string
+
+    Raises:
+      StoreError if the fragment is missing or corrupt
+    """
+
+    try:
+        with open(os.path.join(store, "objects", h[:2], h), "rb") as f:
+            raw = zlib.decompress(f.read())
+    except (IOError, OSError, zlib.error) as e:
+        raise StoreError("fragment {}: {}".format(h, e))
+    if hashlib.sha256(raw).hexdigest() != h:
+        raise StoreError("fragment {} is corrupt".format(h))
+    return raw.decode("utf-8")
+
+
+def save(store, minion, configs, meta=None):
+    """
+    Store the configurations of an apply and write its manifest
+
+    Args:
+      store (string): the store directory
+      minion (string): the minion id
+      configs (dictionary): state -> configuration (string or iterable of
+                            lines, see split)
+      meta (dictionary): extra manifest data (eg the device commit)
+
+    Returns:
+      string (the apply id)
+    """
+
+    now = datetime.datetime.utcnow()
+    apply_id = now.strftime("%Y%m%dT%H%M%S.%fZ")
+    manifest = {"id": apply_id, "minion": minion, "time": now.isoformat() + "Z",
+                "states": {state: [put(store, f) for f in split(text)] for state, text in configs.items()}}
+    manifest.update(meta or {})
+    d = os.path.join(store, "manifests", minion)
+    os.makedirs(d, exist_ok=True)
+    _write_atomic(os.path.join(d, "{}.json".format(apply_id)), json.dumps(manifest).encode("utf-8"))
+    return apply_id
+
+
+def manifest(store, minion, apply_id):
+    """
+    Get the manifest of an apply
+
+    Raises:
+      StoreError if there is no such apply
+    """
+
+    try:
+        with open(os.path.join(store, "manifests", minion, "{}.json".format(apply_id))) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise StoreError("apply {} of {}: {}".format(apply_id, minion, e))
+
+
+def history(store, minion):
+    """
+    Get the apply ids of a minion, latest first
+    """
+
+    try:
+        names = os.listdir(os.path.join(store, "manifests", minion))
+    except OSError:
+        return []
+    return sorted([n[:-5] for n in names if n.endswith(".json")], reverse=True)
+
+
+def assemble(store, m, state):
+    """
+    Get the configuration of a state from a manifest
+
+    Args:
+      store (string): the store directory
+      m (dictionary): the manifest
+      state (string): the state
+
+    Returns:
+      string (the configuration)
+    """
+
+    if state not in m["states"]:
+        raise StoreError("apply {} has no {} configuration".format(m["id"], state))
+    return "".join([get(store, h) for h in m["states"][state]])
+
+
+def stats(store):
+    """
+    Get the size of a store
+
+    Returns:
+      dictionary: number and compressed bytes of the fragments, number of
+                  manifests and the uncompressed bytes they reference
+    """
+
+    objects = 0
+    stored = 0
+    for dirpath, dirnames, filenames in os.walk(os.path.join(store, "objects")):
+        for f in filenames:
+            objects += 1
+            stored += os.path.getsize(os.path.join(dirpath, f))
+    manifests = 0
+    referenced = 0
+    sizes = {}
+    for dirpath, dirnames, filenames in os.walk(os.path.join(store, "manifests")):
+        for f in filenames:
+            if not f.endswith(".json"):
+                continue
+            manifests += 1
+            with open(os.path.join(dirpath, f)) as fp:
+                m = json.load(fp)
+            for hashes in m["states"].values():
+                for h in hashes:
+                    if h not in sizes:
+                        sizes[h] = len(get(store, h).encode("utf-8"))
+                    referenced += sizes[h]
+    return {"fragments": objects, "stored_bytes": stored, "manifests": manifests,
+            "referenced_bytes": referenced}
@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Change impact index of the bgp-te-tool states.
+
+Maps the source of truth objects the pillar is built from (netbox prefixes
+and aggregates, peering-manager routers, connections, internet exchanges,
+sessions, autonomous systems, routing policies and BGP groups) and the out
+policy action communities to the minions and the bgpte fragments that a
+change of them affects, so that a change is applied only where it matters.
+
+The external pillar programs record what they contributed to the pillar,
+when run with their impact index option:
+
+  <index>/minions/<minion_id>.json   peering-manager objects of a minion
+  <index>/prefixes.json              netbox announcement prefixes
+  <index>/settings.json              ebgp-peerings config.j2 settings
+
+A file is written only when its content changes and only by the program
+that owns it, so the pillar compilations of different minions do not
+contend. The reverse index is built from these files and patched
+incrementally: refresh() reads only the files that changed since the last
+refresh (and nothing when the directories did not change). The index is
+saved in <index>/index.pickle, so a new process starts from it.
+
+Fragments are named <state>:<kind>:<name> after the bgpte execution module
+fragments, eg ebgp-peerings:policy:AS65100_TRANSIT1-FR-V4-OUT or
+bgp-announcements:routes:IPv4:aggregate. <state>:* is the whole state.
+
+A change is a netbox or peering-manager changelog entry (ObjectChange):
+
+  {'changed_object_type': 'ipam.prefix', 'changed_object_id': 34, 'action': 'update',
+   'prechange_data': {...}, 'postchange_data': {...}}
+
+webhook_change() gets the change of a netbox / peering-manager webhook.
+
+The module is also a command line program:
+
+  impact_index.py -i /var/cache/salt/master/bgpte/impact impact change.json
+  impact_index.py -i /var/cache/salt/master/bgpte/impact community 65000:40:65100
+  impact_index.py -i /var/cache/salt/master/bgpte/impact stats
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import json
+import os
+import pickle
+
+#----------------- Global settings -------------------
+# Out policy actions per peer ASN and per location (large community data1)
+PEER_ACTIONS = ["40", "41", "61", "62", "63"]
+LOCATION_ACTIONS = ["400", "601", "602", "603"]
+# Actions of every out policy (data2 0: all peers / all locations)
+ALL_ACTIONS = ["40:0", "400:0"]
+PICKLE_VERSION = 1
+# Webhook model -> changelog object type
+WEBHOOK_MODELS = {
+    "prefix": "ipam.prefix",
+    "aggregate": "ipam.aggregate",
+    "router": "peering.router",
+    "directpeeringsession": "peering.directpeeringsession",
+    "internetexchangepeeringsession": "peering.internetexchangepeeringsession",
+    "autonomoussystem": "peering.autonomoussystem",
+    "routingpolicy": "peering.routingpolicy",
+    "bgpgroup": "peering.bgpgroup",
+    "internetexchange": "peering.internetexchange",
+    "connection": "net.connection",
+}
+# Webhook event -> changelog action
+WEBHOOK_EVENTS = {"created": "create", "updated": "update", "deleted": "delete"}
+#----------------- Global settings -------------------
+
+
+def _write_atomic(path, data):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _update_file(path, data):
+    """
+    Write json serializable data to a file, unless the file has it already
+
+    Returns:
+      boolean (True if the file was written)
+    """
+
+    raw = json.dumps(data, sort_keys=True).encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == raw:
+                return False
+    except (IOError, OSError):
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, raw)
+    return True
+
+
+def _tag_names(tags):
+    return [t["name"] if isinstance(t, dict) else t for t in tags or []]
+
+
+def _id(value):
+    """
+    Get the id of a foreign key of changelog data (an id or a nested object)
+    """
+
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def minion_record(router, sessions):
+    """
+    Get the index record of a minion from the peering-manager data of its
+    pillar
+
+    Args:
+      router (dictionary): the router, from get_router_info (None if the
+                           router is not in peering-manager)
+      sessions (list of dictionaries): the sessions of the router, as
+                                       collected by get_peering_sessions
+
+    Returns:
+      dictionary
+    """
+
+    if router is None:
+        return {"router": None, "location": None, "connections": [], "sessions": []}
+    return {"router": router["id"],
+            "location": (router["location"] or "").upper() or None,
+            "connections": [{"id": ix["ixp_connection_id"], "ix": ix["id"], "group": "{}-PEERS".format(ix["name"])}
+                            for ix in router["internet-exchanges"]],
+            "sessions": sessions}
+
+
+def prefix_record(prefix, tags):
+    """
+    Get the index record of a netbox announcement prefix or aggregate
+
+    Args:
+      prefix (string): the prefix
+      tags (list): the tag names (or tag objects) of the prefix
+
+    Returns:
+      dictionary: the prefix, its address family, route type and tags
+    """
+
+    tags = _tag_names(tags)
+    route_type = "aggregate"
+    for t in tags:
+        if t.lower().startswith("route-type:"):
+            route_type = t.lower().split(":")[1]
+    return {"prefix": prefix, "family": "IPv6" if ":" in prefix else "IPv4", "route_type": route_type,
+            "tags": sorted(tags)}
+
+
+def webhook_change(payload):
+    """
+    Get the changelog entry of a netbox or peering-manager webhook
+
+    Args:
+      payload (dictionary): the webhook body (event, model, data and the
+                            prechange / postchange snapshots)
+
+    Returns:
+      dictionary (ObjectChange)
+    """
+
+    event = payload.get("event")
+    data = payload.get("data") or {}
+    snapshots = payload.get("snapshots") or {}
+    post = snapshots.get("postchange")
+    if post is None and event != "deleted":
+        post = data
+    return {"changed_object_type": WEBHOOK_MODELS.get(payload.get("model"), payload.get("model")),
+            "changed_object_id": data.get("id"),
+            "action": WEBHOOK_EVENTS.get(event, event),
+            "prechange_data": snapshots.get("prechange"),
+            "postchange_data": post}
+
+
+def update_minion(path, minion, record):
+    """
+    Record the peering-manager objects of a minion (peering-manager external
+    pillar)
+
+    Returns:
+      boolean (True if the record changed)
+    """
+
+    return _update_file(os.path.join(path, "minions", "{}.json".format(minion)), record)
+
+
+def update_prefixes(path, prefixes, announcement_community):
+    """
+    Record the netbox announcement prefixes (netbox external pillar)
+
+    Args:
+      path (string): the index directory
+      prefixes (dictionary): "prefix:<id>" / "aggregate:<id>" -> prefix_record
+      announcement_community (string): the tag of the announced prefixes
+
+    Returns:
+      boolean (True if the prefixes changed)
+    """
+
+    return _update_file(os.path.join(path, "prefixes.json"),
+                        {"announcement_community": announcement_community, "prefixes": prefixes})
+
+
+def update_settings(path, settings):
+    """
+    Record the ebgp-peerings settings the index depends on (local_asn,
+    geolocations, prune_unused_policy_actions)
+
+    Returns:
+      boolean (True if the settings changed)
+    """
+
+    return _update_file(os.path.join(path, "settings.json"),
+                        {k: settings.get(k) for k in ["local_asn", "geolocations", "prune_unused_policy_actions"]})
+
+
+class ImpactIndex(object):
+    """
+    The reverse index of an index directory
+
+    keys maps an object key (eg session:direct:12, asn:65100,
+    policy:AS65100_TRANSIT1-FR-V4-OUT, action:40:65100) to the fragments
+    of every minion it affects: {key: {minion: set of fragments}}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.signatures = {}
+        self.minions = {}
+        self.keys = {}
+        self.peered = set()
+        self.settings = {}
+        self.prefixes = {}
+        self.announcement_community = None
+        self.action_counts = {}
+        try:
+            with open(os.path.join(path, "index.pickle"), "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == PICKLE_VERSION:
+                for k in ["signatures", "minions", "keys", "peered", "settings", "prefixes",
+                          "announcement_community", "action_counts"]:
+                    setattr(self, k, data[k])
+        except Exception:
+            pass
+
+    def _signature(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _minion_keys(self, record):
+        """
+        Get the (key, fragment) pairs of a minion record
+        """
+
+        pairs = []
+        if record.get("router") is not None:
+            pairs += [("router:{}".format(record["router"]), "*")]
+        loc = (self.settings.get("geolocations") or {}).get(record.get("location"))
+        for s in record["sessions"]:
+            group = "ebgp-peerings:group:{}".format(s["group"])
+            communities = "ebgp-peerings:communities:AS{}".format(s["peer_asn"])
+            policy = "ebgp-peerings:policy:{}".format(s["policy"]) if s.get("policy") else None
+            frags = [group, communities] + ([policy] if policy else [])
+            pairs += [("session:{}".format(s["id"]), f) for f in frags]
+            pairs += [("asn:{}".format(s["peer_asn"]), group), ("group:{}".format(s["group"]), group)]
+            if policy:
+                pairs += [("policy:{}".format(s["policy"]), f) for f in [policy, group]]
+                actions = ALL_ACTIONS + ["{}:{}".format(a, s["peer_asn"]) for a in PEER_ACTIONS]
+                if loc is not None:
+                    actions += ["{}:{}".format(a, loc) for a in LOCATION_ACTIONS]
+                pairs += [("action:{}".format(a), f) for a in actions for f in [policy, communities]]
+        for c in record["connections"]:
+            group = "ebgp-peerings:group:{}".format(c["group"])
+            pairs += [("connection:{}".format(c["id"]), group), ("ix:{}".format(c["ix"]), group)]
+        return pairs
+
+    def _set_minion(self, minion, record):
+        old = self.minions.pop(minion, None)
+        if old is not None:
+            for key, frag in self._minion_keys(old):
+                by_minion = self.keys.get(key)
+                if by_minion and minion in by_minion:
+                    by_minion[minion].discard(frag)
+                    if not by_minion[minion]:
+                        del by_minion[minion]
+                    if not by_minion:
+                        del self.keys[key]
+        self.peered.discard(minion)
+        if record is None:
+            return
+        self.minions[minion] = record
+        for key, frag in self._minion_keys(record):
+            self.keys.setdefault(key, {}).setdefault(minion, set()).add(frag)
+        if record["sessions"]:
+            self.peered.add(minion)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the index directory, re-reading only
+        the files that changed
+
+        Returns:
+          boolean (True if the index changed)
+        """
+
+        changed = False
+        settings_path = os.path.join(self.path, "settings.json")
+        sig = self._signature(settings_path)
+        if sig != self.signatures.get("settings.json"):
+            try:
+                with open(settings_path) as f:
+                    settings = json.load(f)
+            except (IOError, OSError, ValueError):
+                settings = {}
+            self.signatures["settings.json"] = sig
+            if settings != self.settings:
+                # the keys of every minion and the prefix actions depend on
+                # the settings
+                records = dict(self.minions)
+                for minion in records:
+                    self._set_minion(minion, None)
+                self.settings = settings
+                for minion, record in records.items():
+                    self._set_minion(minion, record)
+                self._count_actions()
+                changed = True
+        minions_dir = os.path.join(self.path, "minions")
+        sig = self._signature(minions_dir)
+        if sig != self.signatures.get("minions"):
+            seen = set()
+            try:
+                entries = list(os.scandir(minions_dir))
+            except OSError:
+                entries = []
+            for e in entries:
+                if not e.name.endswith(".json"):
+                    continue
+                minion = e.name[:-5]
+                seen.add(minion)
+                st = e.stat()
+                sig_e = (st.st_mtime_ns, st.st_size)
+                if sig_e == self.signatures.get("minions/" + minion):
+                    continue
+                try:
+                    with open(e.path) as f:
+                        record = json.load(f)
+                except (IOError, OSError, ValueError):
+                    continue
+                self.signatures["minions/" + minion] = sig_e
+                if record != self.minions.get(minion):
+                    self._set_minion(minion, record)
+                    changed = True
+            for minion in set(self.minions) - seen:
+                self._set_minion(minion, None)
+                self.signatures.pop("minions/" + minion, None)
+                changed = True
+            self.signatures["minions"] = sig
+        prefixes_path = os.path.join(self.path, "prefixes.json")
+        sig = self._signature(prefixes_path)
+        if sig != self.signatures.get("prefixes.json"):
+            try:
+                with open(prefixes_path) as f:
+                    data = json.load(f)
+            except (IOError, OSError, ValueError):
+                data = {"announcement_community": None, "prefixes": {}}
+            self.signatures["prefixes.json"] = sig
+            self.announcement_community = data["announcement_community"]
+            self.prefixes = data["prefixes"]
+            self._count_actions()
+            changed = True
+        return changed
+
+    def _actions(self, rec):
+        """
+        Get the out policy actions ("<action>:<value>") of a prefix record:
+        its <local_asn>:<action>:<asn or location code> communities
+        """
+
+        actions = set()
+        for t in rec["tags"]:
+            parts = t.split(":")
+            if len(parts) == 3 and parts[0] == str(self.settings.get("local_asn")) and \
+               parts[1] in PEER_ACTIONS + LOCATION_ACTIONS:
+                actions.add("{}:{}".format(parts[1], parts[2]))
+        return actions
+
+    def _count_actions(self):
+        """
+        Count the prefixes that use every out policy action
+        """
+
+        self.action_counts = {}
+        for rec in self.prefixes.values():
+            for a in self._actions(rec):
+                self.action_counts[a] = self.action_counts.get(a, 0) + 1
+
+    def save(self):
+        """
+        Save the index (index.pickle in the index directory)
+        """
+
+        data = {"version": PICKLE_VERSION}
+        for k in ["signatures", "minions", "keys", "peered", "settings", "prefixes",
+                  "announcement_community", "action_counts"]:
+            data[k] = getattr(self, k)
+        os.makedirs(self.path, exist_ok=True)
+        _write_atomic(os.path.join(self.path, "index.pickle"), pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    def lookup(self, key):
+        """
+        Get the fragments an object key affects
+
+        Returns:
+          dictionary: minion -> set of fragments
+        """
+
+        return self.keys.get(key, {})
+
+    def community(self, community):
+        """
+        Get the out policies (and per peer ASN community fragments) that
+        reference an out policy action community
+
+        Args:
+          community (string): eg 65000:40:65100
+
+        Returns:
+          dictionary: minion -> set of fragments
+        """
+
+        parts = community.split(":")
+        if len(parts) != 3 or parts[0] != str(self.settings.get("local_asn")):
+            return {}
+        return self.lookup("action:{}:{}".format(parts[1], parts[2]))
+
+    def _prefix_impact(self, key, entry):
+        """
+        Get the impact of a change of a netbox prefix or aggregate
+        """
+
+        def announced(data):
+            if not data or self.announcement_community not in _tag_names(data.get("tags")):
+                return None
+            return prefix_record(data["prefix"], data.get("tags"))
+
+        old = self.prefixes.get(key) or announced(entry.get("prechange_data"))
+        new = announced(entry.get("postchange_data")) if entry.get("action") != "delete" else None
+        if old == new:
+            return {}
+        ret = {}
+        routes = set(["bgp-announcements:routes:{}:{}".format(r["family"], r["route_type"])
+                      for r in [old, new] if r])
+        for minion in self.peered:
+            ret[minion] = set(routes)
+        if self.settings.get("prune_unused_policy_actions"):
+            old_actions = self._actions(old) if old else set()
+            new_actions = self._actions(new) if new else set()
+            for a in old_actions ^ new_actions:
+                count = self.action_counts.get(a, 0)
+                after = count - (a in old_actions) + (a in new_actions)
+                # an action is generated while some prefix uses it
+                if (count > 0) != (after > 0):
+                    for minion, frags in self.lookup("action:{}".format(a)).items():
+                        ret.setdefault(minion, set()).update(frags)
+        return ret
+
+    def impact(self, entry):
+        """
+        Get the minions and fragments affected by a changelog entry
+
+        Args:
+          entry (dictionary): a netbox or peering-manager ObjectChange
+
+        Returns:
+          dictionary: 'minions' maps every affected minion to its sorted
+          fragments, 'exact' is False for object types the index does not
+          know (then every minion is affected, with every fragment)
+
+        Return example:
+          {'minions': {'vmx1-lab': ['ebgp-peerings:group:TRANSIT1',
+                                    'ebgp-peerings:policy:AS65100_TRANSIT1-FR-V4-OUT']},
+           'exact': True}
+        """
+
+        obj_type = entry.get("changed_object_type")
+        obj_id = entry.get("changed_object_id")
+        pre = entry.get("prechange_data") or {}
+        post = entry.get("postchange_data") or {}
+        action = entry.get("action")
+        ret = {}
+
+        def add(found, frags=None):
+            for minion, f in found.items():
+                ret.setdefault(minion, set()).update(frags or f)
+
+        if obj_type in ["ipam.prefix", "ipam.aggregate"]:
+            add(self._prefix_impact("{}:{}".format(obj_type.split(".")[1], obj_id), entry))
+        elif obj_type in ["peering.directpeeringsession", "peering.internetexchangepeeringsession"]:
+            kind = "direct" if obj_type == "peering.directpeeringsession" else "ix"
+            add(self.lookup("session:{}:{}".format(kind, obj_id)))
+            new_policy = pre.get("export_routing_policies") != post.get("export_routing_policies") or \
+                pre.get("autonomous_system") != post.get("autonomous_system")
+            if action == "create" or (action == "update" and new_policy):
+                # new group / policy / community fragments
+                owner = "router:{}".format(_id(post.get("router"))) if kind == "direct" else \
+                        "connection:{}".format(_id(post.get("ixp_connection")))
+                add(self.lookup(owner), ["ebgp-peerings:*"])
+        elif obj_type == "peering.autonomoussystem":
+            for data in [pre, post]:
+                if data.get("asn") is not None:
+                    add(self.lookup("asn:{}".format(data["asn"])))
+        elif obj_type in ["peering.routingpolicy", "peering.bgpgroup"]:
+            kind = "policy" if obj_type == "peering.routingpolicy" else "group"
+            for data in [pre, post]:
+                if data.get("slug"):
+                    add(self.lookup("{}:{}".format(kind, data["slug"].upper())))
+        elif obj_type == "peering.router":
+            add(self.lookup("router:{}".format(obj_id)))
+            if action == "create" and post.get("name"):
+                ret[post["name"]] = set(["*"])
+        elif obj_type == "net.connection":
+            add(self.lookup("connection:{}".format(obj_id)))
+            if action == "create":
+                add(self.lookup("router:{}".format(_id(post.get("router")))), ["ebgp-peerings:*"])
+        elif obj_type == "peering.internetexchange":
+            add(self.lookup("ix:{}".format(obj_id)))
+        else:
+            return {"minions": {m: ["*"] for m in sorted(self.minions)}, "exact": False}
+        return {"minions": {m: sorted(f) for m, f in sorted(ret.items())}, "exact": True}
+
+    def stats(self):
+        """
+        Get the size of the index
+        """
+
+        return {"minions": len(self.minions), "peered": len(self.peered), "keys": len(self.keys),
+                "prefixes": len(self.prefixes), "settings": self.settings}
+
+
+def load(path):
+    """
+    Get the up to date index of an index directory, saving it if it changed
+
+    Args:
+      path (string): the index directory
+
+    Returns:
+      ImpactIndex
+    """
+
+    index = ImpactIndex(path)
+    if index.refresh():
+        index.save()
+    return index
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Query the change impact index of the bgp-te-tool states")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-i", "--index", required=True, help="The index directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p_impact = subparsers.add_parser("impact", help="Print the minions and fragments a changelog entry affects")
+    p_impact.add_argument("change", type=argparse.FileType('r'), help="The changelog entry in json ('-' for stdin)")
+    p_community = subparsers.add_parser("community", help="Print the out policies that reference a community")
+    p_community.add_argument("community", help="eg 65000:40:65100")
+    p_key = subparsers.add_parser("key", help="Print the fragments an object key affects")
+    p_key.add_argument("key", help="eg asn:65100, session:direct:12, policy:AS65100_TRANSIT1-FR-V4-OUT")
+    subparsers.add_parser("stats", help="Print the size of the index")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        index = load(args.index)
+        if args.command == "impact":
+            result = index.impact(json.load(args.change))
+        elif args.command == "community":
+            result = {m: sorted(f) for m, f in sorted(index.community(args.community).items())}
+        elif args.command == "key":
+            result = {m: sorted(f) for m, f in sorted(index.lookup(args.key).items())}
+        else:
+            result = index.stats()
+        print(json.dumps(result, indent=2))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
@@ -0,0 +1,723 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+JunOS configuration utilities for the bgp-te-tool states.
+
+Parses JunOS configuration in curly bracket (text) format into a tree and
+computes the set / delete commands that transform one configuration into
+another. Used by the bgpte execution module to load only the difference
+between the last applied and the newly rendered configuration of a state.
+
+The tree can also be emitted as JunOS XML (<configuration>), so that the
+device loads it without parsing text. The XML mapping of statements is
+defined for the statements the bgp-te-tool templates produce (see
+XML_SPECIAL_LEAFS and the generic rules of _xml_statement); others raise
+UnsupportedStatement.
+
+A tree node is a dictionary:
+
+  {'leaf': False, 'inactive': False, 'replace': False, 'words': [...], 'children': {...}}
+
+words are the tokens of the statement (without annotations) and children maps the statement of each child (its words joined with a space,
+eg 'neighbor 192.0.2.1' or 'community [ A B ]') to its node. Leaf nodes are
+statements terminated by ';'. Children keep the configuration order. Every
+subtree gets a hash (tree_hash), so that diffs skip identical subtrees.
+
+The module is also a command line program, to compare rendered output with
+a device configuration dump (eg juniper-vmx/*.conf) without a device:
+
+  junos_config.py compare juniper-vmx/vmx1-lab.conf rendered.conf
+  junos_config.py set old.conf new.conf
+  junos_config.py xml rendered.conf
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import contextlib
+import gc
+import hashlib
+import io
+import re
+
+try:
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+#----------------- Global settings -------------------
+# Statement annotations
+ANNOTATIONS = ["replace:", "inactive:", "protect:"]
+# Children ordered by the user: set appends them, so a change of their order
+# needs insert commands
+ORDERED_PREFIXES = ["term "]
+# Attributes of named objects written as one statement, eg
+# 'community NAME members [ A B ]': an object whose last statement is
+# deleted is deleted as a whole, JunOS rejects a community with no members
+NAMED_OBJECT_ATTRIBUTES = ["members"]
+# Lines that need the tokenizer (quotes, comments, several statements)
+SLOW_LINE_RE = re.compile(r'["#{};]|/\*')
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|/\*.*?\*/|#[^\n]*|[{};\[\]]|[^\s{};\[\]"]+', re.S)
+# XML: statements whose children are named elements with another tag, eg
+# routing-instances { NET { ... } } -> <routing-instances><instance><name>NET</name>...
+# The groups statement itself has no element: groups { X { } } -> <groups><name>X</name>
+XML_NAMED_CHILDREN = {"groups": "groups", "routing-instances": "instance"}
+# XML: two word containers whose second word is a tag, eg family inet { } -> <family><inet>
+XML_CHOICE_CONTAINERS = ["family"]
+# XML: one line statements that are containers with a single child, eg
+# from community X; -> <from><community>X</community></from>
+XML_ONE_LINE_CONTAINERS = ["from", "then", "to"]
+# XML: leaf statements with a specific mapping, by (parent keyword, keyword).
+# The values name the elements of the statement arguments, in order
+# ('*': a flag named by the argument, '*value': an element named by the
+# argument with the next argument as value)
+XML_SPECIAL_LEAFS = {
+    ("from", "route-filter"): ["address", "*value"],
+    ("from", "prefix-list-filter"): ["list_name", "*value"],
+    ("then", "community"): ["*", "community-name"],
+    ("prefix-limit", "teardown"): ["limit-threshold"],
+    ("route", "preference"): ["metric-value"],
+    ("policy-options", "community"): ["name", "*list"],
+    ("policy-options", "as-path"): ["name", "path"],
+    ("as-path-group", "as-path"): ["name", "path"],
+}
+#----------------- Global settings -------------------
+
+
+class ParseError(Exception):
+    pass
+
+
+class UnsupportedStatement(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Pause the cyclic garbage collector. Configuration trees have no cycles
+    and the collections triggered while building or walking large trees
+    dominate their processing time.
+    """
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _node(leaf=False, words=None):
+    return {"leaf": leaf, "inactive": False, "replace": False, "words": words or [], "children": {}}
+
+
+def tokenize(text):
+    """
+    Split a JunOS configuration in tokens (words, quoted strings and
+    punctuation). Comments are dropped.
+
+    Args:
+      text (string): configuration in curly bracket format
+
+    Returns:
+      list of strings
+    """
+
+    return [t for t in TOKEN_RE.findall(text) if not (t.startswith("/*") or t.startswith("#"))]
+
+
+def _statement(stack, words, end):
+    """
+    Add a statement (its words, terminated by ';' or '{') to the current
+    node of the parser stack
+    """
+
+    flags = []
+    while words and words[0] in ANNOTATIONS:
+        flags.append(words.pop(0))
+    if not words:
+        raise ParseError("empty statement before '{}'".format(end))
+    key = " ".join(words)
+    leaf = end == ";"
+    children = stack[-1]["children"]
+    node = children.get(key)
+    if node is None or node["leaf"] != leaf:
+        node = {"leaf": leaf, "inactive": False, "replace": False, "words": words, "children": {}}
+        children[key] = node
+    if flags:
+        node["inactive"] = "inactive:" in flags
+        node["replace"] = "replace:" in flags
+    if not leaf:
+        stack.append(node)
+
+
+def _close(stack, words):
+    """
+    Close the current node of the parser stack ('}'). A pending statement
+    without ';' (eg the last line of a JunOS dump) is terminated first.
+    """
+
+    if words:
+        _statement(stack, words, ";")
+    if len(stack) == 1:
+        raise ParseError("unbalanced '}'")
+    stack.pop()
+
+
+def parse(text):
+    """
+    Parse a JunOS configuration in curly bracket format
+
+    Lines holding a single simple statement (the bulk of a configuration)
+    are split on white space; the rest of the text goes through the
+    tokenizer. Parsing is linear in the size of the configuration.
+
+    Args:
+      text (string): the configuration
+
+    Returns:
+      the root node of the configuration tree
+
+    Raises:
+      ParseError on unbalanced brackets or an unterminated statement
+    """
+
+    with _gc_paused():
+        return _parse(text)
+
+
+def _parse(text):
+    root = _node()
+    stack = [root]
+    words = []
+    in_list = False
+    if "/*" in text:
+        text = COMMENT_RE.sub(" ", text)
+    lines = iter(text.split("\n"))
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not words and not in_list:
+            if line == "}":
+                _close(stack, words)
+                continue
+            end = line[-1]
+            if end in "{;" and not SLOW_LINE_RE.search(line, 0, len(line) - 1):
+                w = line[:-1].split()
+                if "[" not in line or all(x in ["[", "]"] or ("[" not in x and "]" not in x) for x in w):
+                    _statement(stack, w, end)
+                    continue
+        # quoted strings may span lines
+        while line.count('"') - line.count('\\"') & 1:
+            try:
+                line += "\n" + next(lines)
+            except StopIteration:
+                raise ParseError("unterminated quoted string")
+        for t in tokenize(line):
+            if in_list:
+                words.append(t)
+                if t == "]":
+                    in_list = False
+            elif t == "[":
+                words.append(t)
+                in_list = True
+            elif t == "{" or t == ";":
+                _statement(stack, words, t)
+                words = []
+            elif t == "}":
+                _close(stack, words)
+                words = []
+            else:
+                words.append(t)
+    if words or in_list:
+        raise ParseError("unterminated statement '{}'".format(" ".join(words)))
+    if len(stack) != 1:
+        raise ParseError("{} unclosed '{{'".format(len(stack) - 1))
+    return root
+
+
+def to_set(node, path=None):
+    """
+    Get the set commands that create a configuration (sub)tree
+
+    Args:
+      node (dictionary): a tree node
+      path (list of strings): the statements leading to the node
+
+    Returns:
+      list of strings (set and deactivate commands)
+    """
+
+    path = path or []
+    commands = []
+    deactivate = []
+    for key, child in node["children"].items():
+        child_path = path + [key]
+        if child["leaf"] or not child["children"]:
+            commands.append("set {}".format(" ".join(child_path)))
+        else:
+            commands.extend(to_set(child, child_path))
+        if child["inactive"]:
+            deactivate.append("deactivate {}".format(" ".join(child_path)))
+    return commands + deactivate
+
+
+def _delete_statement(key, node, names):
+    """
+    Get the statement that deletes a child: a leaf with a value list is
+    deleted as a whole (eg 'community [ A B ]' -> 'community'), the named
+    object of a leaf is deleted as a whole when it has no statement left
+    (eg 'community X members [ A B ]' -> 'community X')
+
+    Args:
+      key (string): the statement of the child
+      node (dictionary): the child
+      names (set of strings): the first two words of the statements of the
+                              new children
+    """
+
+    words = key.split()
+    if not node["leaf"]:
+        return key
+    if len(words) > 2 and words[2] in NAMED_OBJECT_ATTRIBUTES:
+        name = " ".join(words[:2])
+        if name not in names:
+            return name
+    if "[" in words:
+        return " ".join(words[:words.index("[")])
+    return key
+
+
+def tree_hash(node):
+    """
+    Get the hash of a configuration (sub)tree. Hashes are computed once and
+    kept in the nodes ('hash'), so that identical subtrees of two trees are
+    compared in constant time.
+
+    Args:
+      node (dictionary): a tree node
+
+    Returns:
+      string (hex digest)
+    """
+
+    h = node.get("hash")
+    if h is None:
+        with _gc_paused():
+            h = _tree_hash(node)
+    return h
+
+
+def _tree_hash(node):
+    h = node.get("hash")
+    if h is None:
+        if node["leaf"]:
+            # the statement of a leaf is part of its parent's hash
+            h = "LI" if node["inactive"] else "LA"
+        else:
+            data = "C{}\0{}".format("I" if node["inactive"] else "A",
+                                     "\0".join([k + "\0" + _tree_hash(c) for k, c in node["children"].items()]))
+            h = hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+        node["hash"] = h
+    return h
+
+
+def _ordered(key):
+    return any(key.startswith(p) for p in ORDERED_PREFIXES)
+
+
+def _diff(path, old, new, deletes, sets, states, inserts):
+    names = None
+    for key, onode in old["children"].items():
+        nnode = new["children"].get(key)
+        if nnode is None or nnode["leaf"] != onode["leaf"]:
+            if names is None:
+                names = set([" ".join(k.split()[:2]) for k in new["children"]])
+            deletes.append("delete {}".format(" ".join(path + [_delete_statement(key, onode, names)])))
+    for key, nnode in new["children"].items():
+        onode = old["children"].get(key)
+        child_path = path + [key]
+        if onode is None or onode["leaf"] != nnode["leaf"]:
+            commands = to_set({"children": {key: nnode}}, path)
+            sets.extend([c for c in commands if c.startswith("set ")])
+            states.extend([c for c in commands if not c.startswith("set ")])
+            continue
+        if not nnode["leaf"] and _tree_hash(onode) != _tree_hash(nnode):
+            _diff(child_path, onode, nnode, deletes, sets, states, inserts)
+        if onode["inactive"] != nnode["inactive"]:
+            states.append("{} {}".format("deactivate" if nnode["inactive"] else "activate", " ".join(child_path)))
+    # user ordered children: set appends the new ones after the kept ones
+    new_order = [k for k in new["children"] if _ordered(k)]
+    result_order = [k for k in old["children"] if _ordered(k) and k in new["children"]] + \
+                   [k for k in new_order if k not in old["children"]]
+    if result_order != new_order:
+        for prev, key in zip(new_order, new_order[1:]):
+            inserts.append("insert {} after {}".format(" ".join(path + [key]), prev))
+
+
+def diff(old, new):
+    """
+    Get the commands that transform a configuration tree into another
+
+    Deletes come first, so a changed single value statement is deleted and
+    set again. Identical subtrees (same hash) are skipped, so the cost is
+    linear in the size of the trees. User ordered children (policy terms) are reordered with
+    insert commands when needed.
+
+    Args:
+      old (dictionary): the root node of the current configuration
+      new (dictionary): the root node of the desired configuration
+
+    Returns:
+      list of strings (delete, set, activate / deactivate and insert commands)
+    """
+
+    deletes, sets, states, inserts = [], [], [], []
+    with _gc_paused():
+        _diff([], old, new, deletes, sets, states, inserts)
+    return deletes + sets + states + inserts
+
+
+def diff_text(old_text, new_text):
+    """
+    Get the set / delete commands between two configurations in curly
+    bracket format
+
+    Args:
+      old_text (string): the current configuration
+      new_text (string): the desired configuration
+
+    Returns:
+      string (one command per line, empty if the configurations are equivalent)
+    """
+
+    commands = diff(parse(old_text), parse(new_text))
+    return "\n".join(commands) + "\n" if commands else ""
+
+
+def _statement_text(key, node):
+    prefix = ""
+    if node["inactive"]:
+        prefix += "inactive: "
+    if node["replace"]:
+        prefix += "replace: "
+    return prefix + key
+
+
+def _text_lines(key, node, indent, lines):
+    pad = " " * indent
+    if node["leaf"]:
+        lines.append("{}{};".format(pad, _statement_text(key, node)))
+        return
+    lines.append("{}{} {{".format(pad, _statement_text(key, node)))
+    for k, child in node["children"].items():
+        _text_lines(k, child, indent + 4, lines)
+    lines.append("{}}}".format(pad))
+
+
+def to_text(tree):
+    """
+    Get the curly bracket format of a configuration tree (4 space indents)
+
+    Args:
+      tree (dictionary): the root node of a configuration tree
+
+    Returns:
+      string
+    """
+
+    lines = []
+    for key, child in tree["children"].items():
+        _text_lines(key, child, 0, lines)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _compare(path, old, new, out):
+    lines = []
+    changed = []
+    for key, onode in old["children"].items():
+        nnode = new["children"].get(key)
+        if nnode is None or nnode["leaf"] != onode["leaf"]:
+            block = []
+            _text_lines(key, onode, 4, block)
+            lines.extend(["-" + l[1:] for l in block])
+    for key, nnode in new["children"].items():
+        onode = old["children"].get(key)
+        if onode is None or onode["leaf"] != nnode["leaf"]:
+            block = []
+            _text_lines(key, nnode, 4, block)
+            lines.extend(["+" + l[1:] for l in block])
+            continue
+        if onode["inactive"] != nnode["inactive"]:
+            lines.append("!   {}{}".format(_statement_text(key, nnode), "" if nnode["leaf"] else " { ... }"))
+        if not nnode["leaf"] and _tree_hash(onode) != _tree_hash(nnode):
+            changed.append((key, onode, nnode))
+    if lines:
+        out.append("[edit{}]".format("".join([" " + p for p in path])))
+        out.extend(lines)
+    for key, onode, nnode in changed:
+        _compare(path + [key], onode, nnode, out)
+
+
+def compare(old, new):
+    """
+    Get the structural differences of two configuration trees, in the format
+    of the JunOS 'show | compare' command: a [edit ...] header per changed
+    hierarchy followed by the removed (-), added (+) and (de)activated (!)
+    statements. Identical subtrees (same hash) are skipped, so the cost is
+    linear in the size of the trees.
+
+    Args:
+      old (dictionary): the root node of the current configuration
+      new (dictionary): the root node of the desired configuration
+
+    Returns:
+      list of strings (the lines of the comparison, empty if the trees are
+      equivalent)
+    """
+
+    out = []
+    with _gc_paused():
+        _compare([], old, new, out)
+    return out
+
+
+def _unquote(word):
+    if len(word) > 1 and word.startswith('"') and word.endswith('"'):
+        return re.sub(r'\\(.)', r'\1', word[1:-1])
+    return word
+
+
+def _values(words):
+    """
+    Get the values of statement arguments: a [ ] list or a single value
+    """
+
+    if words and words[0] == "[":
+        return [_unquote(w) for w in words[1:-1]]
+    return [_unquote(w) for w in words]
+
+
+def _attrs(node):
+    attrs = {}
+    if node["inactive"]:
+        attrs["inactive"] = "inactive"
+    if node["replace"]:
+        attrs["replace"] = "replace"
+    return attrs
+
+
+def _xml_children(xf, parent, node):
+    for child in node["children"].values():
+        _xml_statement(xf, parent, child)
+
+
+def _xml_leaf(xf, tag, value=None, attrs=None):
+    with xf.element(tag, attrs or {}):
+        if value is not None:
+            xf.write(value)
+
+
+def _xml_statement(xf, parent, node):
+    """
+    Write the XML of a statement
+
+    Args:
+      xf: the lxml incremental writer
+      parent (list of strings): the words of the parent statement
+      node (dictionary): the tree node of the statement
+    """
+
+    words = node["words"]
+    kw = words[0]
+    pkw = parent[0] if parent else None
+    attrs = _attrs(node)
+    if not node["leaf"] and words == ["groups"] and not parent:
+        _xml_children(xf, words, node)
+    elif not node["leaf"] and len(parent) == 1 and pkw in XML_NAMED_CHILDREN:
+        with xf.element(XML_NAMED_CHILDREN[pkw], attrs):
+            _xml_leaf(xf, "name", _unquote(kw))
+            _xml_children(xf, words, node)
+    elif node["leaf"] and pkw == "prefix-list" and len(words) == 1:
+        with xf.element("prefix-list-item", attrs):
+            _xml_leaf(xf, "name", kw)
+    elif node["leaf"] and kw in XML_ONE_LINE_CONTAINERS and len(words) > 1:
+        with xf.element(kw, attrs):
+            _xml_statement(xf, words[:1], {"leaf": True, "inactive": False, "replace": False,
+                                           "words": words[1:], "children": {}})
+    elif node["leaf"] and (pkw, kw) in XML_SPECIAL_LEAFS:
+        args = words[1:]
+        with xf.element(kw, attrs):
+            for el in XML_SPECIAL_LEAFS[(pkw, kw)]:
+                if not args:
+                    break
+                if el == "*":
+                    _xml_leaf(xf, args.pop(0))
+                elif el == "*value":
+                    tag = args.pop(0)
+                    _xml_leaf(xf, tag, _unquote(args.pop(0)) if args else None)
+                elif el == "*list":
+                    if args[0] != "members":
+                        raise UnsupportedStatement(" ".join(words))
+                    for v in _values(args[1:]):
+                        _xml_leaf(xf, "members", v)
+                    args = []
+                else:
+                    _xml_leaf(xf, el, _unquote(args.pop(0)))
+            if args:
+                raise UnsupportedStatement(" ".join(words))
+    elif node["leaf"]:
+        if len(words) == 1:
+            _xml_leaf(xf, kw, attrs=attrs)
+        elif words[1] == "[":
+            for v in _values(words[1:]):
+                _xml_leaf(xf, kw, v, attrs)
+        elif kw == "as-path-prepend":
+            _xml_leaf(xf, kw, " ".join(_values(words[1:])), attrs)
+        elif len(words) == 2:
+            _xml_leaf(xf, kw, _unquote(words[1]), attrs)
+        else:
+            raise UnsupportedStatement(" ".join(words))
+    elif len(words) == 1:
+        with xf.element(kw, attrs):
+            _xml_children(xf, words, node)
+    elif len(words) == 2 and kw in XML_CHOICE_CONTAINERS:
+        with xf.element(kw):
+            with xf.element(words[1], attrs):
+                _xml_children(xf, words[1:], node)
+    elif len(words) == 2:
+        with xf.element(kw, attrs):
+            _xml_leaf(xf, "name", _unquote(words[1]))
+            _xml_children(xf, words, node)
+    else:
+        raise UnsupportedStatement(" ".join(words))
+
+
+def to_xml(tree):
+    """
+    Get the JunOS XML of a configuration tree
+
+    The XML is written incrementally (lxml xmlfile), without building an
+    element tree in memory.
+
+    Args:
+      tree (dictionary): the root node of a configuration tree
+
+    Returns:
+      string (a <configuration> element)
+
+    Raises:
+      UnsupportedStatement if a statement has no known XML mapping
+    """
+
+    if not HAS_LXML:
+        raise UnsupportedStatement("lxml is not available")
+    buf = io.BytesIO()
+    with etree.xmlfile(buf, encoding="utf-8") as xf:
+        with xf.element("configuration"):
+            _xml_children(xf, [], tree)
+    return buf.getvalue().decode("utf-8")
+
+
+def text_to_xml(text):
+    """
+    Get the JunOS XML of a configuration in curly bracket format
+
+    Args:
+      text (string): the configuration
+
+    Returns:
+      string (a <configuration> element)
+    """
+
+    return to_xml(parse(text))
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Parse, compare and convert JunOS configurations offline")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p_compare = subparsers.add_parser("compare", help="Show the differences of two configurations \
+                                      ('show | compare' format). Exits with 1 if they differ")
+    p_compare.add_argument("old", type=argparse.FileType('r'), help="The current configuration ('-' for stdin)")
+    p_compare.add_argument("new", type=argparse.FileType('r'), help="The desired configuration")
+    p_set = subparsers.add_parser("set", help="Print the set / delete commands from a configuration to another")
+    p_set.add_argument("old", type=argparse.FileType('r'), help="The current configuration ('-' for stdin)")
+    p_set.add_argument("new", type=argparse.FileType('r'), help="The desired configuration")
+    p_xml = subparsers.add_parser("xml", help="Print the JunOS XML of a configuration")
+    p_xml.add_argument("config", type=argparse.FileType('r'), help="The configuration ('-' for stdin)")
+    p_text = subparsers.add_parser("text", help="Print a configuration normalized (4 space indents, no comments)")
+    p_text.add_argument("config", type=argparse.FileType('r'), help="The configuration ('-' for stdin)")
+    p_hash = subparsers.add_parser("hash", help="Print the hash of a configuration and of its top level statements")
+    p_hash.add_argument("config", type=argparse.FileType('r'), help="The configuration ('-' for stdin)")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        if args.command in ["compare", "set"]:
+            old = parse(args.old.read())
+            new = parse(args.new.read())
+            lines = compare(old, new) if args.command == "compare" else diff(old, new)
+            # freeing the trees here is faster than at interpreter exit
+            del old, new
+            if lines:
+                print("\n".join(lines))
+                err_code = 1 if args.command == "compare" else 0
+        elif args.command == "xml":
+            print(text_to_xml(args.config.read()))
+        elif args.command == "text":
+            print(to_text(parse(args.config.read())), end="")
+        elif args.command == "hash":
+            tree = parse(args.config.read())
+            print(tree_hash(tree))
+            for key, child in tree["children"].items():
+                for k, c in child["children"].items() if key == "groups" else [(key, child)]:
+                    print("  {}  {}".format(tree_hash(c) if not c["leaf"] else "-", k))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except ParseError as e:
+        logger.error("Parse error: {}".format(e))
+        sys.exit(2)
+    except:
+        logger.exception("main()")
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Prefix trie of the BGP announcements of the bgp-te-tool.
+
+A PrefixTrie is the binary trie of the prefixes of an address family. A
+node is a prefix length and the leading bits of the prefix (the network
+address shifted right by the host bits), and the nodes are stored in one
+hash table per prefix length. The parent of a node is (length - 1,
+bits >> 1), its sibling (length, bits ^ 1), and the prefixes covering a
+route are found with one lookup per prefix length present in the trie
+(at most 33 / 129), without walking pointers bit by bit. Loading 500k
+prefixes is a dictionary insert per prefix.
+
+Route origin validation (RFC 6811) of the announcements:
+
+  valid: a covering VRP has the origin AS and a max length not shorter
+         than the announcement
+  invalid: covering VRPs exist, none of them matches
+  not-found: no covering VRP
+
+Announcements outside our allocations (v4_allocations / v6_allocations of
+the ebgp-peerings config.j2) are invalid whatever their RPKI state: the
+INVALID-ANNOUNCEMENTS policies of the routers reject them.
+
+The VRPs are read from the json export of a local relying party, the
+format of rpki-client (-j) and routinator (vrps -f json): a "roas" list of
+{"prefix", "maxLength", "asn"} objects, the asn a number or "AS<number>".
+
+Aggregation of the announcements (minimize): announcements with the same
+address family, route type, next-hop, preference and communities are
+merged without changing what is announced with which attributes:
+
+  duplicate: the same prefix twice
+  covered: a more-specific whose nearest less-specific announcement has
+           the same attributes, it is dropped
+  merged: two sibling prefixes (eg two /25 of a /24) that is not announced,
+          they are replaced by it, bottom up (four /26 become a /24)
+
+A more-specific under a less-specific announcement with other attributes
+(an overlap) is kept as it is: it is the TE of a part of the range. Given
+our allocations and the VRPs, a merge or a drop is only done if the
+resulting prefix is in our allocations and validates no worse than the
+prefixes it replaces (eg two /24 with their own VRPs are not merged into
+a /23 whose VRP has max length 16), otherwise the prefixes are kept.
+
+The module is also a command line program, for the report of the
+aggregation of an announcement pillar:
+
+  netbox_extpillar.py | prefix_trie.py
+  prefix_trie.py -p pillar.json -m > minimized.json
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename, dirname
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import json
+import os
+import pickle
+import socket
+
+#----------------- Global settings -------------------
+# Address family: (socket family, address bits)
+FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+RPKI_STATES = ["valid", "invalid", "not-found"]
+# Order of the validation states, the lower the worse
+RPKI_RANKS = {"invalid": 0, "not-found": 1, "valid": 2}
+PICKLE_VERSION = 1
+# Announcement attributes that have to be equal for an aggregation
+AGGREGATE_KEYS = ["address-family", "route-type", "next-hop", "preference"]
+#----------------- Global settings -------------------
+
+
+def _write_atomic(path, data):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def parse_prefix(prefix):
+    """
+    Get the address family, network address and length of a prefix
+
+    Args:
+      prefix (string): eg 100.64.0.0/24, 2001:db8::/48
+
+    Returns:
+      (version, address, length) tuple, the address an int
+
+    Raises:
+      ValueError on invalid prefixes or host bits set
+    """
+
+    address, _, length = prefix.partition("/")
+    version = 6 if ":" in address else 4
+    family, bits = FAMILIES[version]
+    try:
+        address = int.from_bytes(socket.inet_pton(family, address), "big")
+        length = int(length) if length else bits
+    except (OSError, ValueError):
+        raise ValueError("{} is not a valid prefix".format(prefix))
+    if not 0 <= length <= bits or address & ((1 << (bits - length)) - 1):
+        raise ValueError("{} is not a valid prefix".format(prefix))
+    return (version, address, length)
+
+
+def format_prefix(version, address, length):
+    """
+    Get the string of a prefix (the inverse of parse_prefix)
+    """
+
+    family, bits = FAMILIES[version]
+    return "{}/{}".format(socket.inet_ntop(family, address.to_bytes(bits // 8, "big")), length)
+
+
+class PrefixTrie(object):
+    """
+    Binary trie of the prefixes of an address family, a value per prefix
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        # prefix length -> {prefix bits: value}
+        self.levels = {}
+        self.lengths = []
+
+    def __len__(self):
+        return sum([len(level) for level in self.levels.values()])
+
+    def level(self, length):
+        """
+        Get the nodes of a prefix length (added if missing)
+        """
+
+        level = self.levels.get(length)
+        if level is None:
+            level = self.levels[length] = {}
+            self.lengths = sorted(self.levels)
+        return level
+
+    def setdefault(self, address, length, value):
+        """
+        Get the value of a prefix, set to value if the prefix is missing
+        """
+
+        return self.level(length).setdefault(address >> (self.bits - length), value)
+
+    def get(self, address, length, default=None):
+        level = self.levels.get(length)
+        if level is None:
+            return default
+        return level.get(address >> (self.bits - length), default)
+
+    def covering(self, address, length):
+        """
+        Get the prefixes that cover a prefix (itself included), shortest first
+
+        Returns:
+          list of (length, value) tuples
+        """
+
+        found = []
+        for l in self.lengths:
+            if l > length:
+                break
+            value = self.levels[l].get(address >> (self.bits - l))
+            if value is not None:
+                found.append((l, value))
+        return found
+
+    def items(self):
+        """
+        Get the prefixes of the trie, sorted by address and length
+
+        Returns:
+          list of (address, length, value) tuples
+        """
+
+        items = [(bits << (self.bits - length), length, value)
+                 for length, level in self.levels.items() for bits, value in level.items()]
+        items.sort(key=lambda i: (i[0], i[1]))
+        return items
+
+
+def tries():
+    """
+    Get an empty trie per address family
+    """
+
+    return {version: PrefixTrie(bits) for version, (family, bits) in FAMILIES.items()}
+
+
+def allocation_tries(v4_allocations, v6_allocations):
+    """
+    Get the tries of our allocations
+
+    Raises:
+      ValueError on invalid prefixes
+    """
+
+    t = tries()
+    for a in list(v4_allocations) + list(v6_allocations):
+        version, address, length = parse_prefix(a)
+        t[version].setdefault(address, length, a)
+    return t
+
+
+def load_vrps(path, cache=None):
+    """
+    Get the VRPs of a relying party json export, in a trie per address family
+
+    Parsing the json of 500k VRPs takes a couple of seconds, the tries are
+    loaded from a pickle cache file in a fraction of it, as long as the
+    modification time and the size of the export are unchanged.
+
+    Args:
+      path (string): the json file
+      cache (string): the pickle cache file, None for no cache
+
+    Returns:
+      tries: the value of a prefix is its VRP, asn << 8 | max length, or
+      the tuple of its VRPs. Ints are not tracked by the garbage collector,
+      lists of tuples made it most of the load time
+
+    Raises:
+      IOError, ValueError on unreadable files or invalid VRPs
+    """
+
+    st = os.stat(path)
+    source = (st.st_mtime_ns, st.st_size)
+    t = tries()
+    if cache:
+        try:
+            with open(cache, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == PICKLE_VERSION and data.get("source") == source:
+                for version, levels in data["levels"].items():
+                    t[version].levels = levels
+                    t[version].lengths = sorted(levels)
+                return t
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass
+    with open(path) as f:
+        roas = json.load(f)["roas"]
+    # parse_prefix and PrefixTrie.setdefault inlined, half of the load time
+    # is in the calls
+    levels = {}
+    from_bytes = int.from_bytes
+    inet_pton = socket.inet_pton
+    for r in roas:
+        prefix = r["prefix"]
+        address, _, length = prefix.partition("/")
+        version = 6 if ":" in address else 4
+        family, bits = FAMILIES[version]
+        try:
+            address = from_bytes(inet_pton(family, address), "big")
+            length = int(length)
+        except (OSError, ValueError):
+            raise ValueError("{} is not a valid prefix".format(prefix))
+        host = bits - length
+        if not 0 <= host <= bits or address & ((1 << host) - 1):
+            raise ValueError("{} is not a valid prefix".format(prefix))
+        level = levels.get((version, length))
+        if level is None:
+            level = levels[(version, length)] = t[version].level(length)
+        asn = r["asn"]
+        if asn.__class__ is not int:
+            asn = int(asn[2:] if asn[:2] in ("AS", "as") else asn)
+        entry = asn << 8 | int(r.get("maxLength") or length)
+        entries = level.get(address >> host)
+        if entries is None:
+            level[address >> host] = entry
+        elif entries.__class__ is int:
+            level[address >> host] = (entries, entry)
+        else:
+            level[address >> host] = entries + (entry,)
+    if cache:
+        if dirname(cache):
+            os.makedirs(dirname(cache), exist_ok=True)
+        data = {"version": PICKLE_VERSION, "source": source,
+                "levels": {version: trie.levels for version, trie in t.items()}}
+        _write_atomic(cache, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    return t
+
+
+def validate(announcements, vrps, origin_asn, allocations=None):
+    """
+    Get the route origin validation state of announcements
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      vrps (tries): see load_vrps
+      origin_asn (int): the origin AS of the announcements (our AS number)
+      allocations (tries): see allocation_tries, None not to check
+
+    Returns:
+      list of dictionaries: prefix, state (RPKI_STATES) and the reason of
+      an invalid state, in the order of the announcements
+
+    Raises:
+      ValueError on invalid prefixes
+    """
+
+    results = []
+    for a in announcements:
+        version, address, length = parse_prefix(a["prefix"])
+        state, reason = _state(version, address, length, vrps, origin_asn, allocations)
+        results.append({"prefix": a["prefix"], "state": state, "reason": reason})
+    return results
+
+
+def _state(version, address, length, vrps, origin_asn, allocations=None):
+    """
+    Get the route origin validation state of a prefix and the reason of an
+    invalid state (see validate)
+    """
+
+    if allocations is not None and not allocations[version].covering(address, length):
+        return ("invalid", "not in our allocations")
+    if vrps is None:
+        return ("not-found", None)
+    covering = vrps[version].covering(address, length)
+    if not covering:
+        return ("not-found", None)
+    vrp = [(l, entries) if entries.__class__ is tuple else (l, (entries,)) for l, entries in covering]
+    matches = [(e & 0xff, l) for l, entries in vrp for e in entries if e >> 8 == origin_asn]
+    if matches and max(matches)[0] >= length:
+        return ("valid", None)
+    if matches:
+        max_length, l = max(matches)
+        bits = vrps[version].bits
+        reason = "longer than the max length {} of the AS{} VRP {}".format(
+            max_length, origin_asn, format_prefix(version, address >> (bits - l) << (bits - l), l))
+    else:
+        asns = sorted(set([e >> 8 for l, entries in vrp for e in entries]))
+        reason = "covered by VRPs of {} only".format(", ".join(["AS{}".format(asn) for asn in asns]))
+    return ("invalid", reason)
+
+
+def _attributes(a):
+    return tuple([a.get(k) for k in AGGREGATE_KEYS] + [tuple(sorted(set(a["communities"])))])
+
+
+def minimize(announcements, vrps=None, origin_asn=None, allocations=None):
+    """
+    Get the minimized list of announcements and the report of the changes
+
+    With allocations and / or vrps, a merged or covering prefix must be in
+    our allocations and its validation state (valid, not-found, invalid)
+    must not be worse than the one of the prefixes it replaces: the
+    minimized announcements are not rejected where the original ones are
+    accepted. The merges refused are reported as kept.
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      vrps (tries): see load_vrps, None not to check
+      origin_asn (int): the origin AS of the announcements, with vrps
+      allocations (tries): see allocation_tries, None not to check
+
+    Returns:
+      (minimized, report) tuple: minimized is the list of announcements (in
+      the order of the announcements, a merged one where its first part
+      was), report a dictionary with the duplicate, covered and merged
+      prefixes, the merges kept apart and the overlaps
+
+    Raises:
+      ValueError on invalid prefixes
+    """
+
+    check = vrps is not None or allocations is not None
+    # (version, length, bits) -> (rank, reason), the lower rank the worse
+    states = {}
+
+    def state(version, length, bits):
+        if (version, length, bits) not in states:
+            host = FAMILIES[version][1] - length
+            s, reason = _state(version, bits << host, length, vrps, origin_asn, allocations)
+            states[(version, length, bits)] = (RPKI_RANKS[s], reason)
+        return states[(version, length, bits)]
+
+    t = tries()
+    # attributes -> id, the value of a prefix in the tries; -1 for a prefix
+    # announced twice with different attributes, never aggregated
+    ids = {}
+    # (version, length, bits) -> (announcement index, original prefixes)
+    nodes = {}
+    report = {"announcements": len(announcements), "minimized": 0, "duplicate": [], "covered": [],
+              "merged": [], "kept": [], "overlaps": []}
+    for i, a in enumerate(announcements):
+        version, address, length = parse_prefix(a["prefix"])
+        trie = t[version]
+        key = ids.setdefault(_attributes(a), len(ids))
+        bits = address >> (trie.bits - length)
+        current = trie.get(address, length)
+        if current is None:
+            trie.setdefault(address, length, key)
+            nodes[(version, length, bits)] = (i, [a["prefix"]])
+        elif current == key:
+            report["duplicate"].append(a["prefix"])
+        else:
+            trie.level(length)[bits] = -1
+            nodes[(version, length, bits, i)] = (i, [a["prefix"]])
+    # siblings, longest prefixes first so that merges cascade
+    for version, trie in t.items():
+        for length in range(trie.bits, 0, -1):
+            level = trie.levels.get(length)
+            if not level:
+                continue
+            for bits in [b for b in level if not b & 1]:
+                key = level.get(bits)
+                if key is None or key == -1 or level.get(bits | 1) != key:
+                    continue
+                parent = trie.level(length - 1)
+                if (bits >> 1) in parent:
+                    continue
+                if check:
+                    rank, reason = state(version, length - 1, bits >> 1)
+                    if rank < max(state(version, length, bits)[0], state(version, length, bits | 1)[0]):
+                        prefix = format_prefix(version, (bits >> 1) << (trie.bits - length + 1), length - 1)
+                        report["kept"].append({"prefix": prefix, "from": nodes[(version, length, bits)][1] +
+                                               nodes[(version, length, bits | 1)][1], "reason": reason})
+                        continue
+                del level[bits], level[bits | 1]
+                parent[bits >> 1] = key
+                i0, p0 = nodes.pop((version, length, bits))
+                i1, p1 = nodes.pop((version, length, bits | 1))
+                nodes[(version, length - 1, bits >> 1)] = (min(i0, i1), p0 + p1)
+    # covered more-specifics and overlaps, against the nearest less-specific
+    for version, trie in t.items():
+        removed = []
+        for address, length, key in trie.items():
+            covering = [(l, k) for l, k in trie.covering(address, length) if l < length]
+            if not covering:
+                continue
+            l, k = covering[-1]
+            prefix = format_prefix(version, address, length)
+            by = format_prefix(version, address >> (trie.bits - l) << (trie.bits - l), l)
+            if key == k and key != -1 and check:
+                bits = address >> (trie.bits - length)
+                if state(version, l, bits >> (length - l))[0] < state(version, length, bits)[0]:
+                    report["kept"].append({"prefix": prefix, "by": by,
+                                           "reason": state(version, l, bits >> (length - l))[1]})
+                    continue
+            if key == k and key != -1:
+                removed.append((address, length))
+                report["covered"].append({"prefix": prefix, "by": by})
+            else:
+                report["overlaps"].append({"prefix": prefix, "by": by})
+        for address, length in removed:
+            bits = address >> (trie.bits - length)
+            del trie.levels[length][bits]
+            nodes.pop((version, length, bits))
+    minimized = []
+    for node, (i, prefixes) in sorted(nodes.items(), key=lambda n: n[1][0]):
+        a = announcements[i]
+        if len(prefixes) > 1:
+            a = dict(a, prefix=format_prefix(node[0], node[2] << (FAMILIES[node[0]][1] - node[1]), node[1]))
+            report["merged"].append({"prefix": a["prefix"], "from": prefixes})
+        minimized.append(a)
+    report["minimized"] = len(minimized)
+    return (minimized, report)
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Report the aggregation of the BGP announcements of a pillar")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-p", "--pillar", type=argparse.FileType('r'), default="-",
+                        help="The announcement pillar json (default: stdin)")
+    parser.add_argument("-m", "--minimized", action="store_true", help="Print the pillar with the \
+                        minimized announcements instead of the report")
+    parser.add_argument("-j", "--json", action="store_true", help="Print the report as json")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        pillar = json.load(args.pillar)
+        minimized, report = minimize(pillar.get("bgp", {}).get("announcements", []))
+        logger.debug("Announcements minimized in {}".format(datetime.datetime.now() - t0))
+        if args.minimized:
+            pillar.setdefault("bgp", {})["announcements"] = minimized
+            print(json.dumps(pillar))
+        elif args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            for m in report["merged"]:
+                print("merged    {:<45} {}".format(m["prefix"], " ".join(m["from"])))
+            for c in report["covered"]:
+                print("covered   {:<45} by {}".format(c["prefix"], c["by"]))
+            for p in report["duplicate"]:
+                print("duplicate {}".format(p))
+            for k in report["kept"]:
+                print("kept      {:<45} {}: {}".format(k["prefix"], " ".join(k["from"]) if "from" in k else
+                                                       "under {}".format(k["by"]), k["reason"]))
+            for o in report["overlaps"]:
+                print("overlap   {:<45} under {}".format(o["prefix"], o["by"]))
+            print("{} announcements, {} minimized ({} merged, {} covered, {} duplicate, {} kept), {} overlaps".format(
+                report["announcements"], report["minimized"], len(report["merged"]), len(report["covered"]),
+                len(report["duplicate"]), len(report["kept"]), len(report["overlaps"])))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    except:
+        logger.exception("main()")
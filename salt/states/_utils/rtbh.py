@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Remotely triggered blackhole (RTBH) routes of the bgp-te-tool.
+
+A blackholed prefix is a discard static route tagged with the
+RTBH-AS<local_asn> community (<local_asn>:666), in the rib of the
+bgp-announcements state (the Internet VRF, if any). The RTBH term of the
+eBGP out policies announces it to the transit providers with their
+blackhole community.
+
+The routes are configured outside of the BGP-ANNOUNCEMENTS group, as a few
+set / delete commands, so a blackhole is committed without rendering the
+states and the full applies of the states leave it in place.
+
+Only prefixes of our allocations (v4_allocations / v6_allocations of the
+ebgp-peerings config.j2) can be blackholed: the out policies reject
+anything else as an invalid announcement.
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+
+import ipaddress
+import re
+
+#----------------- Global settings -------------------
+# Blackhole community: <local_asn>:RTBH_COMMUNITY_VALUE (RTBH-AS<local_asn>)
+RTBH_COMMUNITY_VALUE = 666
+#----------------- Global settings -------------------
+
+
+def validate(prefix, v4_allocations, v6_allocations):
+    """
+    Check that a prefix can be blackholed
+
+    Args:
+      prefix (string): the prefix (a host address is taken as a /32 or /128)
+      v4_allocations (list of strings): our IPv4 allocations
+      v6_allocations (list of strings): our IPv6 allocations
+
+    Returns:
+      string (the prefix, normalized)
+
+    Raises:
+      ValueError if the prefix is invalid or not in our allocations
+    """
+
+    try:
+        network = ipaddress.ip_network(str(prefix).strip())
+    except ValueError as e:
+        raise ValueError("{} is not a valid prefix: {}".format(prefix, e))
+    allocations = v4_allocations if network.version == 4 else v6_allocations
+    for a in allocations:
+        allocation = ipaddress.ip_network(a)
+        if network.subnet_of(allocation):
+            return str(network)
+    raise ValueError("{} is not in our allocations ({})".format(network, ", ".join(allocations) or "none"))
+
+
+def rib(prefix, internet_vrf=None):
+    """
+    Get the configuration path of the rib of a prefix (set command syntax)
+    """
+
+    table = "inet.0" if ipaddress.ip_network(prefix).version == 4 else "inet6.0"
+    if internet_vrf:
+        return "routing-instances {0} routing-options rib {0}.{1}".format(internet_vrf, table)
+    return "routing-options rib {}".format(table)
+
+
+def config(prefix, local_asn, internet_vrf=None, withdraw=False):
+    """
+    Get the set / delete commands that blackhole a prefix or withdraw it
+
+    Args:
+      prefix (string): the validated prefix
+      local_asn (int): our AS number
+      internet_vrf (string): the Internet VRF (None for the main instance)
+      withdraw (boolean): remove the blackhole route
+
+    Returns:
+      string (the JunOS set commands)
+    """
+
+    route = "{} static route {}".format(rib(prefix, internet_vrf), prefix)
+    if withdraw:
+        return "delete {}\n".format(route)
+    return "set {0} discard\nset {0} community {1}:{2}\n".format(route, local_asn, RTBH_COMMUNITY_VALUE)
+
+
+def parse(text, local_asn):
+    """
+    Get the blackholed prefixes from configuration in set format
+    (show configuration ... | display set)
+
+    Returns:
+      sorted list of strings
+    """
+
+    rgx = re.compile(r"^set .*\bstatic route (\S+) community {}:{}$".format(local_asn, RTBH_COMMUNITY_VALUE))
+    found = set()
+    for line in text.splitlines():
+        m = rgx.match(line.strip())
+        if m:
+            found.add(m.group(1))
+    return sorted(found, key=lambda p: (ipaddress.ip_network(p).version, ipaddress.ip_network(p)))
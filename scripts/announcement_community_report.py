@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+Program that reports on the community sets carried by the BGP announcements
+found in netbox.
+
+The bgp-announcements state interns community sets: every distinct set of
+communities is rendered once and reused by all the static and aggregate
+routes that carry it, as a single line community list instead of one line
+per member. This program reads the pillar data produced by
+netbox_extpillar.py (as a file or from stdin) and reports the number of
+announcements, the number of unique community sets, the most used sets and
+the configuration bytes saved by the interned representation.
+
+Example:
+
+  netbox_extpillar.py -s | announcement_community_report.py
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import json
+import re
+
+#----------------- Global settings -------------------
+# Indentation of the community statement of a route inside the
+# BGP-ANNOUNCEMENTS group, as produced by announcements.j2
+ROUTE_ATTR_INDENT = 32
+# Indentation of the community members in the multi line representation
+MEMBER_INDENT = 36
+#----------------- Global settings -------------------
+
+def junos_community(c):
+    """
+    Get a community string and return its JunOS representation
+
+    Args:
+      c (string): a community as stored in netbox (eg 65000:3:1999)
+
+    Returns:
+      string (large communities are prefixed with large:)
+
+    Raises:
+      None
+    """
+
+    return re.sub(r'(\d+:\d+:\d+$)', r'large:\1', c)
+
+
+def community_set_key(communities):
+    """
+    Get the list of communities of an announcement and return the key of
+    its community set. Order and duplicates do not matter in a set, so
+    this matches the key used by announcements.j2
+
+    Args:
+      communities (list of strings): the communities of an announcement
+
+    Returns:
+      string
+
+    Raises:
+      None
+    """
+
+    return " ".join(sorted(set(communities)))
+
+
+def inline_size(communities):
+    """
+    Size in bytes of the multi line community statement (one line per member)
+
+    Args:
+      communities (list of strings): the communities of an announcement
+
+    Returns:
+      int
+
+    Raises:
+      None
+    """
+
+    size = ROUTE_ATTR_INDENT + len("community [") + 1
+    for c in communities:
+        size += MEMBER_INDENT + len(junos_community(c)) + 1
+    size += ROUTE_ATTR_INDENT + len("];") + 1
+    return size
+
+
+def interned_size(communities):
+    """
+    Size in bytes of the single line community statement of an interned set
+
+    Args:
+      communities (list of strings): the communities of an announcement
+
+    Returns:
+      int
+
+    Raises:
+      None
+    """
+
+    members = " ".join([junos_community(c) for c in sorted(set(communities))])
+    return ROUTE_ATTR_INDENT + len("community [ ") + len(members) + len(" ];") + 1
+
+
+def community_set_report(announcements, top=10):
+    """
+    Computes the community set statistics of the BGP announcements
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements list of the
+                                            netbox external pillar
+      top (int): number of most used community sets to include
+
+    Returns:
+      report (dictionary): the statistics
+
+    Return example:
+      {'announcements': 31,
+       'unique_sets': 12,
+       'inline_bytes': 6904,
+       'interned_bytes': 3913,
+       'saved_bytes': 2991,
+       'top_sets': [{'communities': '65000:3:1999 65000:400:250', 'routes': 9}]}
+
+    Raises:
+      None
+    """
+
+    sets = {}
+    inline_bytes = 0
+    interned_bytes = 0
+    for a in announcements:
+        key = community_set_key(a["communities"])
+        sets[key] = sets.get(key, 0) + 1
+        inline_bytes += inline_size(a["communities"])
+        interned_bytes += interned_size(a["communities"])
+    top_sets = sorted(sets.items(), key=lambda i: (-i[1], i[0]))[:top]
+    return {"announcements": len(announcements),
+            "unique_sets": len(sets),
+            "inline_bytes": inline_bytes,
+            "interned_bytes": interned_bytes,
+            "saved_bytes": inline_bytes - interned_bytes,
+            "top_sets": [{"communities": k, "routes": v} for k, v in top_sets]}
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Report on the community sets of the BGP announcements")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-j", "--json", help="Print the report as json", action="store_true")
+    parser.add_argument("-t", "--top", type=int, default=10,
+                        help="Number of most used community sets to report")
+    parser.add_argument('pillar', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                        help='The netbox external pillar json (default: stdin)')
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        pillar = json.load(args.pillar)
+        announcements = pillar.get("bgp", {}).get("announcements", [])
+        report = community_set_report(announcements, args.top)
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print("Announcements:  {}".format(report["announcements"]))
+            print("Unique sets:    {}".format(report["unique_sets"]))
+            print("Inline bytes:   {}".format(report["inline_bytes"]))
+            print("Interned bytes: {}".format(report["interned_bytes"]))
+            if report["inline_bytes"] > 0:
+                print("Saved bytes:    {} ({:.1f}%)".format(report["saved_bytes"],
+                      100.0 * report["saved_bytes"] / report["inline_bytes"]))
+            print("Most used sets:")
+            for s in report["top_sets"]:
+                print("  {:6d}  {}".format(s["routes"], s["communities"]))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+"""
+Offline evaluation of the eBGP out policies of the routers: which prefix is
+exported to which BGP session, with how many prepends, without looking at
+the routers.
+
+The announcements (netbox pillar, plus optional extra routes such as the
+legacy routes of transit customers) are evaluated against the out policy of
+every session of the peering pillars (peering-manager pillar), with the
+term semantics of gen_junos_ebgp_out_policy as modelled in export_policy.py:
+invalid announcement guard, RTBH, per peer and per location no-announce /
+announce / prepend, default announce and legacy customer routes. The
+result is the full prefix x session export matrix.
+
+The outcome of a route only depends on a few of its attributes (our ranges,
+customer AS path, the markers, RTBH and any peer / location communities)
+and on the peer ASN, location and relationship of the session. So:
+
+  - the routes are grouped in classes of the attributes all the sessions
+    look at, and the row of a (relationship, location, family) is built by
+    translating the class ids of the routes (bytes.translate) with a table
+    of the outcomes of the classes,
+  - the routes carrying communities of a location or of a peer ASN are
+    overlaid on the row of the sessions of that location / peer.
+
+Every distinct (policy, route class) is evaluated once, so 100k prefixes x
+5k sessions are computed in seconds and the matrix is kept as shared rows
+plus the overlays of the sessions.
+
+Example:
+
+  export_matrix.py -p vmx1-lab.json -p vmx2-lab.json -a announcements.json --summary
+  export_matrix.py -p vmx1-lab.json -a announcements.json --peer 65100
+  export_matrix.py -p vmx1-lab.json -a announcements.json --format csv -o matrix.csv --rejected
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename, splitext
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import ipaddress
+import sys
+import csv
+import json
+import export_policy
+
+#----------------- Global settings -------------------
+# Our large community of no action, standing for any large community of ours
+# (see the OUR_TAGGED_AS_RANGES term of the optimized layout)
+OTHER_LARGE_ACTION = 61
+PEER_ACTIONS = set([str(a) for a in export_policy.PEER_ACTIONS])
+LOCATION_ACTIONS = set([str(a) for a in export_policy.LOCATION_ACTIONS])
+CELL_FIELDS = ["router", "group", "neighbor", "peer_asn", "export_policy", "prefix", "outcome",
+               "prepend", "term"]
+#----------------- Global settings -------------------
+
+def get_sessions(pillar, router):
+    """
+    Get the BGP sessions with an out policy of a router from its peering pillar
+
+    Args:
+      pillar (dictionary): the pillar of the router (peering-manager extpillar)
+      router (string): the router name
+
+    Returns:
+      list of dictionaries: router, group, neighbor, family, peer_asn,
+      relationship, export_policy, location and is_enabled
+
+    Raises:
+      None
+    """
+
+    sessions = []
+    location = (pillar.get("location") or "").upper()
+    for key in ["direct-peerings", "internet-exchange-peerings"]:
+        for pg in pillar.get("bgp", {}).get(key, []):
+            for s in pg["peerings"]:
+                if s["export_policy"]:
+                    sessions.append({"router": router, "group": pg["group"], "neighbor": s["neighbor"],
+                                     "family": s["family"], "peer_asn": int(s["peer_asn"]),
+                                     "relationship": s["relationship"], "export_policy": s["export_policy"],
+                                     "location": location, "is_enabled": s.get("is_enabled", True)})
+    return sessions
+
+
+def get_routes(announcements, settings, customer_routes=None):
+    """
+    Get the routes seen by the out policies, sorted by family and prefix
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      customer_routes (list of dictionaries): routes learned from transit
+                                              customers (prefix, communities)
+
+    Returns:
+      list of dictionaries: prefix, family (inet or inet6), in_ranges,
+      customer_path and communities (frozenset)
+
+    Raises:
+      ValueError on invalid prefixes
+    """
+
+    # (version, prefix length, shifted network address) of the allocations
+    allocations = []
+    for a in settings["v4_allocations"] + settings["v6_allocations"]:
+        r = ipaddress.ip_network(a)
+        allocations.append((r.version, r.prefixlen, int(r.network_address) >> (r.max_prefixlen - r.prefixlen)))
+    routes = []
+    for customer, records in [(False, announcements), (True, customer_routes or [])]:
+        for a in records:
+            network = ipaddress.ip_network(a["prefix"])
+            address = int(network.network_address)
+            routes.append({"prefix": str(network), "family": "inet" if network.version == 4 else "inet6",
+                           "in_ranges": any([network.version == v and network.prefixlen >= l and
+                                             address >> (network.max_prefixlen - l) == n
+                                             for v, l, n in allocations]),
+                           "customer_path": customer, "communities": frozenset(a.get("communities", [])),
+                           "_key": (network.version, address, network.prefixlen)})
+    routes.sort(key=lambda r: r["_key"])
+    for r in routes:
+        del r["_key"]
+    return routes
+
+
+def split_communities(communities, local_asn):
+    """
+    Split the communities of a route in the parts the out policies look at
+
+    Args:
+      communities (frozenset of strings): the route communities
+      local_asn (int): our AS number
+
+    Returns:
+      (common, peers, locations) tuple: common is the frozenset of the
+      communities every policy sees the same way, peers and locations map a
+      peer ASN / location code to the frozenset of its action communities
+
+    Raises:
+      None
+    """
+
+    asn = str(local_asn)
+    markers = set(["{}:3:1999".format(asn), "{}:3:200".format(asn), "{}:40:0".format(asn), "{}:400:0".format(asn)])
+    common = set()
+    peers = {}
+    locations = {}
+    other_large = False
+    for c in communities:
+        parts = c.split(":")
+        if len(parts) == 3 and parts[0] == asn:
+            data1, target = parts[1], parts[2]
+            if c in markers:
+                common.add(c)
+            else:
+                # the actions of the other peers / locations still are large
+                # communities of ours for every policy
+                other_large = True
+                if target != "0" and data1 in PEER_ACTIONS:
+                    peers.setdefault(int(target), set()).add(c)
+                elif target != "0" and data1 in LOCATION_ACTIONS:
+                    locations.setdefault(int(target), set()).add(c)
+        elif c == "{}:666".format(asn):
+            common.add(c)
+    if other_large:
+        common.add("{}:{}:0".format(asn, OTHER_LARGE_ACTION))
+    return (frozenset(common), {k: frozenset(v) for k, v in peers.items()},
+            {k: frozenset(v) for k, v in locations.items()})
+
+
+def build_matrix(routes, sessions, settings, used_actions=None, optimized=False):
+    """
+    Compute the prefix x session export matrix
+
+    Args:
+      routes (list of dictionaries): see get_routes (sorted by family)
+      sessions (list of dictionaries): see get_sessions
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      used_actions (set of strings): the used actions when pruning, None otherwise
+      optimized (boolean): evaluate the optimize_out_policies layout
+
+    Returns:
+      matrix (dictionary):
+        routes, sessions: the arguments
+        results: list of (outcome, prepend, term) tuples, indexed by the
+                 cell codes
+        families: family -> (first, last + 1) route indexes
+        bases: base key -> bytes, the cell codes of the routes of a family
+        rows: per session, (base key, overlay) where the overlay maps a
+              route index (relative to the family) to its cell code
+
+    Raises:
+      ValueError if the policies give more than 256 distinct results
+    """
+
+    asn = settings["local_asn"]
+    geolocations = settings["geolocations"]
+    results = []
+    codes = {}
+    policies = {}
+    memo = {}
+
+    def evaluate(s, route, communities):
+        pkey = (s["peer_asn"], s["location"], s["relationship"])
+        key = (pkey, route["in_ranges"], route["customer_path"], communities)
+        if key not in memo:
+            if pkey not in policies:
+                p = {"name": s["export_policy"], "family": s["family"], "peer_asn": s["peer_asn"],
+                     "relationship": s["relationship"], "location": s["location"]}
+                policies[pkey] = (export_policy.build_out_policy(p, settings, used_actions, optimized),
+                                  export_policy.build_named_communities(p, settings))
+            terms, named = policies[pkey]
+            res = export_policy.evaluate({"in_ranges": route["in_ranges"], "customer_path": route["customer_path"],
+                                          "communities": communities}, terms, named)
+            result = (res[0], res[1], res[4])
+            if result not in codes:
+                if len(results) == 256:
+                    raise ValueError("more than 256 distinct policy results")
+                codes[result] = len(results)
+                results.append(result)
+            memo[key] = codes[result]
+        return memo[key]
+
+    families = {}
+    for i, r in enumerate(routes):
+        first, last = families.get(r["family"], (i, i))
+        families[r["family"]] = (first, i + 1)
+    # route classes: the attributes every policy sees the same way
+    classes = []
+    class_ids = {}
+    class_of = bytearray(len(routes))
+    split = []
+    peer_routes = {}
+    location_routes = {}
+    for i, r in enumerate(routes):
+        common, peers, locations = split_communities(r["communities"], asn)
+        key = (r["in_ranges"], r["customer_path"], common)
+        if key not in class_ids:
+            if len(classes) == 256:
+                raise ValueError("more than 256 route classes")
+            class_ids[key] = len(classes)
+            classes.append((r, common))
+        class_of[i] = class_ids[key]
+        split.append((common, peers, locations))
+        for a in peers:
+            peer_routes.setdefault(a, []).append(i)
+        for c in locations:
+            location_routes.setdefault(c, []).append(i)
+
+    bases = {}
+    rows = []
+    for s in sessions:
+        if s["family"] not in families:
+            rows.append((None, {}))
+            continue
+        first, last = families[s["family"]]
+        loc = geolocations.get(s["location"])
+        base_key = (s["relationship"], s["location"], s["family"])
+        if base_key not in bases:
+            table = bytes([evaluate(s, r, common) for r, common in classes]) + bytes(256 - len(classes))
+            base = bytearray(bytes(class_of[first:last]).translate(table))
+            for i in location_routes.get(loc, []):
+                if first <= i < last:
+                    common, peers, locations = split[i]
+                    base[i - first] = evaluate(s, routes[i], common | locations[loc])
+            bases[base_key] = bytes(base)
+        overlay = {}
+        for i in peer_routes.get(s["peer_asn"], []):
+            if first <= i < last:
+                common, peers, locations = split[i]
+                overlay[i - first] = evaluate(s, routes[i], common | locations.get(loc, frozenset()) |
+                                              peers[s["peer_asn"]])
+        rows.append((base_key, overlay))
+    return {"routes": routes, "sessions": sessions, "results": results, "families": families,
+            "bases": bases, "rows": rows}
+
+
+def session_row(matrix, s):
+    """
+    Get the cell codes of a session (index in matrix sessions), one per
+    route of its family
+
+    Returns:
+      (first, bytearray) tuple: first is the index of the first route of the row
+    """
+
+    base_key, overlay = matrix["rows"][s]
+    if base_key is None:
+        return (0, bytearray())
+    row = bytearray(matrix["bases"][base_key])
+    for i, c in overlay.items():
+        row[i] = c
+    return (matrix["families"][matrix["sessions"][s]["family"]][0], row)
+
+
+def session_summary(matrix, s):
+    """
+    Get the number of routes per result of a session, without building its row
+
+    Returns:
+      dictionary: exported, rejected and prepend<n> (accepted with n prepends)
+    """
+
+    base_key, overlay = matrix["rows"][s]
+    counts = [0] * len(matrix["results"])
+    if base_key is not None:
+        base = matrix["bases"][base_key]
+        # the sessions of a base share its counts
+        base_counts = matrix.setdefault("base_counts", {})
+        if base_key not in base_counts:
+            base_counts[base_key] = [base.count(code) for code in range(len(counts))]
+        counts = list(base_counts[base_key])
+        for i, c in overlay.items():
+            counts[base[i]] -= 1
+            counts[c] += 1
+    summary = {"exported": 0, "rejected": 0, "prepend1": 0, "prepend2": 0, "prepend3": 0}
+    for (outcome, prepend, term), n in zip(matrix["results"], counts):
+        if outcome == "accept":
+            summary["exported"] += n
+            if prepend:
+                summary["prepend{}".format(prepend)] += n
+        else:
+            summary["rejected"] += n
+    return summary
+
+
+def cells(matrix, session_ids, prefixes=None, rejected=False):
+    """
+    Get the cells of sessions
+
+    Args:
+      matrix (dictionary): see build_matrix
+      session_ids (list of ints): the sessions (indexes in matrix sessions)
+      prefixes (set of strings): only these prefixes
+      rejected (boolean): include the rejected routes
+
+    Returns:
+      generator of dictionaries (CELL_FIELDS)
+    """
+
+    routes = matrix["routes"]
+    for s in session_ids:
+        session = matrix["sessions"][s]
+        first, row = session_row(matrix, s)
+        for i, code in enumerate(row):
+            route = routes[first + i]
+            if prefixes and route["prefix"] not in prefixes:
+                continue
+            outcome, prepend, term = matrix["results"][code]
+            if outcome != "accept" and not rejected:
+                continue
+            yield {"router": session["router"], "group": session["group"], "neighbor": session["neighbor"],
+                   "peer_asn": session["peer_asn"], "export_policy": session["export_policy"],
+                   "prefix": route["prefix"], "outcome": outcome, "prepend": prepend, "term": term}
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compute which prefixes the eBGP out policies export to which session")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-f", "--config", default=export_policy.DEFAULT_CONFIG,
+                        help="The config.j2 of the ebgp-peerings state")
+    parser.add_argument("-p", "--pillar", action="append", required=True,
+                        help="Peering pillar json of a router (repeat). The router name is the file \
+                        name without extension, or given as name=path")
+    parser.add_argument("-a", "--announcements", help="Announcement pillar json (netbox extpillar). \
+                        Default: the announcements of the first peering pillar that has them")
+    parser.add_argument("-r", "--customer-routes", help="Json list of routes learned from transit \
+                        customers (prefix, communities)")
+    parser.add_argument("--router", action="append", help="Only the sessions of this router (repeat)")
+    parser.add_argument("--peer", type=int, action="append", help="Only the sessions of this peer ASN (repeat)")
+    parser.add_argument("--neighbor", action="append", help="Only the session of this neighbor address (repeat)")
+    parser.add_argument("--prefix", action="append", help="Only this prefix (repeat)")
+    parser.add_argument("--rejected", action="store_true", help="Include the rejected routes")
+    parser.add_argument("-s", "--summary", action="store_true", help="Print the number of exported \
+                        routes per session instead of the cells")
+    parser.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                        help="Output format (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="Write the output to this file instead of stdout")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        settings = export_policy.load_template_settings(args.config)
+        sessions = []
+        announcements = None
+        for p in args.pillar:
+            router, path = p.split("=", 1) if "=" in p else (splitext(basename(p))[0], p)
+            with open(path) as f:
+                pillar = json.load(f)
+            sessions.extend(get_sessions(pillar, router))
+            if announcements is None and "announcements" in pillar.get("bgp", {}):
+                announcements = pillar["bgp"]["announcements"]
+        if args.announcements:
+            with open(args.announcements) as f:
+                announcements = json.load(f).get("bgp", {}).get("announcements", [])
+        customer_routes = None
+        if args.customer_routes:
+            with open(args.customer_routes) as f:
+                customer_routes = json.load(f)
+        announcements = announcements or []
+        used_actions = None
+        if settings.get("prune_unused_policy_actions"):
+            used_actions = export_policy.get_used_actions(announcements, settings["local_asn"])
+        routes = get_routes(announcements, settings, customer_routes)
+        matrix = build_matrix(routes, sessions, settings, used_actions,
+                              bool(settings.get("optimize_out_policies")))
+        logger.info("{} routes x {} sessions evaluated in {}".format(len(routes), len(sessions),
+                                                                     datetime.datetime.now() - t0))
+        selected = [i for i, s in enumerate(sessions)
+                    if (not args.router or s["router"] in args.router) and
+                    (not args.peer or s["peer_asn"] in args.peer) and
+                    (not args.neighbor or s["neighbor"] in args.neighbor)]
+        prefixes = set([str(ipaddress.ip_network(p)) for p in args.prefix or []])
+        if args.summary:
+            fields = ["router", "group", "neighbor", "peer_asn", "export_policy"]
+            records = []
+            for i in selected:
+                rec = {k: sessions[i][k] for k in fields}
+                rec.update(session_summary(matrix, i))
+                records.append(rec)
+            fields += ["exported", "prepend1", "prepend2", "prepend3", "rejected"]
+        else:
+            fields = CELL_FIELDS
+            records = cells(matrix, selected, prefixes, args.rejected)
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        if args.format == "json":
+            json.dump(list(records), out, indent=2)
+            out.write("\n")
+        elif args.format == "csv":
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writeheader()
+            for rec in records:
+                writer.writerow(rec)
+        else:
+            out.write(" ".join(fields) + "\n")
+            for rec in records:
+                out.write(" ".join([str(rec[k]) for k in fields]) + "\n")
+        if args.output:
+            out.close()
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+
+"""
+Offline model of the eBGP out policies generated by the ebgp-peerings state
+(gen_junos_ebgp_out_policy in lib.j2).
+
+The policy terms are modelled with the JunOS first match semantics: named
+communities with several members match only if the route carries all the
+members, a list of communities in a from clause matches if any of them
+matches and a from policy clause matches if the subroutine accepts the route.
+Term evaluations (subroutine terms included) are counted per route.
+
+Two commands are supported:
+
+  verify: proves that the optimized layout of the out policies
+          (optimize_out_policies in config.j2) gives the same
+          accept/reject outcome, prepends and resulting communities as the
+          standard layout. The terms only look at a small set of route
+          attributes (our ranges, transit customer AS path and the
+          communities referenced by the policy), so every equivalence class
+          of routes is enumerated exhaustively.
+  bench:  builds a synthetic full table (Internet routes from transits,
+          transit customer routes, our announcements and untagged routes of
+          our ranges) and counts the term evaluations per route of both
+          layouts.
+
+Settings (local ASN, locations, allocations, transit customers) are read from
+the config.j2 of the ebgp-peerings state.
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename, dirname, join, realpath
+from logging.handlers import SysLogHandler
+from itertools import product
+from functools import lru_cache
+import logging
+import argparse
+import datetime
+import random
+import sys
+import json
+import jinja2
+
+#----------------- Global settings -------------------
+DEFAULT_CONFIG = join(dirname(realpath(__file__)), "..", "salt", "states",
+                      "ebgp-peerings", "templates", "config.j2")
+# Out policy actions per peer ASN and per location (large community data1)
+PEER_ACTIONS = [40, 41, 61, 62, 63]
+LOCATION_ACTIONS = [400, 601, 602, 603]
+#----------------- Global settings -------------------
+
+def load_template_settings(path):
+    """
+    Get the settings of a state from its config.j2 template
+
+    The config.j2 templates only contain set statements, so the template is
+    rendered and the variables exported by the template module are returned.
+
+    Args:
+      path (string): path of the config.j2 template
+
+    Returns:
+      settings (dictionary): the template variables (eg local_asn, geolocations)
+
+    Raises:
+      IOError if the template cannot be read
+    """
+
+    with open(path) as f:
+        source = f.read()
+    module = jinja2.Environment(extensions=["jinja2.ext.do"]).from_string(source).module
+    return {k: getattr(module, k) for k in dir(module) if not k.startswith("_")}
+
+
+def get_used_actions(announcements, local_asn):
+    """
+    Get the out policy actions referenced by the BGP announcements.
+
+    This is the same computation peerings.j2 does when
+    prune_unused_policy_actions is enabled.
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      local_asn (int): our AS number
+
+    Returns:
+      set of strings in the form "<action>:<asn or location code>"
+
+    Raises:
+      None
+    """
+
+    used = set()
+    actions = [str(a) for a in PEER_ACTIONS + LOCATION_ACTIONS]
+    for a in announcements:
+        for c in a["communities"]:
+            parts = c.split(":")
+            if len(parts) == 3 and parts[0] == str(local_asn) and parts[1] in actions:
+                used.add("{}:{}".format(parts[1], parts[2]))
+    return used
+
+
+@lru_cache(maxsize=None)
+def member_match(community, member):
+    """
+    Check whether a community matches a member of a named community
+
+    Args:
+      community (string): a community (eg 65000:61:65100)
+      member (string): a member of a named community. A field can be the
+                       wildcard * (eg 65000:*:*)
+
+    Returns:
+      boolean
+
+    Raises:
+      None
+    """
+
+    if "*" not in member:
+        return community == member
+    m_parts = member.split(":")
+    c_parts = community.split(":")
+    return len(c_parts) == len(m_parts) and \
+        all([mp == "*" or mp == cp for mp, cp in zip(m_parts, c_parts)])
+
+
+def community_match(communities, members):
+    """
+    Check whether a route carrying communities matches a named community
+
+    Args:
+      communities (frozenset of strings): the communities of the route
+      members (tuple of strings): the members of the named community
+
+    Returns:
+      boolean (True if every member is matched by a route community)
+
+    Raises:
+      None
+    """
+
+    for m in members:
+        if "*" not in m:
+            if m not in communities:
+                return False
+        elif not any([member_match(c, m) for c in communities]):
+            return False
+    return True
+
+
+def _term(name, from_communities=None, from_policy=None, ranges=None, customer_path=None,
+          then=None, action="next"):
+    """
+    Build a policy term record. All the given from conditions must match.
+    """
+
+    return {"name": name,
+            "from_communities": from_communities,
+            "from_policy": from_policy,
+            "ranges": ranges,
+            "customer_path": customer_path,
+            "then": then or [],
+            "action": action}
+
+
+def build_named_communities(p, settings):
+    """
+    Get the named communities used by an out policy
+
+    Args:
+      p (dictionary): the policy record (name, family, peer_asn, relationship, location)
+      settings (dictionary): the ebgp-peerings config.j2 settings
+
+    Returns:
+      dictionary of community name -> tuple of members
+
+    Raises:
+      None
+    """
+
+    asn = settings["local_asn"]
+    loc = settings["geolocations"].get(p["location"])
+    peer = p["peer_asn"]
+    rtbh = settings["transit_blackhole_communities"].get(peer, "{}:666".format(peer))
+    named = {"RT_ANY": ("target:*:*",),
+             "AS{}_LARGE_ANY".format(asn): ("{}:*:*".format(asn),),
+             "RTBH-AS{}".format(asn): ("{}:666".format(asn),),
+             "RTBH-AS{}".format(peer): (rtbh,),
+             "ROUTE_ANNOUNCEMENT": ("{}:3:1999".format(asn),),
+             "CUSTOMER_ROUTE_ANNOUNCEMENT": ("{}:3:200".format(asn),)}
+    for prefix, marker in [("", "3:1999"), ("CUSTOMER_", "3:200")]:
+        named["{}ROUTE_NO_ANNOUNCE_ANY_PEER".format(prefix)] = ("{}:{}".format(asn, marker), "{}:40:0".format(asn))
+        named["{}ROUTE_NO_ANNOUNCE_ANY_LOCATION".format(prefix)] = ("{}:{}".format(asn, marker), "{}:400:0".format(asn))
+        for action, name in zip(PEER_ACTIONS, ["NO_ANNOUNCE", "ANNOUNCE", "PREPENDx1", "PREPENDx2", "PREPENDx3"]):
+            named["{}ROUTE_{}_AS{}".format(prefix, name, peer)] = ("{}:{}".format(asn, marker),
+                                                                  "{}:{}:{}".format(asn, action, peer))
+        for action, name in zip(LOCATION_ACTIONS, ["NO_ANNOUNCE", "PREPENDx1", "PREPENDx2", "PREPENDx3"]):
+            named["{}ROUTE_{}_{}".format(prefix, name, p["location"])] = ("{}:{}".format(asn, marker),
+                                                                         "{}:{}:{}".format(asn, action, loc))
+    return named
+
+
+def build_out_policy(p, settings, used_actions=None, optimized=False):
+    """
+    Build the terms of an out policy, following gen_junos_ebgp_out_policy
+
+    Args:
+      p (dictionary): the policy record (name, family, peer_asn, relationship, location)
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      used_actions (set of strings): the used actions when pruning, None otherwise
+      optimized (boolean): build the optimize_out_policies layout
+
+    Returns:
+      terms (list of dictionaries): the policy terms
+
+    Raises:
+      None
+    """
+
+    asn = settings["local_asn"]
+    loc = settings["geolocations"].get(p["location"])
+    peer = p["peer_asn"]
+    large_any = "AS{}_LARGE_ANY".format(asn)
+    rtbh_local = "RTBH-AS{}".format(asn)
+
+    def used(key):
+        return used_actions is None or key in used_actions
+
+    def accept_then(prepend=0):
+        then = []
+        if prepend:
+            then.append(("prepend", prepend))
+        if optimized:
+            then.append(("delete", "RT_ANY"))
+        then.append(("delete", large_any))
+        return then
+
+    # the subroutine used as safety net
+    if optimized:
+        invalid = [_term("OUR_TAGGED_AS_RANGES", ranges=True, from_communities=[large_any, rtbh_local],
+                         action="reject"),
+                   _term("OUR_CUSTOMERS", customer_path=True, action="reject"),
+                   _term("rest", action="accept")]
+    else:
+        invalid = [_term("OUR_AS_RANGES", ranges=True, action="reject"),
+                   _term("OUR_CUSTOMERS", customer_path=True, action="reject"),
+                   _term("rest", action="accept")]
+    terms = [_term("PREVENT_INVALID_ANNOUNCEMENTS", from_policy=invalid, action="reject")]
+    if not optimized:
+        terms.append(_term("CLEAN_RT", then=[("delete", "RT_ANY")], action="next"))
+    if p["relationship"] == "transit-provider":
+        terms.append(_term("RTBH", from_communities=[rtbh_local],
+                           then=[("set", "RTBH-AS{}".format(peer))], action="accept"))
+    no_announce_peer = []
+    if used("40:0"):
+        no_announce_peer += ["ROUTE_NO_ANNOUNCE_ANY_PEER", "CUSTOMER_ROUTE_NO_ANNOUNCE_ANY_PEER"]
+    if used("40:{}".format(peer)):
+        no_announce_peer += ["ROUTE_NO_ANNOUNCE_AS{}".format(peer), "CUSTOMER_ROUTE_NO_ANNOUNCE_AS{}".format(peer)]
+    if no_announce_peer:
+        terms.append(_term("ROUTE_DO_NOT_ANNOUNCE_PEER", from_communities=no_announce_peer, action="reject"))
+    if used("41:{}".format(peer)):
+        terms.append(_term("ROUTE_ANNOUNCE_PEER",
+                           from_communities=["ROUTE_ANNOUNCE_AS{}".format(peer), "CUSTOMER_ROUTE_ANNOUNCE_AS{}".format(peer)],
+                           then=accept_then(), action="accept"))
+    for n in [1, 2, 3]:
+        if used("6{}:{}".format(n, peer)):
+            terms.append(_term("ROUTE_PREPENDx{}_PEER".format(n),
+                               from_communities=["ROUTE_PREPENDx{}_AS{}".format(n, peer),
+                                                 "CUSTOMER_ROUTE_PREPENDx{}_AS{}".format(n, peer)],
+                               then=accept_then(n), action="accept"))
+    no_announce_location = []
+    if used("400:0"):
+        no_announce_location += ["ROUTE_NO_ANNOUNCE_ANY_LOCATION", "CUSTOMER_ROUTE_NO_ANNOUNCE_ANY_LOCATION"]
+    if used("400:{}".format(loc)):
+        no_announce_location += ["ROUTE_NO_ANNOUNCE_{}".format(p["location"]),
+                                 "CUSTOMER_ROUTE_NO_ANNOUNCE_{}".format(p["location"])]
+    if no_announce_location:
+        terms.append(_term("ROUTE_DO_NOT_ANNOUNCE_LOCATION", from_communities=no_announce_location, action="reject"))
+    for n in [1, 2, 3]:
+        if used("60{}:{}".format(n, loc)):
+            terms.append(_term("ROUTE_PREPENDx{}_LOCATION".format(n),
+                               from_communities=["ROUTE_PREPENDx{}_{}".format(n, p["location"]),
+                                                 "CUSTOMER_ROUTE_PREPENDx{}_{}".format(n, p["location"])],
+                               then=accept_then(n), action="accept"))
+    terms.append(_term("ROUTE_ANNOUNCE", from_communities=["ROUTE_ANNOUNCEMENT", "CUSTOMER_ROUTE_ANNOUNCEMENT"],
+                       then=accept_then(), action="accept"))
+    terms.append(_term("LEGACY_ANNOUNCEMENT_CUSTOMER", customer_path=True, then=accept_then(), action="accept"))
+    terms.append(_term("DEFAULT", action="reject"))
+    return terms
+
+
+def evaluate(route, terms, named):
+    """
+    Evaluate a route against the terms of a policy
+
+    Args:
+      route (dictionary): 'in_ranges' (boolean), 'customer_path' (boolean) and
+                          'communities' (frozenset of strings)
+      terms (list of dictionaries): the policy terms (see build_out_policy)
+      named (dictionary): the named communities (see build_named_communities)
+
+    Returns:
+      (outcome, prepend, communities, evaluations, term) tuple. outcome is
+      "accept" or "reject", evaluations counts the terms (subroutine terms
+      included) evaluated and term is the name of the terminating term
+
+    Raises:
+      None
+    """
+
+    communities = route["communities"]
+    prepend = 0
+    evaluations = 0
+    for t in terms:
+        evaluations += 1
+        if t["ranges"] is not None and route["in_ranges"] != t["ranges"]:
+            continue
+        if t["customer_path"] is not None and route["customer_path"] != t["customer_path"]:
+            continue
+        if t["from_communities"] is not None and \
+           not any([community_match(communities, named[c]) for c in t["from_communities"]]):
+            continue
+        if t["from_policy"] is not None:
+            outcome, _, _, sub_evaluations, _ = evaluate(route, t["from_policy"], named)
+            evaluations += sub_evaluations
+            if outcome != "accept":
+                continue
+        for op, arg in t["then"]:
+            if op == "prepend":
+                prepend += arg
+            elif op == "delete":
+                communities = frozenset([c for c in communities if not community_match(frozenset([c]), named[arg])])
+            elif op == "set":
+                communities = frozenset(named[arg])
+        if t["action"] != "next":
+            return (t["action"], prepend if t["action"] == "accept" else 0,
+                    communities if t["action"] == "accept" else frozenset(), evaluations, t["name"])
+    return ("reject", 0, frozenset(), evaluations, None)
+
+
+def verify_policy(p, settings, used_actions, logger):
+    """
+    Prove that the optimized layout of an out policy keeps the outcomes of
+    the standard layout, by exhaustive enumeration of the route classes the
+    terms can tell apart.
+
+    Args:
+      p (dictionary): the policy record
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      used_actions (set of strings): the used actions when pruning, None otherwise
+      logger: a logger object for the program
+
+    Returns:
+      (classes, mismatches) tuple of ints
+
+    Raises:
+      None
+    """
+
+    asn = settings["local_asn"]
+    loc = settings["geolocations"].get(p["location"])
+    named = build_named_communities(p, settings)
+    standard = build_out_policy(p, settings, used_actions, optimized=False)
+    optimized = build_out_policy(p, settings, used_actions, optimized=True)
+    markers = ["{}:3:1999".format(asn), "{}:3:200".format(asn)]
+    actions = ["{}:40:0".format(asn), "{}:400:0".format(asn)] + \
+              ["{}:{}:{}".format(asn, a, p["peer_asn"]) for a in PEER_ACTIONS] + \
+              ["{}:{}:{}".format(asn, a, loc) for a in LOCATION_ACTIONS]
+    # communities no term of this policy looks for, apart from the wildcards
+    others = ["{}:61:0".format(asn), "{}:666".format(asn), "target:{}:1".format(asn)]
+    classes = 0
+    mismatches = 0
+    flags = list(product([False, True], repeat=2))
+    for bits in product([False, True], repeat=len(markers) + len(actions) + len(others)):
+        communities = frozenset([c for c, b in zip(markers + actions + others, bits) if b])
+        for in_ranges, customer_path in flags:
+            route = {"in_ranges": in_ranges, "customer_path": customer_path, "communities": communities}
+            r1 = evaluate(route, standard, named)
+            r2 = evaluate(route, optimized, named)
+            classes += 1
+            if r1[:3] != r2[:3]:
+                mismatches += 1
+                logger.error("{}: route {} standard {} optimized {}".format(p["name"], route, r1, r2))
+    return (classes, mismatches)
+
+
+def synthetic_table(settings, announcements, internet, customers, untagged, seed):
+    """
+    Build a synthetic full table as seen by the out policies of the NET VRF
+
+    Args:
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      announcements (list of dictionaries): the bgp | announcements pillar
+      internet (int): number of Internet routes received from transits
+      customers (int): number of transit customer routes
+      untagged (int): number of untagged routes of our ranges (infrastructure,
+                      customer statics)
+      seed (int): random seed
+
+    Returns:
+      list of (class name, route) tuples
+
+    Raises:
+      None
+    """
+
+    rnd = random.Random(seed)
+    asn = settings["local_asn"]
+    # third party communities seen on Internet routes
+    foreign = ["{}:{}".format(rnd.randint(1, 64000), rnd.randint(1, 1000)) for i in range(64)]
+    table = []
+    for i in range(internet):
+        c = frozenset(rnd.sample(foreign, rnd.randint(0, 3)))
+        table.append(("internet", {"in_ranges": False, "customer_path": False, "communities": c}))
+    customer_sets = [frozenset(), frozenset(["{}:3:200".format(asn)])] + \
+                    [frozenset(["{}:3:200".format(asn), "{}:61:{}".format(asn, a)])
+                     for a in settings["transit_customers_asns"]]
+    for i in range(customers):
+        table.append(("customer", {"in_ranges": False, "customer_path": True,
+                                   "communities": rnd.choice(customer_sets)}))
+    for a in announcements:
+        table.append(("announcement", {"in_ranges": True, "customer_path": False,
+                                       "communities": frozenset(a["communities"])}))
+    for i in range(untagged):
+        c = frozenset(["target:{}:{}".format(asn, rnd.randint(1, 10))])
+        table.append(("untagged", {"in_ranges": True, "customer_path": False, "communities": c}))
+    return table
+
+
+def bench_policy(p, settings, used_actions, table):
+    """
+    Count the term evaluations of both layouts of an out policy over a table
+
+    Args:
+      p (dictionary): the policy record
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      used_actions (set of strings): the used actions when pruning, None otherwise
+      table (list of (class, route) tuples): see synthetic_table()
+
+    Returns:
+      report (dictionary): per class route counts and evaluations of both layouts
+
+    Raises:
+      None
+    """
+
+    named = build_named_communities(p, settings)
+    layouts = {"standard": build_out_policy(p, settings, used_actions, optimized=False),
+               "optimized": build_out_policy(p, settings, used_actions, optimized=True)}
+    # routes with the same attributes evaluate the same way
+    memo = {}
+    report = {"policy": p["name"], "routes": len(table), "mismatches": 0, "classes": {}}
+    for cls, route in table:
+        key = (route["in_ranges"], route["customer_path"], route["communities"])
+        if key not in memo:
+            memo[key] = {l: evaluate(route, t, named) for l, t in layouts.items()}
+        res = memo[key]
+        if res["standard"][:3] != res["optimized"][:3]:
+            report["mismatches"] += 1
+        c = report["classes"].setdefault(cls, {"routes": 0, "standard": 0, "optimized": 0})
+        c["routes"] += 1
+        for l in layouts:
+            c[l] += res[l][3]
+    for l in layouts:
+        report[l] = sum([c[l] for c in report["classes"].values()])
+    return report
+
+
+def get_policies(pillar, location):
+    """
+    Get the out policy records of a router from its peering pillar, as
+    gen_junos_ebgp_groups builds them
+
+    Args:
+      pillar (dictionary): the pillar of the router (peering-manager extpillar)
+      location (string): the location of the router
+
+    Returns:
+      list of policy records
+
+    Raises:
+      None
+    """
+
+    policies = []
+    for key in ["direct-peerings", "internet-exchange-peerings"]:
+        for pg in pillar.get("bgp", {}).get(key, []):
+            for s in pg["peerings"]:
+                if s["export_policy"]:
+                    policies.append({"name": s["export_policy"], "family": s["family"],
+                                     "peer_asn": s["peer_asn"], "relationship": s["relationship"],
+                                     "location": location})
+    return policies
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Verify and benchmark the optimized eBGP out policies")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-f", "--config", default=DEFAULT_CONFIG,
+                        help="The config.j2 of the ebgp-peerings state")
+    parser.add_argument("-p", "--pillar", type=argparse.FileType('r'),
+                        help="Pillar json of a router (peerings, announcements and location). \
+                        Without it one transit and one peering policy are built")
+    parser.add_argument("-j", "--json", help="Print the results as json", action="store_true")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    subparsers.add_parser("verify", help="Prove the optimized policies keep the outcomes")
+    bench_parser = subparsers.add_parser("bench", help="Count term evaluations on a synthetic full table")
+    bench_parser.add_argument("--internet", type=int, default=950000, help="Internet routes")
+    bench_parser.add_argument("--customers", type=int, default=1000, help="Transit customer routes")
+    bench_parser.add_argument("--untagged", type=int, default=20000, help="Untagged routes of our ranges")
+    bench_parser.add_argument("--seed", type=int, default=1, help="Random seed")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        settings = load_template_settings(args.config)
+        pillar = {}
+        if args.pillar:
+            pillar = json.load(args.pillar)
+        location = (pillar.get("location") or list(settings["geolocations"])[0]).upper()
+        announcements = pillar.get("bgp", {}).get("announcements", [])
+        used_actions = None
+        if settings.get("prune_unused_policy_actions"):
+            used_actions = get_used_actions(announcements, settings["local_asn"])
+        policies = get_policies(pillar, location)
+        if not policies:
+            policies = [{"name": "TRANSIT-V4-OUT", "family": "inet", "peer_asn": 65100,
+                         "relationship": "transit-provider", "location": location},
+                        {"name": "PEER-V4-OUT", "family": "inet", "peer_asn": 65200,
+                         "relationship": "ix-peering", "location": location}]
+        # the policy structure only depends on whether the peer is a transit
+        # provider (RTBH term), the family, peer ASN and location just rename
+        # the subroutine and the communities
+        checked = {}
+        for p in policies:
+            checked.setdefault(p["relationship"] == "transit-provider", p)
+        results = []
+        if args.command == "verify":
+            for p in checked.values():
+                classes, mismatches = verify_policy(p, settings, used_actions, logger)
+                results.append({"policy": p["name"], "classes": classes, "mismatches": mismatches})
+                if mismatches:
+                    err_code = 1
+            if args.json:
+                print(json.dumps(results))
+            else:
+                for r in results:
+                    print("{}: {} route classes, {} mismatches".format(r["policy"], r["classes"], r["mismatches"]))
+        else:
+            table = synthetic_table(settings, announcements, args.internet, args.customers,
+                                    args.untagged, args.seed)
+            for p in checked.values():
+                r = bench_policy(p, settings, used_actions, table)
+                results.append(r)
+                if r["mismatches"]:
+                    err_code = 1
+            if args.json:
+                print(json.dumps(results))
+            else:
+                for r in results:
+                    print("{}: {} routes, {} mismatches".format(r["policy"], r["routes"], r["mismatches"]))
+                    print("  {:14s} {:>9s} {:>14s} {:>14s}".format("class", "routes", "standard/route", "optimized/route"))
+                    for cls, c in sorted(r["classes"].items()):
+                        print("  {:14s} {:9d} {:14.2f} {:14.2f}".format(cls, c["routes"], c["standard"] / c["routes"],
+                                                                        c["optimized"] / c["routes"]))
+                    print("  {:14s} {:9d} {:14d} {:14d}".format("total evals", r["routes"], r["standard"], r["optimized"]))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
@@ -19,10 +19,41 @@ via environment variables to connect to the REST API of netbox and search for
 the relevant bgp announcement community.
 Prints in stdout a json serialized dictionary structure containing the BGP
 announcements information for a minion.
+
+With --impactindex, the announcement prefixes and aggregates are also
+recorded, by netbox id, in the change impact index of the bgp-te-tool
+states (see salt/states/_utils/impact_index.py).
+
+With --techeck, the TE action communities of the announcements are checked
+(see check_actions in salt/states/_utils/announcement_te.py): contradictory,
+shadowed or invalid actions and actions towards peer ASNs / location codes
+unknown to peering-manager / the geolocations of the ebgp-peerings config.j2
+are logged as warnings. With --strict they also fail the pillar: the
+findings are returned in the _errors key of the pillar, Salt refuses to run
+states with it. The peer ASNs are checked if PEERING_MANAGER_API_BASE_URL
+and PEERING_MANAGER_API_TOKEN are in the environment; they are cached for
+the pillar runs of all the minions (--asncache), and the findings are only
+logged when they change (--techeckstate).
+
+With --vrps, every announcement is validated against our allocations and the
+VRPs of a local RPKI relying party export (rpki-client / routinator json),
+see salt/states/_utils/prefix_trie.py. Invalid announcements are logged as
+warnings, removed from the pillar with --block-invalid (they are not
+rendered) and fail the pillar with --strict.
+
+With --aggregate, the pillar gets the minimized announcements of
+prefix_trie.minimize: duplicates and more-specifics covered by a
+less-specific announcement with the same attributes are dropped and
+sibling prefixes with the same attributes are merged, so the routers get
+fewer routes for the same announcements (prefix_trie.py prints the report).
+A merged or covering prefix must be in our allocations and, with --vrps,
+validate no worse than the prefixes it replaces. The netbox prefixes of a
+merge are not routes of the routers: bgpte.te skips them (not announced),
+the TE change is rendered by the next apply of the bgp-announcements state.
 """
 
 __author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
-__version__ = "1.1"
+__version__ = "1.6"
 
 from os.path import basename
 from logging.handlers import SysLogHandler
@@ -32,10 +63,30 @@ import datetime
 import sys
 import os
 import json
+import hashlib
 import requests
 import re
 from urllib3.exceptions import InsecureRequestWarning
 
+#----------------- Global settings -------------------
+# Salt states directory (as salt_templates.STATES_DIR). salt_templates and
+# export_policy (and jinja2 with them) are only imported by the options
+# that need them, the pillar itself only needs requests
+STATES_DIR = "/srv/salt/states"
+# Change impact index module, relative to the Salt states directory
+IMPACT_INDEX_MODULE = "_utils/impact_index.py"
+# TE module, relative to the Salt states directory
+ANNOUNCEMENT_TE_MODULE = "_utils/announcement_te.py"
+# Prefix trie module, relative to the Salt states directory
+PREFIX_TRIE_MODULE = "_utils/prefix_trie.py"
+# Cache of the VRPs of --vrps
+VRP_CACHE = "/var/cache/salt/master/bgpte/vrps.pickle"
+# Cache of the peering-manager peer ASNs of --techeck
+PEER_ASN_CACHE = "/var/cache/salt/master/bgpte/peer_asns.json"
+# Digest of the last logged --techeck findings
+TE_CHECK_STATE = "/var/cache/salt/master/bgpte/te_check.json"
+#----------------- Global settings -------------------
+
 def isBGPcommunity(s):
     """
     Get a string and check if it is a valid BGP community
@@ -92,7 +143,8 @@ def slugify(s, num_chars):
     return (st.lower()[:num_chars])
 
 
-def get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, logger, sslverify=True):
+def get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, logger, sslverify=True,
+                          objects=None):
     """
     Gets the BGP announcement prefixes in NETBOX
 
@@ -111,6 +163,11 @@ def get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, l
                                   (eg: 65000:3:1999)
       logger: a logger object for the program
       sslverify (boolean): whether to check the server cert
+      objects (dictionary): if given, the netbox key ("aggregate:<id>" or
+                            "prefix:<id>") and tags of every announcement
+                            are stored in it, for the change impact index.
+                            It gets an 'error' key if the announcements
+                            could not be fetched
 
     Returns:
       announcements (dictionary): a dictionary containing the
@@ -170,6 +227,8 @@ def get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, l
                    else:
                        p_i["next-hop"] = "discard"
                 announcements["bgp"]["announcements"].append(p_i)
+                if objects is not None:
+                    objects["aggregate:{}".format(p["id"])] = (p["prefix"], p["tags"])
         # Now we get any prefixes matching the announcement community
         logger.debug("Getting BGP announcements in netbox prefixes")
         r = requests.get(api_prefixes_url, headers=headers, params=params, verify=sslverify)
@@ -208,12 +267,127 @@ def get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, l
                     else:
                        p_i["next-hop"] = "discard"
                 announcements["bgp"]["announcements"].append(p_i)
+                if objects is not None:
+                    objects["prefix:{}".format(p["id"])] = (p["prefix"], p["tags"])
     except:
         logger.exception("get_bgp_announcements()")
+        if objects is not None:
+            objects["error"] = True
     logger.debug("announcements: {}".format(announcements))
     return announcements
 
 
+def findings_changed(findings, state):
+    """
+    Check if findings differ from the ones of the last run, recorded (as a
+    digest) in a state file. Every minion's pillar run gets the same
+    findings, they are logged once.
+
+    Args:
+      findings (list): json serializable findings
+      state (string): the state file, None to always log
+
+    Returns:
+      boolean
+    """
+
+    if not state:
+        return True
+    digest = hashlib.sha256(json.dumps(findings, sort_keys=True).encode("utf-8")).hexdigest()
+    try:
+        with open(state) as f:
+            if json.load(f).get("digest") == digest:
+                return False
+    except (IOError, OSError, ValueError):
+        pass
+    if os.path.dirname(state):
+        os.makedirs(os.path.dirname(state), exist_ok=True)
+    tmp = "{}.{}.tmp".format(state, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump({"digest": digest, "findings": len(findings)}, f)
+    os.replace(tmp, state)
+    return True
+
+
+def check_te_actions(announcements, settings, states, logger, sslverify=True, asn_cache=None, state=None):
+    """
+    Check the TE action communities of the BGP announcements
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      states (string): the Salt states directory
+      logger: a logger object for the program
+      sslverify (boolean): whether to check the peering-manager server cert
+      asn_cache (string): the cache file of the peer ASNs
+      state (string): the state file of the logged findings (see
+                      findings_changed)
+
+    Returns:
+      findings (list of dictionaries): see announcement_te.check_actions
+
+    Raises:
+      announcement_te.NetboxError on peering-manager failures
+    """
+
+    import salt_templates
+    te = salt_templates.load_states_module(states, ANNOUNCEMENT_TE_MODULE)
+    local_asn = settings["local_asn"]
+    peer_asns = None
+    pm_api_base_url = os.environ.get("PEERING_MANAGER_API_BASE_URL", None)
+    pm_api_token = os.environ.get("PEERING_MANAGER_API_TOKEN", None)
+    if (pm_api_base_url is None) or (pm_api_token is None):
+        logger.warning("Missing PEERING_MANAGER_API_BASE_URL or PEERING_MANAGER_API_TOKEN, peer ASNs not checked")
+    else:
+        if not pm_api_base_url.endswith("/"):
+            pm_api_base_url = "{0}/".format(pm_api_base_url)
+        peer_asns = set(te.peer_asns(pm_api_base_url, pm_api_token, sslverify, asn_cache))
+    location_codes = set(settings.get("geolocations", {}).values())
+    findings = te.check_actions(announcements, local_asn, peer_asns, location_codes)
+    if findings_changed(findings, state):
+        for f in findings:
+            logger.warning("TE check: {prefix}: {kind}: {description}".format(**f))
+    else:
+        logger.info("TE check: {} findings, unchanged".format(len(findings)))
+    return findings
+
+
+def validate_announcements(announcements, settings, states, vrps, vrp_cache, logger):
+    """
+    Validate the BGP announcements against our allocations and the RPKI VRPs
+
+    Args:
+      announcements (list of dictionaries): the bgp | announcements pillar
+      settings (dictionary): the ebgp-peerings config.j2 settings
+      states (string): the Salt states directory
+      vrps (string): the VRP json export of the relying party
+      vrp_cache (string): the VRP cache file
+      logger: a logger object for the program
+
+    Returns:
+      results (list of dictionaries): see prefix_trie.validate
+
+    Raises:
+      IOError, ValueError on unreadable VRPs or invalid prefixes
+    """
+
+    import salt_templates
+    pt = salt_templates.load_states_module(states, PREFIX_TRIE_MODULE)
+    t0 = datetime.datetime.now()
+    allocations = pt.allocation_tries(settings["v4_allocations"], settings["v6_allocations"])
+    vrp_tries = pt.load_vrps(vrps, vrp_cache)
+    results = pt.validate(announcements, vrp_tries, settings["local_asn"], allocations)
+    counts = {state: 0 for state in pt.RPKI_STATES}
+    for r in results:
+        counts[r["state"]] += 1
+        if r["state"] == "invalid":
+            logger.warning("RPKI: {prefix}: invalid: {reason}".format(**r))
+    logger.info("RPKI: {} VRPs, {} valid, {} invalid, {} not-found in {}".format(
+        sum([len(t) for t in vrp_tries.values()]), counts["valid"], counts["invalid"], counts["not-found"],
+        datetime.datetime.now() - t0))
+    return results
+
+
 # Main function
 if __name__ == '__main__':
 
@@ -228,6 +402,27 @@ if __name__ == '__main__':
                         this level of severity")
     parser.add_argument("-s", "--sslnoverify", help="Skip verification of netbox server \
                         certificates (eg use of self signed certs)", action="store_true")
+    parser.add_argument("-i", "--impactindex", help="Record the announcement prefixes in this \
+                        change impact index directory")
+    parser.add_argument("-d", "--states", default=STATES_DIR,
+                        help="The Salt states directory (default: %(default)s)")
+    parser.add_argument("-t", "--techeck", help="Check the TE action communities of the \
+                        announcements and log the findings", action="store_true")
+    parser.add_argument("--asncache", default=PEER_ASN_CACHE, help="The cache of the peer ASNs \
+                        of --techeck (default: %(default)s)")
+    parser.add_argument("--techeckstate", default=TE_CHECK_STATE, help="The digest of the last \
+                        logged --techeck findings (default: %(default)s)")
+    parser.add_argument("-r", "--vrps", help="Validate the announcements against our allocations \
+                        and this RPKI VRP json export (rpki-client / routinator)")
+    parser.add_argument("--vrpcache", default=VRP_CACHE, help="The cache of the VRPs \
+                        (default: %(default)s)")
+    parser.add_argument("-B", "--block-invalid", help="Remove the invalid announcements of --vrps \
+                        from the pillar", action="store_true")
+    parser.add_argument("-A", "--aggregate", help="Minimize the announcements of the pillar \
+                        (merge siblings and covered more-specifics with the same attributes)",
+                        action="store_true")
+    parser.add_argument("--strict", help="Fail the pillar (_errors key) on TE check findings \
+                        (implies --techeck) and invalid announcements", action="store_true")
 
     args = parser.parse_args()
 
@@ -267,7 +462,69 @@ if __name__ == '__main__':
             logger.debug("NETBOX_API_BASE_URL: {}".format(api_base_url))
             logger.debug("NETBOX_API_TOKEN: {}".format(api_token))
             logger.debug("BGP_ANNOUNCEMENT_COMMUNITY: {}".format(bgp_announcement_community))
-            extpillar_data = get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, logger, sslverify)
+            objects = {} if args.impactindex else None
+            extpillar_data = get_bgp_announcements(api_base_url, api_token, bgp_announcement_community, logger,
+                                                   sslverify, objects)
+            # a failed fetch returns partial data, it is not recorded
+            if args.impactindex and "error" not in objects:
+                try:
+                    import salt_templates
+                    impact_index = salt_templates.load_states_module(args.states, IMPACT_INDEX_MODULE)
+                    prefixes = {k: impact_index.prefix_record(prefix, tags) for k, (prefix, tags) in objects.items()}
+                    if impact_index.update_prefixes(args.impactindex, prefixes, bgp_announcement_community):
+                        logger.info("Impact index prefixes updated")
+                except Exception:
+                    logger.exception("impact index")
+            errors = []
+            settings = None
+            if (args.vrps or args.techeck or args.strict or args.aggregate) and "announcements" in extpillar_data["bgp"]:
+                try:
+                    import export_policy
+                    settings = export_policy.load_template_settings(
+                        os.path.join(args.states, "ebgp-peerings", "templates", "config.j2"))
+                except Exception:
+                    logger.exception("ebgp-peerings settings")
+                    errors.append("bgp-te: the checks failed, no ebgp-peerings settings")
+            if args.vrps and settings:
+                try:
+                    results = validate_announcements(extpillar_data["bgp"]["announcements"], settings,
+                                                     args.states, args.vrps, args.vrpcache, logger)
+                    invalid = [r for r in results if r["state"] == "invalid"]
+                    errors += ["rpki: {prefix}: {reason}".format(**r) for r in invalid]
+                    if invalid and args.block_invalid:
+                        blocked = set([r["prefix"] for r in invalid])
+                        extpillar_data["bgp"]["announcements"] = [a for a in extpillar_data["bgp"]["announcements"]
+                                                                  if a["prefix"] not in blocked]
+                        logger.warning("RPKI: {} invalid announcements removed".format(len(blocked)))
+                except Exception:
+                    logger.exception("RPKI validation")
+                    errors.append("rpki: validation failed")
+            if (args.techeck or args.strict) and settings:
+                try:
+                    findings = check_te_actions(extpillar_data["bgp"]["announcements"], settings, args.states,
+                                                logger, sslverify, args.asncache, args.techeckstate)
+                    errors += ["bgp-te: {prefix}: {description}".format(**f) for f in findings]
+                except Exception:
+                    logger.exception("TE check")
+                    errors.append("bgp-te: TE check failed")
+            if args.aggregate and settings and extpillar_data["bgp"].get("announcements"):
+                try:
+                    import salt_templates
+                    pt = salt_templates.load_states_module(args.states, PREFIX_TRIE_MODULE)
+                    allocations = pt.allocation_tries(settings["v4_allocations"], settings["v6_allocations"])
+                    # the VRPs are loaded from the cache of validate_announcements
+                    vrp_tries = pt.load_vrps(args.vrps, args.vrpcache) if args.vrps else None
+                    minimized, report = pt.minimize(extpillar_data["bgp"]["announcements"], vrp_tries,
+                                                    settings["local_asn"], allocations)
+                    extpillar_data["bgp"]["announcements"] = minimized
+                    logger.info("Aggregation: {} announcements, {} minimized ({} merged, {} covered, {} duplicate, {} kept)".format(
+                        report["announcements"], report["minimized"], len(report["merged"]),
+                        len(report["covered"]), len(report["duplicate"]), len(report["kept"])))
+                except Exception:
+                    logger.exception("aggregation")
+            if errors and args.strict:
+                extpillar_data["_errors"] = errors
+                err_code = 1
         print(json.dumps(extpillar_data))
         delta_t = datetime.datetime.now() - t0
         logger.info("Execution time: {0}".format(delta_t))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""
+Program that applies a traffic engineering (TE) action to many BGP
+announcements in netbox at once, eg
+
+  netbox_te.py prepend -x 2 --location FR -t FR      (prepend x2 at location FR
+                                                      for all prefixes tagged FR)
+  netbox_te.py no-announce --peer 65202              (stop announcing to AS65202)
+  netbox_te.py clear --peer 65202 -w 192.0.2.0/23    (remove the AS65202 actions
+                                                      of the prefixes in 192.0.2.0/23)
+
+The announcements (the aggregates and prefixes tagged with the announcement
+community) are fetched once, the new community tags of the selected ones
+are computed locally, the missing community tags are created and the
+changed objects are written with the bulk update endpoints of netbox
+(a PATCH of the list endpoint with a list of objects, --batch objects per
+request), instead of one request per prefix. The affected prefixes and the
+time taken are reported.
+
+The action communities are those of the out policies of the ebgp-peerings
+state (see salt/states/_utils/announcement_te.py): an action sets the
+behaviour towards a peer ASN or a location and replaces the other actions
+towards it. local_asn and the location codes (geolocations) come from the
+ebgp-peerings config.j2.
+
+Expects
+
+NETBOX_API_BASE_URL
+NETBOX_API_TOKEN
+BGP_ANNOUNCEMENT_COMMUNITY
+
+via environment variables, as netbox_extpillar.py. The changes are
+picked by the next pillar refresh / apply of the bgp-announcements state.
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import os
+import json
+import requests
+from urllib3.exceptions import InsecureRequestWarning
+import salt_templates
+import export_policy
+
+#----------------- Global settings -------------------
+# TE module, relative to the Salt states directory
+ANNOUNCEMENT_TE_MODULE = "_utils/announcement_te.py"
+ACTIONS = ["no-announce", "announce", "prepend", "clear"]
+#----------------- Global settings -------------------
+
+def get_target(args, settings):
+    """
+    Get the target of the action from the command line
+
+    Args:
+      args (argparse.Namespace): the command line arguments
+      settings (dictionary): the ebgp-peerings config.j2 settings
+
+    Returns:
+      (kind, target) tuple: kind is peer or location, target the peer ASN
+      or the location code (0: any)
+
+    Raises:
+      ValueError for unknown locations or invalid ASNs
+    """
+
+    if args.peer is not None:
+        if args.peer == "any":
+            return ("peer", 0)
+        try:
+            return ("peer", int(args.peer.upper().replace("AS", "", 1)))
+        except ValueError:
+            raise ValueError("{} is not an AS number".format(args.peer))
+    if args.location == "any":
+        return ("location", 0)
+    geolocations = settings.get("geolocations", {})
+    if args.location not in geolocations:
+        raise ValueError("unknown location {} (known: {})".format(args.location,
+                                                                 ", ".join(sorted(geolocations))))
+    return ("location", geolocations[args.location])
+
+
+def run(te, api, objects, action, kind, target, local_asn, select, dry_run, logger, batch):
+    """
+    Plan a TE action on the announcements of a snapshot and write it in netbox
+
+    Args:
+      te (module): the announcement_te module
+      api (announcement_te.Netbox): the netbox client (None with dry_run)
+      objects (list): the snapshot of the announcements
+      action (string): an announcement_te.TE_ACTIONS action or clear
+      kind (string): peer or location
+      target (int): the peer ASN or location code
+      local_asn (int): our AS number
+      select (dictionary): the selection arguments of announcement_te.select
+      dry_run (boolean): only plan the changes
+      logger (logging.Logger): the logger
+      batch (int): objects per bulk update request
+
+    Returns:
+      dictionary: the changes, the tags created, the number of requests and
+      the seconds of every phase
+    """
+
+    t0 = datetime.datetime.now()
+    selected = te.select(objects, **select)
+    changes = te.plan_action(selected, local_asn, action, kind, target)
+    t1 = datetime.datetime.now()
+    logger.info("{} of {} announcements selected, {} to change".format(len(selected), len(objects),
+                                                                       len(changes)))
+    report = {"selected": len(selected), "changes": changes, "tags_created": [], "requests": 0,
+              "seconds": {"plan": (t1 - t0).total_seconds()}}
+    if dry_run or not changes:
+        return report
+    added = set()
+    for c in changes:
+        added.update(c["added"])
+    report["tags_created"] = api.ensure_tags(added) if added else []
+    t2 = datetime.datetime.now()
+    for kind_ in sorted(te.NETBOX_ENDPOINTS):
+        updates = [{"id": c["id"], "tags": c["tags"]} for c in changes if c["kind"] == kind_]
+        if updates:
+            report["requests"] += api.bulk_update(kind_, updates, batch)
+    t3 = datetime.datetime.now()
+    report["seconds"].update({"tags": (t2 - t1).total_seconds(), "update": (t3 - t2).total_seconds()})
+    return report
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Apply a TE action to BGP announcements in netbox")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-s", "--sslnoverify", help="Skip verification of netbox server \
+                        certificates (eg use of self signed certs)", action="store_true")
+    parser.add_argument("-d", "--states", default=salt_templates.STATES_DIR,
+                        help="The Salt states directory (default: %(default)s)")
+    parser.add_argument("action", choices=ACTIONS, help="The TE action (clear removes the actions \
+                        towards the target)")
+    parser.add_argument("-x", "--times", type=int, choices=[1, 2, 3], default=1,
+                        help="Number of prepends of the prepend action (default: %(default)s)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--peer", help="The peer ASN of the action (any: all peers)")
+    target.add_argument("--location", help="The location of the action, a geolocations key of \
+                        the ebgp-peerings config.j2 (any: all locations)")
+    parser.add_argument("-t", "--tag", action="append", help="Select the announcements with this \
+                        tag (repeat: all tags)")
+    parser.add_argument("-p", "--prefix", action="append", help="Select this announcement (repeat)")
+    parser.add_argument("-w", "--within", action="append", help="Select the announcements in this \
+                        prefix (repeat)")
+    parser.add_argument("-4", dest="family", action="store_const", const="IPv4",
+                        help="Select the IPv4 announcements")
+    parser.add_argument("-6", dest="family", action="store_const", const="IPv6",
+                        help="Select the IPv6 announcements")
+    parser.add_argument("-a", "--all", action="store_true", help="Allow an action on all the \
+                        announcements (no selection)")
+    parser.add_argument("-f", "--snapshot", help="Plan against the announcements of this json file \
+                        instead of netbox (implies --dry-run)")
+    parser.add_argument("-o", "--save", help="Save the announcements fetched from netbox in this \
+                        json file")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Report the changes without \
+                        writing them")
+    parser.add_argument("-b", "--batch", type=int, default=None, help="Objects per bulk update \
+                        request (default: announcement_te.BULK_BATCH)")
+    parser.add_argument("-j", "--json", action="store_true", help="Print the report as json")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    sslverify = True
+    if args.sslnoverify:
+        sslverify = False
+    # Suppress only the single warning from urllib3 needed.
+    requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        select = {"tags": args.tag, "prefixes": args.prefix, "within": args.within, "family": args.family}
+        if not any(select.values()) and not args.all:
+            parser.error("select announcements (--tag, --prefix, --within, -4, -6) or use --all")
+        action = "prepend{}".format(args.times) if args.action == "prepend" else args.action
+        te = salt_templates.load_states_module(args.states, ANNOUNCEMENT_TE_MODULE)
+        settings = export_policy.load_template_settings(
+            os.path.join(args.states, "ebgp-peerings", "templates", "config.j2"))
+        kind, target = get_target(args, settings)
+        if action != "clear":
+            # fail early on actions the out policy does not have
+            te.action_community(settings["local_asn"], action, kind, target)
+        api = None
+        if args.snapshot:
+            with open(args.snapshot) as f:
+                objects = json.load(f)
+            args.dry_run = True
+        else:
+            api_base_url = os.environ.get("NETBOX_API_BASE_URL", None)
+            api_token = os.environ.get("NETBOX_API_TOKEN", None)
+            bgp_announcement_community = os.environ.get("BGP_ANNOUNCEMENT_COMMUNITY", None)
+            if ((api_base_url is None) or (api_token is None) or (bgp_announcement_community is None)):
+                logger.error("Missing NETBOX_API_BASE_URL or NETBOX_API_TOKEN or BGP_ANNOUNCEMENT_COMMUNITY variables in environment")
+                exit(1)
+            api = te.connect(api_base_url, api_token, sslverify)
+            objects = te.snapshot(api, bgp_announcement_community)
+            logger.info("{} announcements fetched in {}".format(len(objects), datetime.datetime.now() - t0))
+            if args.save:
+                with open(args.save, "w") as f:
+                    json.dump(objects, f)
+        report = run(te, api, objects, action, kind, target, settings["local_asn"], select,
+                     args.dry_run, logger, args.batch or te.BULK_BATCH)
+        report["seconds"]["total"] = (datetime.datetime.now() - t0).total_seconds()
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            for c in report["changes"]:
+                print("{:<45} {}".format(c["prefix"], " ".join(["+" + a for a in c["added"]] +
+                                                              ["-" + r for r in c["removed"]])))
+            print("{} prefixes {} ({} selected), {} tags created, {} requests, {:.2f}s".format(
+                len(report["changes"]), "to change" if args.dry_run else "changed", report["selected"],
+                len(report["tags_created"]), report["requests"], report["seconds"]["total"]))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    except:
+        logger.exception("main()")
@@ -17,10 +17,14 @@ PEERING_MANAGER_API_TOKEN
 via environment variables to connect to the REST API of peering-manager.
 Prints in stdout a json serialized dictionary structure containing the BGP
 peering information for a minion.
+
+With --impactindex, the router, connections and sessions of the minion are
+also recorded in the change impact index of the bgp-te-tool states (see
+salt/states/_utils/impact_index.py).
 """
 
 __author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
-__version__ = "1.2"
+__version__ = "1.3"
 
 from os.path import basename
 from logging.handlers import SysLogHandler
@@ -35,7 +39,12 @@ import requests
 from urllib3.exceptions import InsecureRequestWarning
 
 #----------------- Global settings -------------------
-#GLOBALVAR =
+# Salt states directory (as salt_templates.STATES_DIR). salt_templates and
+# export_policy (and jinja2 with them) are only imported by the options
+# that need them, the pillar itself only needs requests
+STATES_DIR = "/srv/salt/states"
+# Change impact index module, relative to the Salt states directory
+IMPACT_INDEX_MODULE = "_utils/impact_index.py"
 #----------------- Global settings -------------------
 
 def isIPv4(a):
@@ -179,7 +188,7 @@ def get_router_info(minion_id, api_base_url, api_token, logger, sslverify=True):
     return routers
 
 
-def get_peering_sessions(routers, api_base_url, api_token, logger, sslverify=True):
+def get_peering_sessions(routers, api_base_url, api_token, logger, sslverify=True, sessions=None):
     """
     Gets the direct and internet exchange sessions for a router.
 
@@ -198,6 +207,9 @@ def get_peering_sessions(routers, api_base_url, api_token, logger, sslverify=Tru
                           authentication
       logger: a logger object for the program
       sslverify (boolean): whether to check the server cert
+      sessions (list): if given, a record of every session is appended
+                       (peering-manager id, BGP group, peer ASN, export policy)
+                       for the change impact index
 
     Returns:
       peerings (dictionary): a dictionary containing the peerings of the router.
@@ -350,6 +362,9 @@ def get_peering_sessions(routers, api_base_url, api_token, logger, sslverify=Tru
                 else:
                     bgp_group = "AS{}-GROUP".format(p_i["peer_asn"])
                 logger.debug("peering: {} group: {}".format(p_i, bgp_group))
+                if sessions is not None:
+                    sessions.append({"id": "direct:{}".format(p["id"]), "group": bgp_group,
+                                     "peer_asn": p_i["peer_asn"], "policy": p_i["export_policy"]})
                 pos = None
                 for i in peerings["bgp"]["direct-peerings"]:
                     if i["group"] == bgp_group:
@@ -410,6 +425,9 @@ def get_peering_sessions(routers, api_base_url, api_token, logger, sslverify=Tru
                     p_i["multihop_ttl"] = p["multihop_ttl"]
                     p_i["is_route_server"] = p["is_route_server"]
                     logger.debug("IX peering: {} group: {}".format(p_i, bgp_group))
+                    if sessions is not None:
+                        sessions.append({"id": "ix:{}".format(p["id"]), "group": bgp_group,
+                                         "peer_asn": p_i["peer_asn"], "policy": p_i["export_policy"]})
                     pos = None
                     for i in peerings["bgp"]["internet-exchange-peerings"]:
                         if i["group"] == bgp_group:
@@ -438,6 +456,10 @@ if __name__ == '__main__':
                         this level of severity")
     parser.add_argument("-s", "--sslnoverify", help="Skip verification of peering-manager server \
                         certificates (eg use of self signed certs)", action="store_true")
+    parser.add_argument("-i", "--impactindex", help="Record the peering-manager objects of the \
+                        minion in this change impact index directory")
+    parser.add_argument("-d", "--states", default=STATES_DIR,
+                        help="The Salt states directory (default: %(default)s)")
     parser.add_argument('minion_id', help='The Salt proxy minion id', type=str)
 
     args = parser.parse_args()
@@ -477,7 +499,23 @@ if __name__ == '__main__':
             logger.debug("PEERING_MANAGER_API_BASE_URL: {}".format(api_base_url))
             logger.debug("PEERING_MANAGER_API_TOKEN: {}".format(api_token))
             routers = get_router_info(args.minion_id, api_base_url, api_token, logger, sslverify)
-            extpillar_data = get_peering_sessions(routers, api_base_url, api_token, logger, sslverify)
+            sessions = [] if args.impactindex else None
+            extpillar_data = get_peering_sessions(routers, api_base_url, api_token, logger, sslverify, sessions)
+            # a router that could not be fetched is not recorded
+            if args.impactindex and routers:
+                # the index is best effort, the pillar is printed regardless
+                try:
+                    import salt_templates
+                    import export_policy
+                    impact_index = salt_templates.load_states_module(args.states, IMPACT_INDEX_MODULE)
+                    settings = export_policy.load_template_settings(
+                        os.path.join(args.states, "ebgp-peerings", "templates", "config.j2"))
+                    impact_index.update_settings(args.impactindex, settings)
+                    if impact_index.update_minion(args.impactindex, args.minion_id,
+                                                  impact_index.minion_record(routers[0], sessions)):
+                        logger.info("Impact index record of {} updated".format(args.minion_id))
+                except Exception:
+                    logger.exception("impact index")
         print(json.dumps(extpillar_data))
         delta_t = datetime.datetime.now() - t0
         logger.info("Execution time: {0}".format(delta_t))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""
+Program that provisions in netbox the community tags of the traffic
+engineering (TE) actions of the out policies, for every peer ASN and
+location:
+
+  <local_asn>:40:<asn>, 41, 61, 62, 63       for every peer ASN
+  <local_asn>:400:<code>, 601, 602, 603      for every location code
+  <local_asn>:40:0, <local_asn>:400:0        (no-announce to any peer / location)
+
+The peer ASNs are the autonomous systems of peering-manager (except the
+affiliated ones, ie ours) and the location codes the geolocations of the
+ebgp-peerings config.j2 (local_asn comes from there too). The tags of
+netbox are fetched once (paginated), the missing tags are created with bulk
+POST requests. Running it again creates nothing.
+
+Expects
+
+PEERING_MANAGER_API_BASE_URL
+PEERING_MANAGER_API_TOKEN
+NETBOX_API_BASE_URL
+NETBOX_API_TOKEN
+
+via environment variables.
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import os
+import json
+import requests
+from urllib3.exceptions import InsecureRequestWarning
+import salt_templates
+import export_policy
+
+#----------------- Global settings -------------------
+# TE module, relative to the Salt states directory
+ANNOUNCEMENT_TE_MODULE = "_utils/announcement_te.py"
+#----------------- Global settings -------------------
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Provision the TE community tags of peers and locations in netbox")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-s", "--sslnoverify", help="Skip verification of netbox / peering-manager \
+                        server certificates (eg use of self signed certs)", action="store_true")
+    parser.add_argument("-d", "--states", default=salt_templates.STATES_DIR,
+                        help="The Salt states directory (default: %(default)s)")
+    parser.add_argument("-a", "--asn", type=int, action="append", default=[],
+                        help="Provision the tags of this peer ASN too (repeat)")
+    parser.add_argument("-P", "--no-peering-manager", action="store_true",
+                        help="Do not read the peer ASNs from peering-manager (only --asn)")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Report the missing tags \
+                        without creating them")
+    parser.add_argument("-b", "--batch", type=int, default=None, help="Tags per bulk POST request \
+                        (default: announcement_te.BULK_BATCH)")
+    parser.add_argument("-j", "--json", action="store_true", help="Print the report as json")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    sslverify = True
+    if args.sslnoverify:
+        sslverify = False
+    # Suppress only the single warning from urllib3 needed.
+    requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        pm_api_base_url = os.environ.get("PEERING_MANAGER_API_BASE_URL", None)
+        if (pm_api_base_url is not None) and (not pm_api_base_url.endswith("/")):
+            pm_api_base_url = "{0}/".format(pm_api_base_url)
+        pm_api_token = os.environ.get("PEERING_MANAGER_API_TOKEN", None)
+        api_base_url = os.environ.get("NETBOX_API_BASE_URL", None)
+        api_token = os.environ.get("NETBOX_API_TOKEN", None)
+        if ((api_base_url is None) or (api_token is None) or
+                (not args.no_peering_manager and ((pm_api_base_url is None) or (pm_api_token is None)))):
+            logger.error("Missing NETBOX_API_BASE_URL, NETBOX_API_TOKEN, PEERING_MANAGER_API_BASE_URL or PEERING_MANAGER_API_TOKEN variables in environment")
+            exit(1)
+        te = salt_templates.load_states_module(args.states, ANNOUNCEMENT_TE_MODULE)
+        settings = export_policy.load_template_settings(
+            os.path.join(args.states, "ebgp-peerings", "templates", "config.j2"))
+        local_asn = settings["local_asn"]
+        asns = set(args.asn)
+        if not args.no_peering_manager:
+            asns.update(te.peer_asns(pm_api_base_url, pm_api_token, sslverify))
+        asns.discard(local_asn)
+        locations = settings.get("geolocations", {})
+        wanted = te.action_tags(local_asn, asns, locations.values())
+        logger.info("{} peer ASNs, {} locations: {} TE tags".format(len(asns), len(locations), len(wanted)))
+        api = te.connect(api_base_url, api_token, sslverify)
+        existing = api.tags()
+        slugs = {slug: name for name, slug in existing.items()}
+        missing = []
+        conflicts = []
+        for n in wanted:
+            if n in existing:
+                continue
+            # tag slugs are unique, a tag of another name may hold it
+            if te.slugify(n) in slugs:
+                conflicts.append({"name": n, "slug": te.slugify(n), "tag": slugs[te.slugify(n)]})
+                continue
+            missing.append(n)
+        for c in conflicts:
+            logger.error("Tag {name} cannot be created: slug {slug} is used by tag {tag}".format(**c))
+            err_code = 1
+        created = 0
+        if missing and not args.dry_run:
+            created = api.create_tags(missing, args.batch or te.BULK_BATCH)
+            logger.info("{} tags created with {} requests".format(len(missing), created))
+        report = {"asns": len(asns), "locations": len(locations), "wanted": len(wanted),
+                  "existing": len(wanted) - len(missing) - len(conflicts), "missing": missing,
+                  "conflicts": conflicts, "requests": created,
+                  "seconds": (datetime.datetime.now() - t0).total_seconds()}
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            for n in missing:
+                print(n)
+            print("{} TE tags ({} peer ASNs, {} locations), {} {}, {} conflicts, {:.2f}s".format(
+                report["wanted"], report["asns"], report["locations"], len(missing),
+                "missing" if args.dry_run else "created", len(conflicts), report["seconds"]))
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
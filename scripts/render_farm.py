@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+"""
+Program that renders the configuration of the bgp-announcements and
+ebgp-peerings states for the whole fleet offline, with no salt-master and
+no devices.
+
+It takes a pillar snapshot of every minion: a directory with one
+<minion_id>.json pillar file per minion, or a single json file mapping
+minion ids to pillars, as printed by
+
+  salt '*' pillar.items --out json --static > pillars.json
+
+The state templates are rendered with stubbed Salt functions (see
+salt_templates.py) across a process pool, one worker per core. The
+configuration of every router is written to <output>/<minion_id>/<state>.conf
+and a summary of the routers whose output changed (compared with the
+previous artifacts in the output directory, or a baseline directory) is
+printed and written to <output>/summary.json. With --diff, the differences
+of a changed configuration are written to <state>.diff ('show | compare'
+format).
+
+Example:
+
+  render_farm.py -p pillars.json -o /tmp/fleet
+  render_farm.py -d salt/states -p snapshots/ -o /tmp/fleet-new -b /tmp/fleet --diff
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import os
+import json
+import hashlib
+import multiprocessing
+import salt_templates
+
+#----------------- Global settings -------------------
+STATES = ["bgp-announcements", "ebgp-peerings"]
+# Per worker process state, set by init_worker
+WORKER = {}
+#----------------- Global settings -------------------
+
+def load_snapshot(path):
+    """
+    Get the minions of a pillar snapshot
+
+    Args:
+      path (string): a directory of <minion_id>.json files or a json file
+                     mapping minion ids to pillars
+
+    Returns:
+      list of (minion_id, pillar file or pillar dictionary) tuples
+
+    Raises:
+      IOError, ValueError on unreadable snapshots
+    """
+
+    if os.path.isdir(path):
+        return [(f[:-5], os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.endswith(".json")]
+    with open(path) as f:
+        pillars = json.load(f)
+    return sorted(pillars.items())
+
+
+def init_worker(states_dir, output, baseline, states, with_diff):
+    """
+    Initialize a worker process: one jinja2 environment (and template cache)
+    per process
+    """
+
+    WORKER["env"] = salt_templates.get_environment(states_dir)
+    WORKER["output"] = output
+    WORKER["baseline"] = baseline
+    WORKER["states"] = states
+    WORKER["junos_config"] = None
+    if with_diff:
+        WORKER["junos_config"] = salt_templates.load_states_module(states_dir, "_utils/junos_config.py")
+
+
+def render_minion(task):
+    """
+    Render the states of a minion and write its artifacts
+
+    Args:
+      task (tuple): minion id, pillar file or pillar dictionary
+
+    Returns:
+      (minion_id, dictionary) tuple: per state the status (new, changed,
+      unchanged, error), the size and the sha256 of the configuration
+    """
+
+    minion, pillar = task
+    env = WORKER["env"]
+    result = {}
+    try:
+        if isinstance(pillar, str):
+            with open(pillar) as f:
+                pillar = json.load(f)
+        salt_templates.set_pillar(env, pillar)
+    except Exception as e:
+        return (minion, {s: {"status": "error", "error": "pillar: {}".format(e)} for s in WORKER["states"]})
+    out_dir = os.path.join(WORKER["output"], minion)
+    os.makedirs(out_dir, exist_ok=True)
+    for state in WORKER["states"]:
+        try:
+            config = salt_templates.render_state(env, state)
+        except Exception as e:
+            result[state] = {"status": "error", "error": "{}: {}".format(type(e).__name__, e)}
+            continue
+        path = os.path.join(out_dir, "{}.conf".format(state))
+        previous = None
+        try:
+            with open(os.path.join(WORKER["baseline"], minion, "{}.conf".format(state))) as f:
+                previous = f.read()
+        except (IOError, OSError):
+            pass
+        with open(path, "w") as f:
+            f.write(config)
+        if previous is None:
+            status = "new"
+        elif previous == config:
+            status = "unchanged"
+        else:
+            status = "changed"
+        diff_path = os.path.join(out_dir, "{}.diff".format(state))
+        if status == "changed" and WORKER["junos_config"]:
+            jc = WORKER["junos_config"]
+            with open(diff_path, "w") as f:
+                f.write("\n".join(jc.compare(jc.parse(previous), jc.parse(config))) + "\n")
+        elif os.path.exists(diff_path):
+            os.remove(diff_path)
+        result[state] = {"status": status, "bytes": len(config),
+                         "sha256": hashlib.sha256(config.encode("utf-8")).hexdigest()}
+    return (minion, result)
+
+
+def render_fleet(minions, states_dir, output, baseline=None, states=STATES, workers=None, with_diff=False):
+    """
+    Render the states of all minions across a process pool
+
+    Args:
+      minions (list of tuples): from load_snapshot
+      states_dir (string): the Salt states directory
+      output (string): the artifacts directory
+      baseline (string): directory of the artifacts to compare with
+                         (default: the previous artifacts in output)
+      states (list of strings): the states to render
+      workers (int): number of processes (default: number of cores)
+      with_diff (boolean): write the differences of changed configurations
+
+    Returns:
+      summary (dictionary)
+
+    Return example:
+      {'routers': 300, 'states': {...}, 'changed': ['vmx1-lab'], 'errors': [],
+       'results': {'vmx1-lab': {'ebgp-peerings': {'status': 'changed', ...}}}}
+    """
+
+    baseline = baseline or output
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    chunksize = max(1, len(minions) // (workers * 4))
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(states_dir, output, baseline, states, with_diff)) as pool:
+        for minion, result in pool.imap_unordered(render_minion, minions, chunksize):
+            results[minion] = result
+    counts = {s: {} for s in states}
+    for minion, result in results.items():
+        for s, r in result.items():
+            counts[s][r["status"]] = counts[s].get(r["status"], 0) + 1
+    return {"routers": len(results),
+            "states": counts,
+            "changed": sorted([m for m, r in results.items()
+                               if any(v["status"] in ["changed", "new"] for v in r.values())]),
+            "errors": sorted([m for m, r in results.items() if any(v["status"] == "error" for v in r.values())]),
+            "results": dict(sorted(results.items()))}
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Render the BGP states of the whole fleet offline")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-d", "--states", default=salt_templates.STATES_DIR,
+                        help="The Salt states directory (default: %(default)s)")
+    parser.add_argument("-p", "--pillars", required=True,
+                        help="Pillar snapshot: a directory of <minion_id>.json files or a json \
+                        file mapping minion ids to pillars")
+    parser.add_argument("-o", "--output", required=True, help="The artifacts directory")
+    parser.add_argument("-b", "--baseline", help="Directory of the artifacts to compare with \
+                        (default: the previous artifacts in the output directory)")
+    parser.add_argument("-g", "--group", action="append", choices=STATES,
+                        help="Render only this state (can be repeated)")
+    parser.add_argument("-w", "--workers", type=int, help="Number of processes (default: number of cores)")
+    parser.add_argument("-D", "--diff", action="store_true", help="Write the differences of the \
+                        changed configurations")
+    parser.add_argument("-j", "--json", help="Print the summary as json", action="store_true")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        minions = load_snapshot(args.pillars)
+        logger.debug("Rendering {} minions".format(len(minions)))
+        summary = render_fleet(minions, args.states, args.output, args.baseline,
+                               args.group or STATES, args.workers, args.diff)
+        delta_t = datetime.datetime.now() - t0
+        summary["seconds"] = delta_t.total_seconds()
+        with open(os.path.join(args.output, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print("Routers:  {} ({:.2f} sec)".format(summary["routers"], summary["seconds"]))
+            for s, counts in summary["states"].items():
+                print("{}: {}".format(s, ", ".join(["{} {}".format(v, k) for k, v in sorted(counts.items())])))
+            print("Changed:  {}".format(" ".join(summary["changed"]) or "-"))
+            if summary["errors"]:
+                print("Errors:   {}".format(" ".join(summary["errors"])))
+                for m in summary["errors"]:
+                    for s, r in summary["results"][m].items():
+                        if r["status"] == "error":
+                            print("  {} {}: {}".format(m, s, r["error"]))
+        if summary["errors"]:
+            err_code = 1
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")
@@ -0,0 +1,172 @@
+"""
+Module that renders the Salt state templates (peerings.j2, announcements.j2)
+outside of Salt, for offline tools.
+
+It provides a jinja2 environment over the Salt states directory with the
+Salt specific filters the templates use (regex_replace, is_ipv4, is_ipv6,
+json) and stubs of the Salt functions they call (pillar.get,
+cp.stat_file). The salt and pillar template globals are the same objects
+for all renders: set_pillar() replaces the pillar data they refer to, so
+templates and imported template modules cached by jinja2 see the pillar of
+the minion being rendered.
+
+Example:
+
+  env = get_environment("/srv/salt/states")
+  set_pillar(env, json.load(open("vmx1-lab.json")))
+  config = render_state(env, "ebgp-peerings")
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+import importlib.util
+import ipaddress
+import json
+import os
+import re
+
+import jinja2
+
+#----------------- Global settings -------------------
+# State -> template rendered by the state
+STATE_TEMPLATES = {
+    "bgp-announcements": "bgp-announcements/templates/announcements.j2",
+    "ebgp-peerings": "ebgp-peerings/templates/peerings.j2",
+}
+# Default location of the Salt states (salt-master container)
+STATES_DIR = "/srv/salt/states"
+#----------------- Global settings -------------------
+
+
+def regex_replace(txt, rgx, val, ignorecase=False, multiline=False):
+    """
+    The Salt regex_replace jinja filter
+    """
+
+    flag = 0
+    if ignorecase:
+        flag |= re.I
+    if multiline:
+        flag |= re.M
+    return re.compile(rgx, flag).sub(val, txt)
+
+
+def is_ipv4(value):
+    """
+    The Salt is_ipv4 jinja filter
+    """
+
+    try:
+        return isinstance(ipaddress.ip_interface(value), ipaddress.IPv4Interface)
+    except ValueError:
+        return False
+
+
+def is_ipv6(value):
+    """
+    The Salt is_ipv6 jinja filter
+    """
+
+    try:
+        return isinstance(ipaddress.ip_interface(value), ipaddress.IPv6Interface)
+    except ValueError:
+        return False
+
+
+def pillar_get(pillar, key, default="", delimiter=":"):
+    """
+    The Salt pillar.get function: traverse nested dictionaries with a
+    delimited key
+
+    Args:
+      pillar (dictionary): the pillar data
+      key (string): eg bgp:direct-peerings
+      default: the value returned if the key is not found
+
+    Returns:
+      the value of the key or default
+    """
+
+    d = pillar
+    for k in key.split(delimiter):
+        if isinstance(d, dict) and k in d:
+            d = d[k]
+        else:
+            return default
+    return d
+
+
+def get_environment(states_dir=STATES_DIR):
+    """
+    Get a jinja2 environment that renders the Salt state templates
+
+    Args:
+      states_dir (string): the Salt states directory (file_roots)
+
+    Returns:
+      jinja2.Environment
+    """
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(states_dir),
+                             extensions=["jinja2.ext.do"])
+    env.filters.update({"regex_replace": regex_replace, "is_ipv4": is_ipv4,
+                        "is_ipv6": is_ipv6, "json": json.dumps})
+    pillar = {}
+
+    def stat_file(path, saltenv="base", octal=True):
+        return os.path.isfile(os.path.join(states_dir, path.replace("salt://", "", 1)))
+
+    salt = {
+        "pillar.get": lambda key, default="", delimiter=":": pillar_get(pillar, key, default, delimiter),
+        "cp.stat_file": stat_file,
+    }
+    env.globals.update({"salt": salt, "pillar": pillar})
+    return env
+
+
+def set_pillar(env, pillar):
+    """
+    Set the pillar data the templates of an environment render with
+
+    Args:
+      env (jinja2.Environment): an environment from get_environment
+      pillar (dictionary): the pillar of a minion
+    """
+
+    env.globals["pillar"].clear()
+    env.globals["pillar"].update(pillar)
+
+
+def render_state(env, state):
+    """
+    Render the template of a state with the current pillar
+
+    Args:
+      env (jinja2.Environment): an environment from get_environment
+      state (string): bgp-announcements or ebgp-peerings
+
+    Returns:
+      string (the JunOS configuration)
+    """
+
+    return env.get_template(STATE_TEMPLATES[state]).render()
+
+
+def load_states_module(states_dir, path):
+    """
+    Load a python module shipped with the Salt states (eg _utils/junos_config.py)
+
+    Args:
+      states_dir (string): the Salt states directory
+      path (string): path of the module relative to states_dir
+
+    Returns:
+      module
+    """
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(states_dir, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
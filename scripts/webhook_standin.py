@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Program that stands in for netbox or peering-manager webhooks, to test the
+event driven apply of the bgp-te-tool states without editing objects in
+the applications.
+
+It posts object change webhooks, in the netbox / peering-manager format
+
+  {"event": "updated", "timestamp": ..., "model": "prefix", "username": ...,
+   "request_id": ..., "data": {...}, "snapshots": {"prechange": {...},
+   "postchange": {...}}}
+
+to the salt-api webhook endpoint (/hook/bgpte/<source>), signed with the
+webhook secret (X-Hook-Signature: hex HMAC-SHA512 of the body) if one is
+given in the BGPTE_WEBHOOK_SECRET environment variable. A burst of edits is
+sent with --count / --interval, to see the changes coalesce in a single
+apply.
+
+Example:
+
+  webhook_standin.py -s netbox -m prefix -i 34 --post '{"id": 34, "prefix": "192.0.2.0/24", "tags": [{"name": "AS65000:3:1999"}]}'
+  webhook_standin.py -s peering-manager -m autonomoussystem -i 3 --pre '{"asn": 65100}' --post '{"asn": 65100}'
+  webhook_standin.py -s netbox -f recorded_webhooks.json -n 5 -w 0.5
+"""
+
+__author__ = "Kostas Zorbadelos <kzorba@nixly.net>"
+__version__ = "1.0"
+
+from os.path import basename
+from logging.handlers import SysLogHandler
+import logging
+import argparse
+import datetime
+import sys
+import os
+import json
+import time
+import uuid
+import hmac
+import hashlib
+import requests
+from urllib3.exceptions import InsecureRequestWarning
+
+#----------------- Global settings -------------------
+# salt-api (rest_cherrypy) webhook endpoint of the salt-master container
+HOOK_URL = "https://localhost:8080/hook/bgpte"
+SOURCES = ["netbox", "peering-manager"]
+EVENTS = ["created", "updated", "deleted"]
+#----------------- Global settings -------------------
+
+def make_payload(event, model, object_id, pre=None, post=None, username="webhook-standin"):
+    """
+    Build a webhook body as sent by netbox / peering-manager
+
+    Args:
+      event (string): created, updated or deleted
+      model (string): the object model (eg prefix, directpeeringsession)
+      object_id (int): the object id
+      pre (dictionary): the object before the change
+      post (dictionary): the object after the change
+
+    Returns:
+      dictionary
+    """
+
+    data = dict(post if event != "deleted" and post else pre or {})
+    data["id"] = object_id
+    if event != "deleted" and post is not None:
+        post = dict(post, id=object_id)
+    return {"event": event,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "model": model,
+            "username": username,
+            "request_id": str(uuid.uuid4()),
+            "data": data,
+            "snapshots": {"prechange": pre, "postchange": None if event == "deleted" else post}}
+
+
+def sign(body, secret):
+    """
+    Get the X-Hook-Signature of a webhook body (hex HMAC-SHA512)
+    """
+
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+
+
+def send(url, payload, logger, secret=None, sslverify=True):
+    """
+    Post a webhook
+
+    Args:
+      url (string): the webhook endpoint
+      payload (dictionary): the webhook body
+      logger (logging.Logger): the logger
+      secret (string): the webhook secret (the body is signed if given)
+      sslverify (boolean): whether to check the server cert
+
+    Returns:
+      int (the HTTP status code)
+    """
+
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Hook-Signature"] = sign(body, secret)
+    r = requests.post(url, data=body, headers=headers, verify=sslverify)
+    logger.debug("{} {} {}: {}".format(payload["event"], payload["model"], payload["data"].get("id"),
+                                       r.status_code))
+    return r.status_code
+
+
+# Main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Stand in for netbox / peering-manager webhooks")
+    parser.add_argument("-v", "--version", action="version", version="%(prog)s: version {0}".format(__version__))
+    parser.add_argument("-c", "--logconsole", help="Provide extra logging to the console of the \
+                        program. Syslog facility local1 is used at all times", action="store_true")
+    parser.add_argument("-l", "--loglevel", type=str,
+                        choices=['debug', 'info', 'warning', 'error'],
+                        default='info',
+                        help="Set log level. Only log messages with at least \
+                        this level of severity")
+    parser.add_argument("-u", "--url", default=HOOK_URL, help="The salt-api webhook endpoint, \
+                        /<source> is appended (default: %(default)s)")
+    parser.add_argument("-s", "--source", choices=SOURCES, default="netbox",
+                        help="The application the webhook stands in for (default: %(default)s)")
+    parser.add_argument("-m", "--model", help="The model of the changed object (eg prefix)")
+    parser.add_argument("-i", "--id", type=int, help="The id of the changed object")
+    parser.add_argument("-e", "--event", choices=EVENTS, default="updated",
+                        help="The change (default: %(default)s)")
+    parser.add_argument("--pre", help="The object before the change (json)")
+    parser.add_argument("--post", help="The object after the change (json)")
+    parser.add_argument("-f", "--file", help="Send the webhook bodies of a json file (a body or a \
+                        list of bodies) instead")
+    parser.add_argument("-n", "--count", type=int, default=1, help="Number of times the webhooks \
+                        are sent (default: %(default)s)")
+    parser.add_argument("-w", "--interval", type=float, default=0, help="Seconds between \
+                        webhooks (default: %(default)s)")
+    parser.add_argument("-k", "--sslnoverify", help="Skip verification of the salt-api server \
+                        certificate", action="store_true")
+    parser.add_argument("-p", "--print", help="Print the webhook bodies instead of sending them",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    # create logger
+    logger = logging.getLogger(basename(__file__))
+    logger.setLevel(getattr(logging, args.loglevel.upper()))
+    # create handler(s). We use syslog and console if requested
+    sh = SysLogHandler(facility='local1')
+    sh.setLevel(logging.DEBUG)
+    syslogformatter = logging.Formatter('%(name)s - %(levelname)s :: %(message)s')
+    sh.setFormatter(syslogformatter)
+    logger.addHandler(sh)
+    if args.logconsole:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        consoleformatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s :: %(message)s', '%Y-%m-%d %H:%M:%S')
+        ch.setFormatter(consoleformatter)
+        logger.addHandler(ch)
+    requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+    try:
+        err_code = 0
+        t0 = datetime.datetime.now()
+        if args.file:
+            with open(args.file) as f:
+                payloads = json.load(f)
+            if isinstance(payloads, dict):
+                payloads = [payloads]
+        elif args.model and args.id is not None:
+            payloads = None
+        else:
+            parser.error("either --file or --model and --id are required")
+        url = "{}/{}".format(args.url.rstrip("/"), args.source)
+        secret = os.environ.get("BGPTE_WEBHOOK_SECRET")
+        for n in range(args.count):
+            for payload in payloads or [make_payload(args.event, args.model, args.id,
+                                                     json.loads(args.pre) if args.pre else None,
+                                                     json.loads(args.post) if args.post else None)]:
+                if args.print:
+                    print(json.dumps(payload))
+                    continue
+                status = send(url, payload, logger, secret, not args.sslnoverify)
+                if status != requests.codes.ok:
+                    logger.error("{} returned {}".format(url, status))
+                    err_code = 1
+                if args.interval:
+                    time.sleep(args.interval)
+        delta_t = datetime.datetime.now() - t0
+        logger.info("Execution time: {0}".format(delta_t))
+        exit(err_code)
+    except SystemExit as e:
+        sys.exit(e.code)
+    except:
+        logger.exception("main()")